@@ -0,0 +1,292 @@
+'''
+Cisco Unity Connection samples client-side micro-benchmarks
+
+Times the local hot paths of the samples, with no network access, so the
+effect of a change to request building or response parsing can be measured:
+
+* multipart-*: building and streaming a CUMI POST /vmrest/messages body
+  (cumi_multipart.MessageBody) for 64 KB to 16 MB audio files
+* cuni-subscribe-*: rendering a CUNI subscribe envelope for 1 and 500 users
+* cuni-parse-*: lxml parsing of CUNI notification payloads (parseEvents)
+* decode-*: JSON decoding and singleton normalisation of synthetic CUPI
+  listings (cuc_response), with and without field projection
+* location-objectid: ObjectId extraction from a Location header
+
+For each benchmark the best time per call over `--repeat` runs and the peak
+memory allocated during one call (tracemalloc) are reported.  Results can be
+saved as a baseline, and later runs compared with it - the run fails (exit
+status 1) if any benchmark is slower, or allocates more, than the baseline
+by more than the threshold:
+
+    python cuc_benchmarks.py --save benchmarks.json
+    ...make changes...
+    python cuc_benchmarks.py --compare benchmarks.json --time-threshold 0.2
+
+Timings depend on the machine, so compare against a baseline saved on the
+same one.  All input data is generated deterministically.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import struct
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import uuid
+from cumi_multipart import MessageBody
+from cuni_subscription_manager import buildSubscribeEnvelope
+from cuni_event_pipeline import parseEvents
+import cuc_response
+
+NOTIFY_EVENT = '''
+        <ns1:messageEvent>
+            <ns1:eventType>NEW_MESSAGE</ns1:eventType>
+            <ns1:subscriptionId>{subscriptionId}</ns1:subscriptionId>
+            <ns1:mailboxId>{mailboxId}</ns1:mailboxId>
+            <ns1:userGuid>{userGuid}</ns1:userGuid>
+            <ns1:messageId>0:{messageId}</ns1:messageId>
+            <ns1:eventTime>2022-02-01T12:00:00Z</ns1:eventTime>
+        </ns1:messageEvent>'''
+
+NOTIFY_ENVELOPE = '''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+<soapenv:Body>
+    <ns1:notifyMessageEvent xmlns:ns1="http://unity.cisco.com/messageeventservice/event">{events}
+    </ns1:notifyMessageEvent>
+</soapenv:Body>
+</soapenv:Envelope>'''
+
+# Stand-in for a requests Response: decode() keeps the parsed body on the
+# response, so each call needs a fresh one
+class FakeResponse:
+
+    def __init__( self, content, headers = None ):
+        self.content = content
+        self.headers = headers or {}
+
+# Same input data on every run
+def syntheticIds( seed, count ):
+    rng = random.Random( seed )
+    return [ str( uuid.UUID( int = rng.getrandbits( 128 ), version = 4 ) ) for _ in range( count ) ]
+
+def userListing( count ):
+    users = [ {
+        'URI': f'/vmrest/users/{ objectId }',
+        'ObjectId': objectId,
+        'Alias': f'benchUser{ index:06d}',
+        'FirstName': 'Bench',
+        'LastName': f'User { index }',
+        'DisplayName': f'Bench User { index }',
+        'DtmfAccessId': str( 700000000 + index ),
+        'IsTemplate': 'false',
+        'CosObjectId': objectId,
+        'PhoneSystemURI': f'/vmrest/phonesystems/{ objectId }' }
+        for index, objectId in enumerate( syntheticIds( count, count ) ) ]
+    # Like CUC, a single item is a singleton rather than a list
+    return json.dumps( { '@total': str( count ), 'User': users[ 0 ] if count == 1 else users } ).encode( 'utf-8' )
+
+def notification( count ):
+    ids = syntheticIds( count, count )
+    return NOTIFY_ENVELOPE.format( events = ''.join( NOTIFY_EVENT.format(
+        subscriptionId = ids[ 0 ], mailboxId = f'benchUser{ index:06d}', userGuid = objectId, messageId = objectId )
+        for index, objectId in enumerate( ids ) ) ).encode( 'utf-8' )
+
+# A 16-bit mono 8Khz PCM WAV file of about `size` bytes
+def writeWav( path, size ):
+    dataSize = size - 44
+    with open( path, 'wb' ) as f:
+        f.write( b'RIFF' + struct.pack( '<I', 36 + dataSize ) + b'WAVEfmt ' +
+            struct.pack( '<IHHIIHH', 16, 1, 1, 8000, 16000, 2, 16 ) + b'data' + struct.pack( '<I', dataSize ) )
+        f.write( random.Random( size ).getrandbits( 8 * dataSize ).to_bytes( dataSize, 'little' ) )
+
+# Benchmarks: name -> function of the scratch directory, returning the callable to time
+BENCHMARKS = {}
+
+def benchmark( name ):
+    def register( setup ):
+        BENCHMARKS[ name ] = setup
+        return setup
+    return register
+
+MESSAGE = json.dumps( { 'Subject': 'benchMessage', 'Priority': 'Normal', 'Sensitivity': 'Normal',
+    'ReadReceiptRequested': False, 'Secure': True } )
+
+def multipartBenchmark( size ):
+    def setup( directory ):
+        path = os.path.join( directory, f'audio{ size }.wav' )
+        writeWav( path, size )
+        recipients = { 'Recipient': [ { 'Type': 'TO', 'Address': { 'UserGuid': syntheticIds( 0, 1 )[ 0 ] } } ] }
+        # Build the body and consume it the way requests does: length, then chunks
+        def run():
+            body = MessageBody( MESSAGE, recipients, path )
+            length = len( body )
+            for chunk in body:
+                length -= len( chunk )
+            return length
+        return run
+    return setup
+
+for label, size in ( ( '64k', 64 * 1024 ), ( '1m', 1024 * 1024 ), ( '16m', 16 * 1024 * 1024 ) ):
+    benchmark( f'multipart-{ label }' )( multipartBenchmark( size ) )
+
+def subscribeBenchmark( count ):
+    def setup( directory ):
+        ids = syntheticIds( count, count )
+        expiration = datetime.datetime( 2022, 2, 1, tzinfo = datetime.timezone.utc )
+        return lambda: buildSubscribeEnvelope( ids, 'http://10.0.0.1:5000/incomingMessages', expiration )
+    return setup
+
+benchmark( 'cuni-subscribe-1' )( subscribeBenchmark( 1 ) )
+benchmark( 'cuni-subscribe-500' )( subscribeBenchmark( 500 ) )
+
+def parseBenchmark( count ):
+    def setup( directory ):
+        payload = notification( count )
+        return lambda: parseEvents( payload )
+    return setup
+
+benchmark( 'cuni-parse-1' )( parseBenchmark( 1 ) )
+benchmark( 'cuni-parse-200' )( parseBenchmark( 200 ) )
+
+def decodeBenchmark( count, fields = None ):
+    def setup( directory ):
+        content = userListing( count )
+        return lambda: cuc_response.page( FakeResponse( content ), 'User', fields )
+    return setup
+
+benchmark( 'decode-singleton' )( decodeBenchmark( 1 ) )
+benchmark( 'decode-500' )( decodeBenchmark( 500 ) )
+benchmark( 'decode-5000' )( decodeBenchmark( 5000 ) )
+benchmark( 'decode-5000-fields' )( decodeBenchmark( 5000, ( 'ObjectId', 'Alias', 'DtmfAccessId' ) ) )
+
+@benchmark( 'location-objectid' )
+def locationBenchmark( directory ):
+    response = FakeResponse( b'', { 'Location': f'https://cuc.example.com/vmrest/users/{ syntheticIds( 0, 1 )[ 0 ] }' } )
+    return lambda: cuc_response.objectIdFromLocation( response )
+
+# Best seconds per call over `repeat` runs, each long enough (>= 0.2s) to time reliably
+def timeCall( function, repeat ):
+    timer = timeit.Timer( function )
+    number, _ = timer.autorange()
+    return min( timer.repeat( repeat = repeat, number = number ) ) / number
+
+# Peak bytes allocated by Python during one call.  Occasionally a call
+# allocates more (e.g. a cache being refilled), so the least of a few is kept
+def peakMemory( function, calls = 3 ):
+    peaks = []
+    for _ in range( calls ):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            function()
+            peaks.append( tracemalloc.get_traced_memory()[ 1 ] )
+        finally:
+            tracemalloc.stop()
+    return min( peaks )
+
+def formatTime( seconds ):
+    if seconds >= 1e-3:
+        return f'{ seconds * 1e3 :.2f} ms'
+    return f'{ seconds * 1e6 :.2f} us'
+
+def run( names, repeat ):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in names:
+            function = BENCHMARKS[ name ]( directory )
+            # Warm up (file cache, lazily created parsers...)
+            function()
+            results[ name ] = { 'seconds': timeCall( function, repeat ), 'peakBytes': peakMemory( function ) }
+            print( f'{ name :<22} { formatTime( results[ name ][ "seconds" ] ) :>12} { results[ name ][ "peakBytes" ] / 1024 :>10.1f} KiB' )
+    return results
+
+# Benchmarks slower or bigger than the baseline by more than the thresholds
+def compare( results, baseline, timeThreshold, memoryThreshold ):
+    regressions = []
+    print( f'\n{ "benchmark" :<22} { "time" :>9} { "memory" :>9}' )
+    for name, result in results.items():
+        previous = baseline.get( name )
+        if not previous:
+            print( f'{ name :<22} (not in baseline)' )
+            continue
+        timeChange = result[ 'seconds' ] / previous[ 'seconds' ] - 1
+        memoryChange = result[ 'peakBytes' ] / previous[ 'peakBytes' ] - 1 if previous[ 'peakBytes' ] else 0
+        flags = []
+        if timeChange > timeThreshold:
+            flags.append( 'SLOWER' )
+        if memoryChange > memoryThreshold:
+            flags.append( 'MORE MEMORY' )
+        if flags:
+            regressions.append( name )
+        print( f'{ name :<22} { timeChange :>+9.1%} { memoryChange :>+9.1%} { " ".join( flags ) }' )
+    return regressions
+
+def main( argv = None ):
+    parser = argparse.ArgumentParser( description = 'Run the client-side micro-benchmarks' )
+    parser.add_argument( '--filter', help = 'Only run benchmarks whose name contains this' )
+    parser.add_argument( '--repeat', type = int, default = 5, help = 'Timing runs per benchmark, the best is kept (default: 5)' )
+    parser.add_argument( '--save', help = 'Save the results as a baseline JSON file' )
+    parser.add_argument( '--compare', help = 'Compare the results with this baseline JSON file' )
+    parser.add_argument( '--time-threshold', type = float, default = 0.25,
+        help = 'Allowed slowdown vs the baseline, as a fraction (default: 0.25)' )
+    parser.add_argument( '--memory-threshold', type = float, default = 0.1,
+        help = 'Allowed peak memory increase vs the baseline, as a fraction (default: 0.1)' )
+    args = parser.parse_args( argv )
+
+    names = [ name for name in BENCHMARKS if not args.filter or args.filter in name ]
+    print( f'\nPython { platform.python_version() }, JSON backend: { cuc_response.BACKEND }\n' )
+    print( f'{ "benchmark" :<22} { "time/call" :>12} { "peak memory" :>14}' )
+    results = run( names, args.repeat )
+
+    if args.save:
+        with open( args.save, 'w', encoding = 'utf-8' ) as f:
+            json.dump( {
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'jsonBackend': cuc_response.BACKEND,
+                'results': results }, f, indent = 2 )
+        print( f'\nBaseline saved to { args.save }' )
+
+    if args.compare:
+        with open( args.compare, encoding = 'utf-8' ) as f:
+            baseline = json.load( f )
+        if baseline.get( 'jsonBackend' ) != cuc_response.BACKEND:
+            print( f'\nNote: the baseline used the { baseline.get( "jsonBackend" ) } JSON backend' )
+        regressions = compare( results, baseline[ 'results' ], args.time_threshold, args.memory_threshold )
+        if regressions:
+            # Timings are noisy: run the regressed benchmarks again, keeping the
+            # best results, before reporting them
+            print( '\nRe-running the regressed benchmarks\n' )
+            for name, result in run( regressions, args.repeat * 2 ).items():
+                results[ name ] = { key: min( value, results[ name ][ key ] ) for key, value in result.items() }
+            regressions = compare( { name: results[ name ] for name in regressions }, baseline[ 'results' ],
+                args.time_threshold, args.memory_threshold )
+        if regressions:
+            print( f'\n{ len( regressions ) } regressions: { ", ".join( regressions ) }\n' )
+            sys.exit( 1 )
+        print( '\nNo regressions\n' )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+'''
+Cisco Unity Connection samples command line
+
+Single entry point for running the samples from scripts, cron jobs or shell
+loops.  Settings are read from .env once, and the samples run without
+pausing between steps unless --interactive is given:
+
+    python cuc_cli.py add-user
+    python cuc_cli.py send-message --timing
+    python cuc_cli.py set-smtp-device --interactive
+    python cuc_cli.py subscribe --port 5000
+
+Only the modules needed by the chosen subcommand are imported (e.g. Flask
+and lxml for `subscribe`, NumPy only when AUDIO_TRANSCODE is set), so
+startup stays short.  --timing prints the startup (CLI + subcommand import)
+and run times to stderr; for a per-module breakdown use:
+
+    python -X importtime cuc_cli.py add-user
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import time
+startTime = time.perf_counter()
+
+import argparse
+import importlib
+import os
+import sys
+
+# Subcommand -> ( sample module, description ).  Modules are imported only
+# when their subcommand runs
+COMMANDS = {
+    'add-user': ( 'cupi_add_user', 'Create / delete a test user' ),
+    'send-message': ( 'cumi_send_message', 'Create a test user, send it a message, clean up' ),
+    'set-smtp-device': ( 'cupi_add_update_user_notificationdevice', "Create a test user and update its SMTP notification device" ),
+    'subscribe': ( 'cuni_notification_logger', 'Subscribe for CUNI mailbox events and log incoming notifications' ) }
+
+def parseArgs( argv ):
+    parser = argparse.ArgumentParser( description = 'Run the Unity Connection API samples' )
+    parser.add_argument( '--env', default = '.env', help = 'Settings file (default: .env)' )
+    parser.add_argument( '--interactive', action = 'store_true', help = 'Pause for Enter between steps' )
+    parser.add_argument( '--timing', action = 'store_true', help = 'Print startup and run times to stderr' )
+    subparsers = parser.add_subparsers( dest = 'command', required = True, metavar = 'command' )
+    for name, ( module, description ) in COMMANDS.items():
+        subparser = subparsers.add_parser( name, help = description, description = description )
+        if name == 'subscribe':
+            subparser.add_argument( '--host', default = '0.0.0.0', help = 'Callback listener address (default: 0.0.0.0)' )
+            subparser.add_argument( '--port', type = int, help = 'Callback listener port (default: APP_PORT in .env)' )
+    return parser.parse_args( argv )
+
+def run( args ):
+    moduleName = COMMANDS[ args.command ][ 0 ]
+    importStart = time.perf_counter()
+    module = importlib.import_module( moduleName )
+    runStart = time.perf_counter()
+    if args.timing:
+        print( f'Startup: { ( runStart - startTime ) * 1000 :.0f} ms (CLI { ( importStart - startTime ) * 1000 :.0f} ms,'
+            f' { moduleName } import { ( runStart - importStart ) * 1000 :.0f} ms)', file = sys.stderr )
+    try:
+        if args.command == 'subscribe':
+            # Importing the logger subscribes; serve the callbacks until interrupted
+            module.app.run( host = args.host, port = args.port or int( os.getenv( 'APP_PORT', 5000 ) ) )
+        else:
+            module.main( interactive = args.interactive )
+    finally:
+        if args.timing:
+            print( f'Run: { ( time.perf_counter() - runStart ) * 1000 :.0f} ms', file = sys.stderr )
+
+def main( argv = None ):
+    args = parseArgs( argv )
+
+    # Read the settings once, before any sample module is imported
+    from dotenv import load_dotenv
+    load_dotenv( args.env, override = True )
+
+    run( args )
+
+if __name__ == '__main__':
+    main()
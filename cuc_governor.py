@@ -0,0 +1,364 @@
+'''
+Cisco Unity Connection adaptive request concurrency governor
+
+CUC throttles REST API traffic, answering 429 (or 503 while overloaded) with
+a Retry-After header.  Governor limits the number of requests in flight per
+endpoint class (CUPI provisioning, CUMI mailbox, CUNI subscriptions) using
+AIMD - additive increase, multiplicative decrease:
+
+* each class starts at `initial` requests in flight
+* while responses arrive within `latencyTarget` and the limit is in use, the
+  limit grows by about one request per round trip, up to the class budget
+* a 429/503 or timeout cuts the limit by `decrease` (once per congestion
+  event), and Retry-After pauses the whole class for that long
+* throttled requests (and timed out idempotent ones) are retried, up to
+  `retries` times
+
+so that bulk jobs settle near the server's actual capacity.  The Session pool
+(cuc_session_pool.py) sends every request through its Governor; for aiohttp
+use AsyncGovernor:
+
+    http = GovernedClient( aiohttp.ClientSession( ... ), AsyncGovernor() )
+    async with http.get( url ) as resp:
+        ...
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import datetime
+import os
+import random
+import threading
+import time
+from requests.exceptions import Timeout
+
+THROTTLE_STATUSES = ( 429, 503 )
+
+# Timed out requests are only retried if repeating them is harmless
+IDEMPOTENT_METHODS = ( 'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE' )
+
+# Default maximum requests in flight per endpoint class
+DEFAULT_BUDGETS = { 'cupi': 16, 'cumi': 32, 'cuni': 4 }
+
+# Endpoint class of a request URL: CUMI mailbox operations, CUNI
+# MessageEventService SOAP requests, or CUPI provisioning
+def endpointClass( url ):
+    path = urlsplit( url ).path.lower()
+    if path.startswith( ( '/vmrest/mailbox/', '/vmrest/messages' ) ):
+        return 'cumi'
+    if path.startswith( '/messageeventservice' ):
+        return 'cuni'
+    return 'cupi'
+
+# Retry-After is either delay-seconds or an HTTP date
+def retryAfterSeconds( value ):
+    if not value:
+        return None
+    try:
+        return max( 0.0, float( value ) )
+    except ValueError:
+        pass
+    try:
+        retryTime = parsedate_to_datetime( value )
+    except ( TypeError, ValueError ):
+        return None
+    return max( 0.0, ( retryTime - datetime.datetime.now( tz = datetime.timezone.utc ) ).total_seconds() )
+
+# A request body can be re-sent if it's absent, in memory, or an iterable
+# which produces a fresh iterator each time (e.g. MessageBody)
+def isReplayable( body ):
+    if body is None or isinstance( body, ( bytes, str ) ):
+        return True
+    try:
+        return iter( body ) is not body
+    except TypeError:
+        return hasattr( body, '__aiter__' )
+
+class AimdState:
+
+    def __init__( self, name, initial = 4, minimum = 1, maximum = 32, increase = 1.0, decrease = 0.5,
+            latencyTarget = 2.0 ):
+        self.name = name
+        self.limit = float( min( initial, maximum ) )
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latencyTarget = latencyTarget
+        self.inFlight = 0
+        self.blockedUntil = 0.0
+        self.lastDecrease = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.decreases = 0
+
+    # Seconds until another request may start: 0 now, None when waiting for
+    # a request in flight to finish
+    def delay( self, now ):
+        if now < self.blockedUntil:
+            return self.blockedUntil - now
+        if self.inFlight >= int( self.limit ):
+            return None
+        return 0
+
+    def started( self ):
+        self.inFlight += 1
+        self.requests += 1
+        return time.monotonic()
+
+    def finished( self, startTime, throttled, latency ):
+        saturated = self.inFlight >= int( self.limit )
+        self.inFlight -= 1
+        if throttled:
+            self.throttled += 1
+            # Requests already in flight when the limit was cut report the
+            # same congestion, so only cut once for them
+            if startTime >= self.lastDecrease:
+                self.limit = max( self.minimum, self.limit * self.decrease )
+                self.lastDecrease = time.monotonic()
+                self.decreases += 1
+        elif latency <= self.latencyTarget and saturated:
+            # About +increase per round trip when running at the limit
+            self.limit = min( self.maximum, self.limit + self.increase / self.limit )
+
+    def backOff( self, seconds ):
+        self.blockedUntil = max( self.blockedUntil, time.monotonic() + seconds )
+
+    def stats( self ):
+        return {
+            'limit': round( self.limit, 2 ),
+            'inFlight': self.inFlight,
+            'requests': self.requests,
+            'throttled': self.throttled,
+            'decreases': self.decreases }
+
+class AimdLimiter( AimdState ):
+
+    def __init__( self, *args, **kwargs ):
+        super().__init__( *args, **kwargs )
+        self.condition = threading.Condition()
+
+    # Block until a request may start, returns its start time
+    def acquire( self ):
+        with self.condition:
+            while True:
+                delay = self.delay( time.monotonic() )
+                if delay == 0:
+                    return self.started()
+                self.condition.wait( delay )
+
+    def release( self, startTime, throttled = False, latency = 0.0 ):
+        with self.condition:
+            self.finished( startTime, throttled, latency )
+            self.condition.notify_all()
+
+    def block( self, seconds ):
+        with self.condition:
+            self.backOff( seconds )
+
+# asyncio is imported by the async classes themselves, so the requests based
+# samples don't pay for loading it
+class AsyncAimdLimiter( AimdState ):
+
+    def __init__( self, *args, **kwargs ):
+        import asyncio
+        super().__init__( *args, **kwargs )
+        self.condition = asyncio.Condition()
+
+    async def acquire( self ):
+        import asyncio
+        async with self.condition:
+            while True:
+                delay = self.delay( time.monotonic() )
+                if delay == 0:
+                    return self.started()
+                try:
+                    await asyncio.wait_for( self.condition.wait(), delay )
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release( self, startTime, throttled = False, latency = 0.0 ):
+        async with self.condition:
+            self.finished( startTime, throttled, latency )
+            self.condition.notify_all()
+
+    def block( self, seconds ):
+        self.backOff( seconds )
+
+class Governor:
+
+    limiterClass = AimdLimiter
+
+    # budgets: endpoint class -> maximum requests in flight
+    # initial: starting requests in flight per class
+    # latencyTarget: seconds - slower responses don't grow the limit
+    # retries: attempts after the first for throttled/timed out requests
+    # backoff: base delay (seconds) when no Retry-After is given, doubled per retry
+    def __init__( self, budgets = None, initial = 4, latencyTarget = 2.0, retries = 5, backoff = 1.0 ):
+        self.budgets = dict( DEFAULT_BUDGETS, **( budgets or {} ) )
+        self.initial = initial
+        self.latencyTarget = latencyTarget
+        self.retries = retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.limiters = {}
+        self.retried = 0
+
+    def limiter( self, url ):
+        name = endpointClass( url )
+        with self.lock:
+            limiter = self.limiters.get( name )
+            if limiter is None:
+                limiter = self.limiters[ name ] = self.limiterClass(
+                    name,
+                    initial = self.initial,
+                    maximum = self.budgets.get( name, max( self.budgets.values() ) ),
+                    latencyTarget = self.latencyTarget )
+            return limiter
+
+    # Exponential backoff with jitter, capped at 30 seconds
+    def backoffDelay( self, attempt ):
+        return min( 30.0, self.backoff * 2 ** attempt ) * random.uniform( 0.5, 1.0 )
+
+    # Send a requests PreparedRequest via send( request, **kwargs ) (an
+    # HTTPAdapter's send), within the concurrency limit, retrying throttled
+    # and timed out requests
+    def send( self, send, request, **kwargs ):
+        limiter = self.limiter( request.url )
+        replayable = isReplayable( request.body )
+        attempt = 0
+        while True:
+            startTime = limiter.acquire()
+            try:
+                response = send( request, **kwargs )
+            except Timeout:
+                limiter.release( startTime, throttled = True )
+                if attempt >= self.retries or request.method not in IDEMPOTENT_METHODS or not replayable:
+                    raise
+                time.sleep( self.backoffDelay( attempt ) )
+            except Exception:
+                # Not congestion (e.g. certificate errors, connection refused):
+                # free the slot without adjusting the limit, and fail right away
+                limiter.release( startTime, latency = float( 'inf' ) )
+                raise
+            else:
+                throttled = response.status_code in THROTTLE_STATUSES
+                limiter.release( startTime, throttled, time.monotonic() - startTime )
+                if not throttled or attempt >= self.retries or not replayable:
+                    return response
+                delay = retryAfterSeconds( response.headers.get( 'Retry-After' ) )
+                limiter.block( self.backoffDelay( attempt ) if delay is None else delay )
+                # Read the (small) error body, so the connection goes back to the pool
+                response.content
+                response.close()
+            attempt += 1
+            with self.lock:
+                self.retried += 1
+
+    def stats( self ):
+        with self.lock:
+            limiters = list( self.limiters.values() )
+            retried = self.retried
+        return { 'retried': retried, 'classes': { limiter.name: limiter.stats() for limiter in limiters } }
+
+class AsyncGovernor( Governor ):
+
+    limiterClass = AsyncAimdLimiter
+
+    # Async context manager for an aiohttp request: the same limits and
+    # retries as Governor.send()
+    @asynccontextmanager
+    async def request( self, http, method, url, **kwargs ):
+        import asyncio
+        limiter = self.limiter( url )
+        replayable = isReplayable( kwargs.get( 'data' ) )
+        attempt = 0
+        while True:
+            startTime = await limiter.acquire()
+            try:
+                response = await http.request( method, url, **kwargs )
+            except asyncio.TimeoutError:
+                await limiter.release( startTime, throttled = True )
+                if attempt >= self.retries or method not in IDEMPOTENT_METHODS or not replayable:
+                    raise
+                await asyncio.sleep( self.backoffDelay( attempt ) )
+            except Exception:
+                await limiter.release( startTime, latency = float( 'inf' ) )
+                raise
+            else:
+                throttled = response.status in THROTTLE_STATUSES
+                await limiter.release( startTime, throttled, time.monotonic() - startTime )
+                if not throttled or attempt >= self.retries or not replayable:
+                    break
+                delay = retryAfterSeconds( response.headers.get( 'Retry-After' ) )
+                limiter.block( self.backoffDelay( attempt ) if delay is None else delay )
+                await response.read()
+                response.release()
+            attempt += 1
+            with self.lock:
+                self.retried += 1
+        try:
+            yield response
+        finally:
+            response.release()
+
+# aiohttp ClientSession wrapper sending every request through an AsyncGovernor,
+# with the usual request/get/post/put/delete methods
+class GovernedClient:
+
+    def __init__( self, http, governor ):
+        self.http = http
+        self.governor = governor
+
+    def request( self, method, url, **kwargs ):
+        return self.governor.request( self.http, method, url, **kwargs )
+
+    def get( self, url, **kwargs ):
+        return self.request( 'GET', url, **kwargs )
+
+    def post( self, url, **kwargs ):
+        return self.request( 'POST', url, **kwargs )
+
+    def put( self, url, **kwargs ):
+        return self.request( 'PUT', url, **kwargs )
+
+    def delete( self, url, **kwargs ):
+        return self.request( 'DELETE', url, **kwargs )
+
+# GOVERNOR_BUDGETS format: cupi=16,cumi=32,cuni=4
+def parseBudgets( value ):
+    budgets = {}
+    for item in ( value or '' ).split( ',' ):
+        if '=' in item:
+            name, limit = item.split( '=', 1 )
+            budgets[ name.strip().lower() ] = int( limit )
+    return budgets
+
+# Create a governor configured by the GOVERNOR_* settings in .env, or None if
+# GOVERNOR=False
+def governorFromEnv( governorClass = Governor ):
+    if os.getenv( 'GOVERNOR', 'True' ) != 'True':
+        return None
+    return governorClass(
+        budgets = parseBudgets( os.getenv( 'GOVERNOR_BUDGETS' ) ),
+        initial = int( os.getenv( 'GOVERNOR_INITIAL_LIMIT', 4 ) ),
+        latencyTarget = float( os.getenv( 'GOVERNOR_LATENCY_TARGET', 2.0 ) ),
+        retries = int( os.getenv( 'GOVERNOR_RETRIES', 5 ) ) )
@@ -0,0 +1,164 @@
+'''
+Cisco Unity Connection resumable job journal
+
+Provisioning a user is a sequence of steps (create the user, set its
+password, configure its SMTP notification device...), and a bulk job runs
+that sequence for thousands of users.  Journal is a write-ahead checkpoint
+log: the outcome of each completed step (e.g. the new user's ObjectId) is
+appended to a local NDJSON file and fsync'ed before the job moves on.
+
+When a job is restarted with the same journal, Job.run() skips every step
+already recorded, feeding the journaled results (ObjectIds) to the remaining
+steps, so a crashed 50k user run resumes without repeating any requests:
+
+    journal = Journal( 'users.journal' )
+    job = Job( journal, [ ( 'create', createUser ), ( 'password', setPassword ) ] )
+    context = job.run( alias, { 'user': user } )
+
+Concurrent workers share fsyncs (group commit): a worker whose record was
+already covered by another worker's fsync doesn't issue its own.  A record
+truncated by a crash is ignored on reload.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import json
+import os
+import threading
+import time
+
+class Journal:
+
+    # path: journal file, or None for an in-memory journal (no resume)
+    # sync: fsync each record before returning from record()
+    def __init__( self, path = None, sync = True ):
+        self.path = path
+        self.sync = sync
+        self.lock = threading.Lock()
+        self.syncLock = threading.Lock()
+        # ( key, step ) -> result dict
+        self.completed = {}
+        self.loaded = 0
+        self.written = 0
+        self.syncs = 0
+        # Sequence numbers of the last record written / made durable
+        self.writeSequence = 0
+        self.syncedSequence = 0
+        self.file = None
+        if path:
+            partial = self.load()
+            self.file = open( path, 'a', encoding = 'utf-8' )
+            # Terminate a truncated last record, so the next one starts on its own line
+            if partial:
+                self.file.write( '\n' )
+
+    # Replay the journal, returning True if it ends with a partial record
+    def load( self ):
+        try:
+            f = open( self.path, encoding = 'utf-8' )
+        except FileNotFoundError:
+            return False
+        line = ''
+        with f:
+            for line in f:
+                try:
+                    record = json.loads( line )
+                except ValueError:
+                    # Partially written record from an interrupted run
+                    continue
+                self.completed[ ( record[ 'key' ], record[ 'step' ] ) ] = record.get( 'result' ) or {}
+                self.loaded += 1
+        return bool( line ) and not line.endswith( '\n' )
+
+    # Result of a completed step, or None if it hasn't been done
+    def get( self, key, step ):
+        return self.completed.get( ( key, step ) )
+
+    def record( self, key, step, result = None ):
+        result = result or {}
+        line = json.dumps( { 'key': key, 'step': step, 'result': result, 'time': round( time.time(), 3 ) } ) + '\n'
+        with self.lock:
+            self.completed[ ( key, step ) ] = result
+            self.written += 1
+            if not self.file:
+                return
+            self.file.write( line )
+            self.file.flush()
+            self.writeSequence += 1
+            sequence = self.writeSequence
+        if self.sync:
+            self.syncTo( sequence )
+
+    # fsync unless another thread's fsync already covered this record
+    def syncTo( self, sequence ):
+        with self.syncLock:
+            if self.syncedSequence >= sequence:
+                return
+            with self.lock:
+                target = self.writeSequence
+            os.fsync( self.file.fileno() )
+            self.syncedSequence = target
+            self.syncs += 1
+
+    def stats( self ):
+        with self.lock:
+            return { 'loaded': self.loaded, 'written': self.written, 'syncs': self.syncs }
+
+    def close( self ):
+        with self.lock:
+            if self.file:
+                self.file.flush()
+                os.fsync( self.file.fileno() )
+                self.file.close()
+                self.file = None
+
+class Job:
+
+    # steps: list of ( name, function( context ) ), each returning a dict of
+    # results (e.g. { 'ObjectId': ... }) which is journaled and merged into
+    # the context for the following steps
+    def __init__( self, journal, steps ):
+        self.journal = journal
+        self.steps = steps
+        self.lock = threading.Lock()
+        self.skipped = 0
+        self.executed = 0
+
+    def isComplete( self, key ):
+        return all( self.journal.get( key, name ) is not None for name, _ in self.steps )
+
+    # Run the steps not yet journaled for this key, returning the context.
+    # If a step raises, its name is left in context[ 'failedStep' ]
+    def run( self, key, context ):
+        for name, step in self.steps:
+            done = self.journal.get( key, name )
+            if done is not None:
+                context.update( done )
+                with self.lock:
+                    self.skipped += 1
+                continue
+            try:
+                result = step( context ) or {}
+            except Exception:
+                context[ 'failedStep' ] = name
+                raise
+            self.journal.record( key, name, result )
+            context.update( result )
+            with self.lock:
+                self.executed += 1
+        return context
@@ -0,0 +1,224 @@
+'''
+Cisco Unity Connection sample flow load harness
+
+Runs the request sequences from the samples in this project repeatedly from a
+pool of worker threads, against CUC_HOSTNAME (typically cuc_stub_server.py),
+and reports overall requests/sec plus p50/p99 latency per operation:
+
+* add-user - create / delete a user (cupi_add_user.py)
+* send-message - create user, set password, address lookup, send message,
+  list inbox, delete messages, delete user (cumi_send_message.py)
+* smtp-device - get mailbox stores, create user, get/update SMTP device,
+  delete user (cupi_add_update_user_notificationdevice.py)
+
+Usage:
+
+    python cuc_load_harness.py --flow send-message --workers 16 --iterations 500
+
+Requests are also counted by how they were authenticated, separately for the
+admin and the per-user CUMI sessions: with Basic auth credentials, with the
+JSESSIONID session cookie, or re-authenticated after the session expired
+(see cuc_session_pool.py).  To measure the latency the session cookies save,
+compare a run against one with SESSION_COOKIES=False, e.g. against
+`cuc_stub_server.py --auth-latency 30`.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import sys
+import threading
+import time
+from requests.auth import HTTPBasicAuth
+from requests.exceptions import RequestException
+import urllib3
+from cumi_multipart import MessageBody
+from cumi_audio import transcode, transcodeFromEnv
+from cuc_session_pool import poolFromEnv
+from cuc_response import items, objectIdFromLocation
+
+# Edit .env file to specify your CUC address and user credentials
+from dotenv import load_dotenv
+load_dotenv( override = True )
+
+parser = argparse.ArgumentParser( description = 'Run sample request flows under load' )
+parser.add_argument( '--flow', choices = [ 'add-user', 'send-message', 'smtp-device' ], default = 'add-user' )
+parser.add_argument( '--workers', type = int, default = 8, help = 'Concurrent workers (default: 8)' )
+parser.add_argument( '--iterations', type = int, default = 100, help = 'Total flow iterations (default: 100)' )
+parser.add_argument( '--extension-start', type = int, default = 880000000,
+    help = 'First test user extension (default: 880000000)' )
+parser.add_argument( '--audio', default = 'message.wav', help = 'Audio attachment for send-message' )
+parser.add_argument( '--transcode', choices = [ 'ulaw', 'alaw' ],
+    help = 'Send an 8Khz G.711 copy of the audio attachment (default: AUDIO_TRANSCODE in .env)' )
+args = parser.parse_args()
+
+if args.transcode:
+    args.audio = transcode( args.audio, args.transcode, os.getenv( 'AUDIO_CACHE_DIR' ) or '.audio_cache' )
+else:
+    args.audio = transcodeFromEnv( args.audio )
+
+baseUrl = f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest'
+adminCredentials = HTTPBasicAuth( os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) )
+password = '0xFt3i4#%p$V'
+
+urllib3.disable_warnings( urllib3.exceptions.InsecureRequestWarning )
+
+# Latency samples (seconds) per operation, and error counts per operation/status
+latencies = defaultdict( list )
+errors = defaultdict( int )
+# Latency samples per ( 'admin'/'user', 'basic'/'cookie'/'reauth' )
+authLatencies = defaultdict( list )
+statsLock = threading.Lock()
+
+class FlowError( Exception ):
+    pass
+
+# One pooled Session per credential, all sharing the same connections
+pool = poolFromEnv( poolSize = args.workers )
+
+def getSession( credentials ):
+    session = pool.session( os.getenv( 'CUC_HOSTNAME' ), credentials.username, credentials.password )
+    session.headers[ 'Accept' ] = 'application/json'
+    return session
+
+# Issue a request, record its latency, and raise FlowError on failure
+def call( operation, credentials, method, path, **kwargs ):
+    startTime = time.perf_counter()
+    try:
+        resp = getSession( credentials ).request( method, f'{ baseUrl }{ path }', **kwargs )
+    except RequestException as err:
+        with statsLock:
+            errors[ ( operation, type( err ).__name__ ) ] += 1
+        raise FlowError( f'{ operation }: { err }' )
+    elapsed = time.perf_counter() - startTime
+    if resp.history:
+        authMode = 'reauth'
+    else:
+        authMode = 'basic' if 'Authorization' in resp.request.headers else 'cookie'
+    with statsLock:
+        latencies[ operation ].append( elapsed )
+        authLatencies[ ( 'admin' if credentials is adminCredentials else 'user', authMode ) ].append( elapsed )
+        if resp.status_code >= 400:
+            errors[ ( operation, resp.status_code ) ] += 1
+    if resp.status_code >= 400:
+        raise FlowError( f'{ operation }: Status Code:{ resp.status_code }' )
+    return resp
+
+def createUser( alias, extension ):
+    resp = call( 'POST /users', adminCredentials, 'POST', '/users',
+        params = { 'templateAlias': 'voicemailusertemplate' },
+        json = { 'Alias': alias, 'DtmfAccessId': extension } )
+    return objectIdFromLocation( resp )
+
+def deleteUser( userObjectId ):
+    call( 'DELETE /users', adminCredentials, 'DELETE', f'/users/{ userObjectId }' )
+
+def addUserFlow( index ):
+    userObjectId = createUser( f'loadUser{ index }', str( args.extension_start + index ) )
+    deleteUser( userObjectId )
+
+def sendMessageFlow( index ):
+    alias = f'loadUser{ index }'
+    userObjectId = createUser( alias, str( args.extension_start + index ) )
+    try:
+        call( 'PUT /password', adminCredentials, 'PUT', f'/users/{ userObjectId }/credential/password',
+            json = { 'Credentials': password, 'CantChange': False, 'DoesntExpire': True, 'Locked': False, 'CredMustChange': False } )
+        userCredentials = HTTPBasicAuth( alias, password )
+        resp = call( 'GET /addresses', userCredentials, 'GET', '/mailbox/addresses', params = { 'name': alias } )
+        addressObjectId = items( resp, 'Address' )[ 0 ][ 'ObjectId' ]
+        requestBody = MessageBody(
+            { 'Subject': 'loadMessage', 'Priority': 'Normal', 'Sensitivity': 'Normal', 'ReadReceiptRequested': False, 'Secure': True },
+            { 'Recipient': [ { 'Type': 'TO', 'Address': { 'UserGuid': addressObjectId } } ] },
+            args.audio )
+        call( 'POST /messages', userCredentials, 'POST', '/messages',
+            params = { 'userobjectid': userObjectId },
+            headers = { 'Content-Type': requestBody.contentType },
+            data = requestBody )
+        resp = call( 'GET /inbox/messages', userCredentials, 'GET', '/mailbox/folders/inbox/messages',
+            params = { 'userobjectid': userObjectId } )
+        for message in items( resp, 'Message' ):
+            call( 'DELETE /messages', userCredentials, 'DELETE', f'/messages/{ message[ "MsgId" ] }' )
+    finally:
+        deleteUser( userObjectId )
+
+def smtpDeviceFlow( index ):
+    call( 'GET /mailboxstores', adminCredentials, 'GET', '/mailboxstores' )
+    userObjectId = createUser( f'loadUser{ index }', str( args.extension_start + index ) )
+    try:
+        resp = call( 'GET /smtpdevices', adminCredentials, 'GET', f'/users/{ userObjectId }/notificationdevices/smtpdevices' )
+        deviceObjectId = items( resp, 'SmtpDevice' )[ 0 ][ 'ObjectId' ]
+        call( 'PUT /smtpdevices', adminCredentials, 'PUT',
+            f'/users/{ userObjectId }/notificationdevices/smtpdevices/{ deviceObjectId }',
+            json = { 'Active': True, 'SmtpAddress': 'user@abc.inc' } )
+    finally:
+        deleteUser( userObjectId )
+
+flows = { 'add-user': addUserFlow, 'send-message': sendMessageFlow, 'smtp-device': smtpDeviceFlow }
+
+def runFlow( index ):
+    try:
+        flows[ args.flow ]( index )
+        return True
+    except FlowError:
+        return False
+
+def percentile( samples, fraction ):
+    return samples[ min( len( samples ) - 1, int( len( samples ) * fraction ) ) ]
+
+print( f'\nRunning { args.iterations } x { args.flow } with { args.workers } workers against { baseUrl }\n' )
+
+startTime = time.perf_counter()
+with ThreadPoolExecutor( max_workers = args.workers ) as executor:
+    results = list( executor.map( runFlow, range( args.iterations ) ) )
+elapsed = time.perf_counter() - startTime
+
+totalRequests = sum( len( samples ) for samples in latencies.values() )
+allSamples = sorted( sample for samples in latencies.values() for sample in samples )
+
+print( f'{ "Operation":<22} { "Requests":>9} { "p50 ms":>9} { "p99 ms":>9} { "max ms":>9}' )
+for operation, samples in sorted( latencies.items() ):
+    samples.sort()
+    print( f'{ operation:<22} { len( samples ):>9} { percentile( samples, 0.5 ) * 1000:>9.1f} { percentile( samples, 0.99 ) * 1000:>9.1f} { samples[ -1 ] * 1000:>9.1f}' )
+if allSamples:
+    print( f'{ "ALL":<22} { totalRequests:>9} { percentile( allSamples, 0.5 ) * 1000:>9.1f} { percentile( allSamples, 0.99 ) * 1000:>9.1f} { allSamples[ -1 ] * 1000:>9.1f}' )
+
+print()
+for kind in ( 'admin', 'user' ):
+    modes = [ f'{ len( authLatencies[ ( kind, mode ) ] ) } { mode }'
+        f' (avg { 1000 * sum( authLatencies[ ( kind, mode ) ] ) / len( authLatencies[ ( kind, mode ) ] ) :.1f} ms)'
+        for mode in ( 'basic', 'cookie', 'reauth' ) if authLatencies[ ( kind, mode ) ] ]
+    if modes:
+        print( f'Auth ({ kind } session): { ", ".join( modes ) }' )
+
+for ( operation, status ), count in sorted( errors.items(), key = str ):
+    print( f'Errors: { operation } { status }: { count }' )
+
+print( f'\nFlows: { results.count( True ) } succeeded, { results.count( False ) } failed' )
+print( f'Connections opened: { pool.stats()[ "handshakes" ] }, sessions created: { pool.stats()[ "sessionsCreated" ] }' )
+if pool.governor:
+    governorStats = pool.governor.stats()
+    limits = ', '.join( f'{ name } { stats[ "limit" ] } ({ stats[ "throttled" ] } throttled)'
+        for name, stats in sorted( governorStats[ 'classes' ].items() ) )
+    print( f'Governor: { governorStats[ "retried" ] } retries, limits: { limits }' )
+print( f'Elapsed: { elapsed :.2f}s, { totalRequests / elapsed if elapsed else 0 :.1f} requests/sec, { len( results ) / elapsed if elapsed else 0 :.1f} flows/sec\n' )
+
+if not all( results ):
+    sys.exit( 1 )
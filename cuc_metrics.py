@@ -0,0 +1,256 @@
+'''
+Cisco Unity Connection per-endpoint HTTP metrics
+
+A requests response hook which records, per endpoint template (method plus URL
+path with ObjectIds/MsgIds replaced by {id}, e.g. 'POST /vmrest/users' or
+'DELETE /vmrest/messages/{id}'):
+
+* a latency histogram (time to response headers, Response.elapsed)
+* response counts per status code
+* request/response byte counts (from Content-Length)
+
+Metrics can be exported in Prometheus text format or as a JSON summary.
+Optionally a random sample of requests/responses is printed, with headers
+(Authorization redacted) and bodies truncated to `maxBodyBytes` - unlike a
+full dump this is usable for message sends with large audio attachments:
+
+    metrics = metricsFromEnv()
+    metrics.install( pool )
+    ...
+    metrics.report()
+
+When both metrics and sampling are disabled, install() doesn't add the hook,
+so there is no per-request cost at all.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from bisect import bisect_left
+from functools import lru_cache
+from urllib.parse import urlsplit
+import atexit
+import json
+import os
+import random
+import threading
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = ( 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0 )
+
+# Replace the variable segments of a URL path (ObjectIds, MsgIds, extensions)
+# with {id}, so requests for different objects share one endpoint
+@lru_cache( maxsize = 4096 )
+def pathTemplate( path ):
+    segments = path.split( '/' )
+    for index, segment in enumerate( segments ):
+        if len( segment ) > 32 or ':' in segment or any( c.isdigit() for c in segment ):
+            segments[ index ] = '{id}'
+    return '/'.join( segments )
+
+def endpointName( method, url ):
+    return f'{ method } { pathTemplate( urlsplit( url ).path ) }'
+
+class EndpointStats:
+
+    def __init__( self ):
+        self.count = 0
+        self.totalSeconds = 0.0
+        self.maxSeconds = 0.0
+        # Per-bucket (not cumulative) counts, the last one is +Inf
+        self.buckets = [ 0 ] * ( len( BUCKETS ) + 1 )
+        self.statuses = {}
+        self.requestBytes = 0
+        self.responseBytes = 0
+
+    def add( self, seconds, status, requestBytes, responseBytes ):
+        self.count += 1
+        self.totalSeconds += seconds
+        self.maxSeconds = max( self.maxSeconds, seconds )
+        self.buckets[ bisect_left( BUCKETS, seconds ) ] += 1
+        self.statuses[ status ] = self.statuses.get( status, 0 ) + 1
+        self.requestBytes += requestBytes
+        self.responseBytes += responseBytes
+
+    # Upper bound of the bucket containing the given fraction of samples
+    # (never more than the slowest sample seen)
+    def quantile( self, fraction ):
+        target = self.count * fraction
+        seen = 0
+        for bound, count in zip( BUCKETS, self.buckets ):
+            seen += count
+            if seen >= target:
+                return min( bound, self.maxSeconds )
+        return self.maxSeconds
+
+def contentLength( headers ):
+    try:
+        return int( headers.get( 'Content-Length' ) or 0 )
+    except ValueError:
+        return 0
+
+def truncate( body, maxBytes ):
+    if body is None:
+        return ''
+    if not isinstance( body, ( bytes, str ) ):
+        return '<streamed body>'
+    if isinstance( body, str ):
+        body = body.encode( 'utf-8' )
+    text = body[ : maxBytes ].decode( 'utf-8', errors = 'replace' )
+    if len( body ) > maxBytes:
+        text += f'... ({ len( body ) } bytes)'
+    return text
+
+def formatHeaders( headers ):
+    return '\n'.join( f'{ name }: { "<redacted>" if name.lower() == "authorization" else value }'
+        for name, value in headers.items() )
+
+class HttpMetrics:
+
+    # enabled: record per-endpoint metrics
+    # sampleRate: fraction (0-1) of requests/responses to print
+    # maxBodyBytes: body bytes printed per sampled request/response
+    # outputPath: write metrics at exit - Prometheus text for *.prom, else JSON
+    def __init__( self, enabled = True, sampleRate = 0.0, maxBodyBytes = 2048, outputPath = None ):
+        self.enabled = enabled
+        self.sampleRate = sampleRate
+        self.maxBodyBytes = maxBodyBytes
+        self.outputPath = outputPath
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        if enabled and outputPath:
+            atexit.register( self.save )
+
+    # Add the response hook to a SessionPool (all of its sessions) or a Session
+    def install( self, target ):
+        if not self.enabled and not self.sampleRate:
+            return
+        if hasattr( target, 'addHook' ):
+            target.addHook( self.responseHook )
+        else:
+            target.hooks[ 'response' ].append( self.responseHook )
+
+    def responseHook( self, response, *args, **kwargs ):
+        if self.enabled:
+            self.record( response )
+        if self.sampleRate and random.random() < self.sampleRate:
+            self.logSample( response, kwargs.get( 'stream', False ) )
+        return response
+
+    def record( self, response ):
+        request = response.request
+        endpoint = endpointName( request.method, request.url )
+        seconds = response.elapsed.total_seconds()
+        requestBytes = contentLength( request.headers )
+        responseBytes = contentLength( response.headers )
+        with self.lock:
+            stats = self.endpoints.get( endpoint )
+            if stats is None:
+                stats = self.endpoints[ endpoint ] = EndpointStats()
+            stats.add( seconds, response.status_code, requestBytes, responseBytes )
+
+    def logSample( self, response, stream = False ):
+        request = response.request
+        print( '--------------- Request/Response ---------------' )
+        print( f'{ request.method } { request.url }' )
+        print( formatHeaders( request.headers ) )
+        print( f'\n{ truncate( request.body, self.maxBodyBytes ) }\n' )
+        print( f'{ response.status_code } { response.reason } ({ response.elapsed.total_seconds() * 1000 :.1f} ms)' )
+        print( formatHeaders( response.headers ) )
+        # Hooks run before the body is read: read it now, unless the request
+        # was streamed (stream=True, e.g. attachment downloads)
+        if not stream:
+            print( f'\n{ truncate( response.content, self.maxBodyBytes ) }\n' )
+        else:
+            print( '\n(streamed body not shown)\n' )
+
+    def summary( self ):
+        with self.lock:
+            return { endpoint: {
+                'count': stats.count,
+                'meanMs': round( stats.totalSeconds / stats.count * 1000, 2 ),
+                'p50Ms': round( stats.quantile( 0.5 ) * 1000, 2 ),
+                'p99Ms': round( stats.quantile( 0.99 ) * 1000, 2 ),
+                'maxMs': round( stats.maxSeconds * 1000, 2 ),
+                'statuses': { str( status ): count for status, count in sorted( stats.statuses.items() ) },
+                'requestBytes': stats.requestBytes,
+                'responseBytes': stats.responseBytes }
+                for endpoint, stats in sorted( self.endpoints.items() ) }
+
+    def prometheus( self ):
+        histogram = [
+            '# HELP cuc_http_request_duration_seconds Time to response headers',
+            '# TYPE cuc_http_request_duration_seconds histogram' ]
+        responses = [
+            '# HELP cuc_http_responses_total Responses by status code',
+            '# TYPE cuc_http_responses_total counter' ]
+        requestBytes = [
+            '# HELP cuc_http_request_bytes_total Request body bytes sent',
+            '# TYPE cuc_http_request_bytes_total counter' ]
+        responseBytes = [
+            '# HELP cuc_http_response_bytes_total Response body bytes received',
+            '# TYPE cuc_http_response_bytes_total counter' ]
+        with self.lock:
+            for endpoint, stats in sorted( self.endpoints.items() ):
+                label = 'endpoint="' + endpoint.replace( '\\', '\\\\' ).replace( '"', '\\"' ) + '"'
+                cumulative = 0
+                for bound, count in zip( BUCKETS + ( '+Inf', ), stats.buckets ):
+                    cumulative += count
+                    histogram.append( f'cuc_http_request_duration_seconds_bucket{{{ label },le="{ bound }"}} { cumulative }' )
+                histogram.append( f'cuc_http_request_duration_seconds_sum{{{ label }}} { stats.totalSeconds }' )
+                histogram.append( f'cuc_http_request_duration_seconds_count{{{ label }}} { stats.count }' )
+                for status, count in sorted( stats.statuses.items() ):
+                    responses.append( f'cuc_http_responses_total{{{ label },status="{ status }"}} { count }' )
+                requestBytes.append( f'cuc_http_request_bytes_total{{{ label }}} { stats.requestBytes }' )
+                responseBytes.append( f'cuc_http_response_bytes_total{{{ label }}} { stats.responseBytes }' )
+        return '\n'.join( histogram + responses + requestBytes + responseBytes ) + '\n'
+
+    def save( self ):
+        if not self.outputPath:
+            return
+        with open( self.outputPath, 'w', encoding = 'utf-8' ) as f:
+            if self.outputPath.endswith( '.prom' ):
+                f.write( self.prometheus() )
+            else:
+                json.dump( self.summary(), f, indent = 2 )
+
+    # Print a per-endpoint latency table
+    def report( self ):
+        if not self.enabled:
+            return
+        summary = self.summary()
+        if not summary:
+            return
+        width = max( len( endpoint ) for endpoint in summary )
+        print( f'{ "Endpoint":<{ width }} { "Count":>7} { "p50 ms":>8} { "p99 ms":>8} { "max ms":>8} { "Sent KB":>9} { "Recv KB":>9}  Statuses' )
+        for endpoint, stats in summary.items():
+            statuses = ' '.join( f'{ status }:{ count }' for status, count in stats[ 'statuses' ].items() )
+            print( f'{ endpoint:<{ width }} { stats[ "count" ]:>7} { stats[ "p50Ms" ]:>8} { stats[ "p99Ms" ]:>8} { stats[ "maxMs" ]:>8}'
+                f' { stats[ "requestBytes" ] / 1024 :>9.1f} { stats[ "responseBytes" ] / 1024 :>9.1f}  { statuses }' )
+        print()
+
+# Create metrics configured by the METRICS_* and DEBUG settings in .env.
+# DEBUG=True prints every request/response (truncated), as logHttp() used to
+def metricsFromEnv():
+    sampleRate = os.getenv( 'METRICS_SAMPLE_RATE' )
+    if not sampleRate:
+        sampleRate = 1.0 if os.getenv( 'DEBUG' ) == 'True' else 0.0
+    return HttpMetrics(
+        enabled = os.getenv( 'METRICS' ) == 'True',
+        sampleRate = float( sampleRate ),
+        maxBodyBytes = int( os.getenv( 'METRICS_BODY_BYTES', 2048 ) ),
+        outputPath = os.getenv( 'METRICS_FILE' ) or None )
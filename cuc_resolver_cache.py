@@ -0,0 +1,220 @@
+'''
+Cisco Unity Connection alias/extension/address -> ObjectId resolution cache
+
+Most flows need ObjectIds that are only discoverable over the network: a
+user's ObjectId from an alias or extension (DtmfAccessId), a CUMI address
+ObjectId from a name, the mailbox store ObjectId...  ResolutionCache keeps
+these mappings in memory with a TTL and LRU eviction, and can snapshot them to
+disk so that repeated batch runs start warm:
+
+    cache = cacheFromEnv()
+    addressId = cache.resolve( 'address', 'testUser', lookupAddress )
+    addressIds, errors = cache.resolveMany( 'address', names, lookupAddress )
+
+Entries are keyed by a kind ('alias', 'extension', 'address', 'mailboxstore',
+...) plus a key.  When an object is deleted, or a request for it returns 404,
+every entry resolving to its ObjectId is dropped - for the latter, install
+`cache.responseHook` on a requests Session:
+
+    session.hooks[ 'response' ].append( cache.responseHook )
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import atexit
+import json
+import os
+import threading
+import time
+
+class ResolutionCache:
+
+    def __init__( self, maxSize = 100000, ttl = 3600, snapshotPath = None ):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.snapshotPath = snapshotPath
+        self.lock = threading.Lock()
+        # ( kind, key ) -> ( value, expiry epoch time ), least recently used first
+        self.entries = OrderedDict()
+        # value -> set of ( kind, key ), for invalidating by ObjectId
+        self.byValue = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if snapshotPath:
+            self.load()
+            atexit.register( self.save )
+
+    # Aliases and names are case-insensitive in CUC
+    def makeKey( self, kind, key ):
+        return ( kind, str( key ).lower() )
+
+    def _remove( self, cacheKey ):
+        value, _ = self.entries.pop( cacheKey )
+        keys = self.byValue.get( value )
+        if keys:
+            keys.discard( cacheKey )
+            if not keys:
+                del self.byValue[ value ]
+
+    def get( self, kind, key ):
+        cacheKey = self.makeKey( kind, key )
+        with self.lock:
+            entry = self.entries.get( cacheKey )
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expiry = entry
+            if expiry < time.time():
+                self._remove( cacheKey )
+                self.misses += 1
+                return None
+            self.entries.move_to_end( cacheKey )
+            self.hits += 1
+            return value
+
+    def put( self, kind, key, value, ttl = None ):
+        if value is None:
+            return
+        cacheKey = self.makeKey( kind, key )
+        expiry = time.time() + ( self.ttl if ttl is None else ttl )
+        with self.lock:
+            if cacheKey in self.entries:
+                self._remove( cacheKey )
+            self.entries[ cacheKey ] = ( value, expiry )
+            self.byValue.setdefault( value, set() ).add( cacheKey )
+            while len( self.entries ) > self.maxSize:
+                self._remove( next( iter( self.entries ) ) )
+                self.evictions += 1
+
+    def invalidate( self, kind, key ):
+        cacheKey = self.makeKey( kind, key )
+        with self.lock:
+            if cacheKey in self.entries:
+                self._remove( cacheKey )
+
+    # Drop every entry resolving to this ObjectId, e.g. after deleting the object
+    def invalidateValue( self, value ):
+        with self.lock:
+            for cacheKey in list( self.byValue.get( value, () ) ):
+                self._remove( cacheKey )
+
+    # Return the cached value, or call fetch( key ) and cache its result
+    def resolve( self, kind, key, fetch, ttl = None ):
+        value = self.get( kind, key )
+        if value is None:
+            value = fetch( key )
+            self.put( kind, key, value, ttl )
+        return value
+
+    # Resolve many keys at once: duplicates (ignoring case) are looked up once,
+    # cached keys aren't looked up at all, and the rest are fetched `workers`
+    # at a time.  fetch( key ) may return None for not found (not cached).
+    # Returns ( { key: value }, { key: exception } ) for every key given
+    def resolveMany( self, kind, keys, fetch, workers = 8, ttl = None ):
+        resolved = {}
+        errors = {}
+        # cache key -> first of the given keys with that cache key
+        missing = {}
+        for key in keys:
+            cacheKey = self.makeKey( kind, key )
+            if cacheKey in missing:
+                continue
+            value = self.get( kind, key )
+            if value is None:
+                missing[ cacheKey ] = key
+            else:
+                resolved[ cacheKey ] = value
+
+        def fetchOne( key ):
+            try:
+                value = fetch( key )
+            except Exception as err:
+                return key, None, err
+            if value is not None:
+                self.put( kind, key, value, ttl )
+            return key, value, None
+
+        with ThreadPoolExecutor( max_workers = workers ) as executor:
+            for key, value, err in executor.map( fetchOne, missing.values() ):
+                if err is None:
+                    resolved[ self.makeKey( kind, key ) ] = value
+                else:
+                    errors[ self.makeKey( kind, key ) ] = err
+
+        # Map the results back to every key as given
+        values = {}
+        failures = {}
+        for key in keys:
+            cacheKey = self.makeKey( kind, key )
+            if cacheKey in errors:
+                failures[ key ] = errors[ cacheKey ]
+            else:
+                values[ key ] = resolved[ cacheKey ]
+        return values, failures
+
+    # requests response hook: a 404 for a URL containing a cached ObjectId
+    # means the object is gone
+    def responseHook( self, response, *args, **kwargs ):
+        if response.status_code == 404:
+            for segment in urlsplit( response.url ).path.split( '/' ):
+                if segment in self.byValue:
+                    self.invalidateValue( segment )
+        return response
+
+    def stats( self ):
+        with self.lock:
+            return { 'entries': len( self.entries ), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions }
+
+    def load( self ):
+        try:
+            with open( self.snapshotPath, encoding = 'utf-8' ) as f:
+                snapshot = json.load( f )
+        except FileNotFoundError:
+            return
+        except ValueError as err:
+            print( f'Ignoring unreadable resolver cache snapshot { self.snapshotPath }: { err }' )
+            return
+        now = time.time()
+        for kind, key, value, expiry in snapshot.get( 'entries', [] ):
+            if expiry > now:
+                self.put( kind, key, value, ttl = expiry - now )
+
+    # Write the unexpired entries atomically, so an interrupted run can't
+    # leave a truncated snapshot
+    def save( self ):
+        if not self.snapshotPath:
+            return
+        now = time.time()
+        with self.lock:
+            entries = [ [ kind, key, value, expiry ]
+                for ( kind, key ), ( value, expiry ) in self.entries.items() if expiry > now ]
+        temporaryPath = f'{ self.snapshotPath }.tmp'
+        with open( temporaryPath, 'w', encoding = 'utf-8' ) as f:
+            json.dump( { 'entries': entries }, f )
+        os.replace( temporaryPath, self.snapshotPath )
+
+# Create a cache configured by the RESOLVER_CACHE_* settings in .env
+def cacheFromEnv():
+    return ResolutionCache(
+        maxSize = int( os.getenv( 'RESOLVER_CACHE_SIZE', 100000 ) ),
+        ttl = float( os.getenv( 'RESOLVER_CACHE_TTL', 3600 ) ),
+        snapshotPath = os.getenv( 'RESOLVER_CACHE_FILE' ) or None )
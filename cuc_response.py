@@ -0,0 +1,147 @@
+'''
+Cisco Unity Connection CUPI/CUMI JSON response decoding
+
+Decodes each response body once, and smooths over the CUPI/CUMI JSON quirks
+the samples otherwise work around by hand:
+
+* a collection with a single item is returned as an object, not a list (and
+  an empty collection has no key at all) - items() always returns a list
+* counts such as @total are strings
+* new objects' ObjectIds are only returned at the end of the Location header
+
+The body is parsed with orjson if it is installed (`pip install orjson`,
+about twice as fast as the json module on large listings), and remembered
+on the Response, so decoding the same response again costs nothing:
+
+    total, users = page( resp, 'User' )
+    addresses = items( resp, 'Address' )
+    userObjectId = objectIdFromLocation( resp )
+
+With `fields`, only those fields of each item are kept, in a slotted record
+object (see recordType()) rather than a dict, which keeps large listings
+small in memory:
+
+    for user in items( resp, 'User', fields = ( 'ObjectId', 'Alias' ) ):
+        print( user.Alias, user[ 'ObjectId' ] )
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import json
+import keyword
+import threading
+
+# orjson is optional: same results, faster
+try:
+    import orjson
+    loads = orjson.loads
+    BACKEND = 'orjson'
+except ImportError:
+    loads = json.loads
+    BACKEND = 'json'
+
+# Parse a response body (a requests Response, or bytes/str, e.g. from
+# aiohttp's resp.read()).  A Response's parsed body is kept on it, so it is
+# only parsed once however many times it is decoded.  Empty bodies give {}
+def decode( response ):
+    if isinstance( response, ( bytes, bytearray, memoryview, str ) ):
+        return loads( response ) if len( response ) else {}
+    body = getattr( response, '_decodedBody', None )
+    if body is None:
+        content = response.content
+        body = loads( content ) if content else {}
+        response._decodedBody = body
+    return body
+
+_recordTypes = {}
+_recordTypesLock = threading.Lock()
+
+# A class holding just these fields, created once per field list.  Records
+# support both attribute (record.Alias) and item (record[ 'Alias' ],
+# record.get( 'Alias' )) access, so they can stand in for the item dicts;
+# missing fields are None
+def recordType( fields ):
+    fields = tuple( fields )
+    with _recordTypesLock:
+        cls = _recordTypes.get( fields )
+        if cls is None:
+            # The names are pasted into generated source, so only plain
+            # identifiers are allowed - not keywords, private names, or the
+            # record's own methods (get, asDict, ...)
+            for field in fields:
+                if ( not isinstance( field, str ) or not field.isidentifier() or keyword.iskeyword( field )
+                        or field.startswith( '_' ) or hasattr( _Record, field ) ):
+                    raise ValueError( f'Invalid record field name: { field !r}' )
+            if len( set( fields ) ) != len( fields ):
+                raise ValueError( f'Duplicate record field names: { fields }' )
+            # Like namedtuple, generate an __init__ which copies each field
+            # directly - about twice as fast as a setattr() loop
+            source = 'def __init__( self, item ):\n    get = item.get\n' + ''.join(
+                f'    self.{ field } = get( { field !r} )\n' for field in fields )
+            namespace = {}
+            exec( source, namespace )
+            cls = _recordTypes[ fields ] = type( 'Record', ( _Record, ),
+                { '__slots__': fields, '__init__': namespace[ '__init__' ] } )
+    return cls
+
+class _Record:
+
+    __slots__ = ()
+
+    def __getitem__( self, field ):
+        if field not in self.__slots__:
+            raise KeyError( field )
+        return getattr( self, field )
+
+    def get( self, field, default = None ):
+        value = getattr( self, field, None ) if field in self.__slots__ else None
+        return default if value is None else value
+
+    def asDict( self ):
+        return { field: getattr( self, field ) for field in self.__slots__ }
+
+    def __repr__( self ):
+        return f'Record({ self.asDict() })'
+
+# The items of the `key` collection in a response (or decoded body), always
+# as a list, optionally projected to `fields` records
+def items( response, key, fields = None ):
+    body = response if isinstance( response, dict ) else decode( response )
+    value = body.get( key )
+    if value is None:
+        return []
+    if not isinstance( value, list ):
+        value = [ value ]
+    if fields:
+        cls = recordType( fields )
+        return [ cls( item ) for item in value ]
+    return value
+
+# The first item of a collection, or None if it is empty
+def first( response, key, fields = None ):
+    found = items( response, key, fields )
+    return found[ 0 ] if found else None
+
+# ( @total, items ) of a paged listing
+def page( response, key, fields = None ):
+    body = response if isinstance( response, dict ) else decode( response )
+    return int( body.get( '@total', 0 ) ), items( body, key, fields )
+
+# ObjectId of a newly created object, from the end of the Location header URL
+def objectIdFromLocation( response ):
+    return response.headers[ 'Location' ].rstrip( '/' ).split( '/' )[ -1 ]
@@ -0,0 +1,289 @@
+'''
+Cisco Unity Connection keyed requests Session pool
+
+Acting as many different users (admin plus one CUMI session per end user)
+with a separate requests Session each means a separate connection pool each:
+every new user costs a TCP + TLS handshake, even though the connection only
+ever talks to the same CUC host.
+
+SessionPool hands out one Session per ( host, username, password ), so each
+credential keeps its own auth and JSESSIONID cookie, but all of the sessions
+are mounted on a single shared HTTPAdapter.  Connections are therefore reused
+across users, bounded by `poolSize` per host, and counted, so it's easy to
+confirm how many handshakes a run actually needed:
+
+    pool = poolFromEnv()
+    adminSession = pool.session( host, os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) )
+    userSession = pool.session( host, 'testUser', password )
+    ...
+    print( pool.stats() )
+
+Each Session also keeps the JSESSIONID cookie CUC returns, and sends it in
+place of the Basic auth credentials (see SessionCookieAuth): a Basic auth
+request can cost CUC a full credential check - an LDAP bind for LDAP
+authenticated end users - while a session cookie request costs nothing
+extra.  Credentials are only sent to start a session, and when CUC rejects
+an expired session cookie the request is transparently resent with them.
+pool.stats() counts the requests sent each way.
+
+Sessions unused for `idleTimeout` seconds are dropped (their connections stay
+in the shared pool).  All requests are sent through an optional Governor
+(cuc_governor.py), which adapts the number of requests in flight to the
+server's throttling and retries 429/503 responses.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase, HTTPBasicAuth
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from cuc_governor import governorFromEnv
+
+# urllib3 connection pool classes which call onConnect() for every new
+# TCP (+ TLS) connection they establish
+def countingPoolClasses( onConnect ):
+
+    class CountingHTTPConnection( HTTPConnection ):
+        def connect( self ):
+            onConnect()
+            return super().connect()
+
+    class CountingHTTPSConnection( HTTPSConnection ):
+        def connect( self ):
+            onConnect()
+            return super().connect()
+
+    class CountingHTTPConnectionPool( HTTPConnectionPool ):
+        ConnectionCls = CountingHTTPConnection
+
+    class CountingHTTPSConnectionPool( HTTPSConnectionPool ):
+        ConnectionCls = CountingHTTPSConnection
+
+    return { 'http': CountingHTTPConnectionPool, 'https': CountingHTTPSConnectionPool }
+
+# Adapter counting new connections, applying a default timeout, and sending
+# requests through a Governor (concurrency limits and 429/503 retries)
+class CountingAdapter( HTTPAdapter ):
+
+    def __init__( self, poolClasses, governor = None, timeout = None, **kwargs ):
+        self.poolClasses = poolClasses
+        self.governor = governor
+        self.timeout = timeout
+        super().__init__( **kwargs )
+
+    def init_poolmanager( self, *args, **kwargs ):
+        super().init_poolmanager( *args, **kwargs )
+        self.poolmanager.pool_classes_by_scheme = self.poolClasses
+
+    def send( self, request, **kwargs ):
+        if kwargs.get( 'timeout' ) is None:
+            kwargs[ 'timeout' ] = self.timeout
+        if self.governor:
+            return self.governor.send( super().send, request, **kwargs )
+        return super().send( request, **kwargs )
+
+# Whether a request body can be sent a second time: an iterator (e.g. a
+# generator) is used up by the first attempt
+def replayable( body ):
+    if body is None or isinstance( body, ( bytes, str ) ):
+        return True
+    return hasattr( body, '__len__' ) and hasattr( body, '__iter__' ) and iter( body ) is not body
+
+# requests auth which uses the server's session cookie once there is one, and
+# Basic auth otherwise.  A 401 to a session cookie request means the session
+# expired: the request is resent once with Basic auth, which starts a new
+# session (and the response's new cookie replaces the old one).
+# onAuth( mode ) is called per request, with 'basic', 'cookie' or 'reauth'
+class SessionCookieAuth( AuthBase ):
+
+    def __init__( self, username, password, cookieName = 'JSESSIONID', onAuth = None ):
+        self.basic = HTTPBasicAuth( username, password )
+        self.cookieName = cookieName
+        self.onAuth = onAuth or ( lambda mode: None )
+
+    def isSessionCookie( self, cookie ):
+        return cookie.startswith( f'{ self.cookieName }=' )
+
+    def cookies( self, request ):
+        return [ part.strip() for part in request.headers.get( 'Cookie', '' ).split( ';' ) if part.strip() ]
+
+    def __call__( self, request ):
+        # Requests whose body couldn't be resent after a 401 always carry credentials
+        if any( self.isSessionCookie( cookie ) for cookie in self.cookies( request ) ) and replayable( request.body ):
+            request.register_hook( 'response', self.handle401 )
+            self.onAuth( 'cookie' )
+            return request
+        self.onAuth( 'basic' )
+        return self.basic( request )
+
+    def handle401( self, response, **kwargs ):
+        if response.status_code != 401 or 'Authorization' in response.request.headers:
+            return response
+        self.onAuth( 'reauth' )
+        # Release the connection before resending
+        response.content
+        response.close()
+        retry = response.request.copy()
+        # Drop the expired session cookie, keep any others
+        otherCookies = '; '.join( cookie for cookie in self.cookies( retry ) if not self.isSessionCookie( cookie ) )
+        if otherCookies:
+            retry.headers[ 'Cookie' ] = otherCookies
+        else:
+            retry.headers.pop( 'Cookie', None )
+        self.basic( retry )
+        retryResponse = response.connection.send( retry, **kwargs )
+        retryResponse.history.append( response )
+        retryResponse.request = retry
+        return retryResponse
+
+class SessionPool:
+
+    # poolSize: maximum connections kept (and, with block=True, opened) per host
+    # keepAlive: reuse connections between requests (False sends Connection: close)
+    # idleTimeout: seconds before an unused Session is dropped
+    # maxSessions: maximum number of Sessions kept, least recently used dropped first
+    # verify: requests `verify` setting for all Sessions
+    # governor: optional cuc_governor.Governor all requests are sent through
+    # timeout: default request timeout in seconds
+    # sessionCookies: send the JSESSIONID cookie instead of Basic auth when there is one
+    def __init__( self, poolSize = 10, keepAlive = True, idleTimeout = 300, maxSessions = 10000,
+            verify = True, block = True, governor = None, timeout = None, sessionCookies = True ):
+        self.keepAlive = keepAlive
+        self.sessionCookies = sessionCookies
+        self.idleTimeout = idleTimeout
+        self.maxSessions = maxSessions
+        self.verify = verify
+        self.lock = threading.Lock()
+        # key -> ( Session, last used monotonic time ), least recently used first
+        self.sessions = OrderedDict()
+        self.handshakes = 0
+        self.sessionsCreated = 0
+        self.sessionsEvicted = 0
+        # Requests sent per auth mode: 'basic', 'cookie', 'reauth'
+        self.authCounts = { 'basic': 0, 'cookie': 0, 'reauth': 0 }
+        self.governor = governor
+        self.adapter = CountingAdapter(
+            countingPoolClasses( self.countConnection ),
+            governor = governor,
+            timeout = timeout,
+            pool_connections = 4,
+            pool_maxsize = poolSize,
+            pool_block = block )
+        # Hooks/settings applied to every new Session, see addHook()
+        self.hooks = []
+
+    def countConnection( self ):
+        with self.lock:
+            self.handshakes += 1
+
+    def countAuth( self, mode ):
+        with self.lock:
+            self.authCounts[ mode ] += 1
+
+    # Register a response hook for all current and future Sessions
+    def addHook( self, hook ):
+        with self.lock:
+            self.hooks.append( hook )
+            for session, _ in self.sessions.values():
+                session.hooks[ 'response' ].append( hook )
+
+    def makeKey( self, host, username, password ):
+        # Don't keep passwords around as dict keys
+        digest = hashlib.sha256( ( password or '' ).encode( 'utf-8' ) ).hexdigest()
+        return ( host, username, digest )
+
+    def createSession( self, username, password ):
+        session = requests.Session()
+        session.mount( 'https://', self.adapter )
+        session.mount( 'http://', self.adapter )
+        session.verify = self.verify
+        if username is not None and self.sessionCookies:
+            session.auth = SessionCookieAuth( username, password, onAuth = self.countAuth )
+        elif username is not None:
+            session.auth = HTTPBasicAuth( username, password )
+        if not self.keepAlive:
+            session.headers[ 'Connection' ] = 'close'
+        for hook in self.hooks:
+            session.hooks[ 'response' ].append( hook )
+        return session
+
+    def evictIdle( self ):
+        now = time.monotonic()
+        with self.lock:
+            for key, ( session, lastUsed ) in list( self.sessions.items() ):
+                if now - lastUsed < self.idleTimeout and len( self.sessions ) <= self.maxSessions:
+                    break
+                # The adapter is shared, so don't close() the Session itself
+                del self.sessions[ key ]
+                self.sessionsEvicted += 1
+
+    # Return the Session for this host/credential, creating it if needed
+    def session( self, host, username = None, password = None ):
+        key = self.makeKey( host, username, password )
+        with self.lock:
+            entry = self.sessions.get( key )
+            if entry:
+                session = entry[ 0 ]
+                self.sessions.move_to_end( key )
+            else:
+                session = self.createSession( username, password )
+                self.sessionsCreated += 1
+            self.sessions[ key ] = ( session, time.monotonic() )
+        self.evictIdle()
+        return session
+
+    def stats( self ):
+        with self.lock:
+            stats = {
+                'sessions': len( self.sessions ),
+                'sessionsCreated': self.sessionsCreated,
+                'sessionsEvicted': self.sessionsEvicted,
+                'handshakes': self.handshakes,
+                'basicAuthRequests': self.authCounts[ 'basic' ],
+                'cookieRequests': self.authCounts[ 'cookie' ],
+                'reauthentications': self.authCounts[ 'reauth' ] }
+        if self.governor:
+            stats[ 'governor' ] = self.governor.stats()
+        return stats
+
+    def close( self ):
+        with self.lock:
+            self.sessions.clear()
+        self.adapter.close()
+
+# Create a pool configured by the SESSION_*, GOVERNOR_* and CUC_CERT settings in .env
+def poolFromEnv( **kwargs ):
+    settings = {
+        'poolSize': int( os.getenv( 'SESSION_POOL_SIZE', 10 ) ),
+        'keepAlive': os.getenv( 'SESSION_KEEP_ALIVE', 'True' ) == 'True',
+        'idleTimeout': float( os.getenv( 'SESSION_IDLE_TIMEOUT', 300 ) ),
+        'timeout': float( os.getenv( 'SESSION_TIMEOUT', 60 ) ),
+        'sessionCookies': os.getenv( 'SESSION_COOKIES', 'True' ) == 'True',
+        'governor': governorFromEnv(),
+        # If the CUC 'tomcat' certificate location is configured in .env,
+        # enable server certificate checking, else disable it
+        'verify': os.getenv( 'CUC_CERT' ) or False }
+    settings.update( kwargs )
+    return SessionPool( **settings )
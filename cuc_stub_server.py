@@ -0,0 +1,613 @@
+'''
+Local Unity Connection stand-in server for offline testing and load benchmarks
+
+Implements just enough of the CUPI/CUMI REST APIs and the CUNI
+MessageEventService used by the samples in this project to run them without
+a live CUC, keeping all state in memory:
+
+* /vmrest/users (create/list/get/delete), /credential/password
+* /vmrest/users/{id}/notificationdevices/smtpdevices
+* /vmrest/mailboxstores
+* /vmrest/mailbox/addresses
+* /vmrest/messages (send/delete), /vmrest/messages/{id}/attachments,
+  /vmrest/mailbox/folders/{folder}/messages
+* /messageeventservice/services/MessageEventService (subscribe/renew/unsubscribe),
+  posting NEW_MESSAGE/DELETED_MESSAGE notifications to subscribers' callback URLs
+
+Response latency, error rate and 429/503 throttling can be injected, and the
+number of requests processed at once capped (--capacity), to exercise client
+retry and concurrency handling.  --users pre-populates the directory with
+that many users, and --max-recipients limits the recipients per message.
+
+Like CUC, a successful Basic auth request starts a session, returned as a
+JSESSIONID cookie, and requests presenting a live session cookie instead of
+credentials skip the credential check.  --auth-latency adds the cost of that
+check (on CUC, often an LDAP bind for end users) to every request carrying
+credentials, and sessions expire after --session-timeout seconds idle.
+
+The samples always use https://, so run the server with a certificate (or
+--adhoc, which requires the `cryptography` package), then point CUC_HOSTNAME
+at it:
+
+    openssl req -x509 -newkey rsa:2048 -nodes -days 30 -subj /CN=localhost -keyout stub.key -out stub.pem
+    python cuc_stub_server.py --port 8443 --cert stub.pem --key stub.key --latency 20 --throttle-rate 0.01
+    CUC_HOSTNAME=localhost:8443 python cupi_add_user.py
+
+The admin credentials are APP_USER/APP_PASSWORD from .env (any credentials
+are accepted as admin if these are not set); end users authenticate with the
+password set via /credential/password.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+from flask import Flask, request, jsonify
+from werkzeug.serving import WSGIRequestHandler
+from lxml import etree
+import argparse
+import datetime
+import json
+import os
+import random
+import requests
+import threading
+import time
+import uuid
+
+# Edit .env file to specify the API admin user credentials
+from dotenv import load_dotenv
+load_dotenv( override = True )
+
+app = Flask( __name__ )
+
+# Fault injection settings, see the command line options below
+config = {
+    'latency': 0.0,
+    'jitter': 0.0,
+    'errorRate': 0.0,
+    'throttleRate': 0.0,
+    'unavailableRate': 0.0,
+    'retryAfter': 1,
+    'capacity': 0,
+    'maxRecipients': 0,
+    'authLatency': 0.0,
+    'sessionTimeout': 1800 }
+
+# Requests currently being processed, for the capacity limit
+inFlight = 0
+inFlightLock = threading.Lock()
+
+# In-memory CUC state, guarded by stateLock
+stateLock = threading.Lock()
+users = {}          # ObjectId -> user dict
+aliases = {}        # lower case Alias -> ObjectId
+extensions = {}     # DtmfAccessId -> ObjectId
+passwords = {}      # ObjectId -> password
+smtpDevices = {}    # user ObjectId -> SmtpDevice dict
+mailboxes = {}      # user ObjectId -> { folder: { MsgId: message dict } }
+attachments = {}    # MsgId -> [ ( content type, bytes ) ], shared by a message's recipients
+subscriptions = {}  # subscriptionId -> { resourceIds, callbackUrl, expiration }
+sessions = {}       # JSESSIONID -> [ principal, expiry time ]
+
+mailboxStore = { 'ObjectId': str( uuid.uuid4() ), 'DisplayName': 'UnityMbxDb1', 'Mounted': 'true' }
+
+# Notification callbacks are posted from a background pool
+callbackExecutor = ThreadPoolExecutor( max_workers = 4 )
+callbackSession = requests.Session()
+
+# Pre-populate the directory with `count` users (stubUser000001...), for
+# exercising exports and other directory-wide operations
+def seedUsers( count ):
+    with stateLock:
+        for index in range( 1, count + 1 ):
+            objectId = str( uuid.uuid4() )
+            alias = f'stubUser{ index:06d}'
+            extension = str( 700000000 + index )
+            aliases[ alias.lower() ] = objectId
+            extensions[ extension ] = objectId
+            users[ objectId ] = {
+                'Alias': alias,
+                'DtmfAccessId': extension,
+                'ObjectId': objectId,
+                'DisplayName': f'Stub User { index }',
+                'FirstName': 'Stub',
+                'LastName': f'User { index }',
+                'URI': f'/vmrest/users/{ objectId }' }
+            smtpDevices[ objectId ] = { 'ObjectId': str( uuid.uuid4() ), 'DisplayName': 'SMTP', 'Active': 'false', 'SmtpAddress': '' }
+            mailboxes[ objectId ] = { 'inbox': {}, 'sent': {}, 'deleted': {} }
+
+def cupiError( statusCode, code, message ):
+    return jsonify( { 'errors': { 'code': code, 'message': message } } ), statusCode
+
+# Collections with a single item are returned as a singleton, not a list,
+# just like CUC does
+def collection( key, items, total = None ):
+    body = { '@total': str( len( items ) if total is None else total ) }
+    if len( items ) == 1:
+        body[ key ] = items[ 0 ]
+    elif items:
+        body[ key ] = items
+    return jsonify( body )
+
+def page( items ):
+    rowsPerPage = request.args.get( 'rowsPerPage', type = int )
+    pageNumber = request.args.get( 'pageNumber', 1, type = int )
+    if not rowsPerPage:
+        return items
+    start = ( pageNumber - 1 ) * rowsPerPage
+    return items[ start : start + rowsPerPage ]
+
+# Check Basic auth credentials: returns 'admin', a user ObjectId, or None if
+# they are invalid
+def checkCredentials( auth ):
+    if config[ 'authLatency' ]:
+        time.sleep( config[ 'authLatency' ] )
+    adminUser = os.getenv( 'APP_USER' )
+    with stateLock:
+        objectId = aliases.get( auth.username.lower() )
+        if objectId is None:
+            if not adminUser or ( auth.username == adminUser and auth.password == os.getenv( 'APP_PASSWORD' ) ):
+                return 'admin'
+            return None
+        if passwords.get( objectId ) == auth.password:
+            return objectId
+    return None
+
+# Returns the principal of valid Basic auth credentials (starting a new
+# session unless a live session cookie was sent too) or, without credentials,
+# of a live session cookie; None if neither
+def authenticate():
+    now = time.monotonic()
+    sessionId = request.cookies.get( 'JSESSIONID' )
+    with stateLock:
+        session = sessions.get( sessionId ) if sessionId else None
+        if session and session[ 1 ] <= now:
+            del sessions[ sessionId ]
+            session = None
+        if session:
+            session[ 1 ] = now + config[ 'sessionTimeout' ]
+    auth = request.authorization
+    if not auth:
+        return session[ 0 ] if session else None
+    # Like CUC, credentials are checked whenever they are sent
+    principal = checkCredentials( auth )
+    if principal and not ( session and session[ 0 ] == principal ):
+        request.newSession = uuid.uuid4().hex.upper()
+        with stateLock:
+            if len( sessions ) >= 10000:
+                for expiredId in [ key for key, ( _, expiry ) in sessions.items() if expiry <= now ]:
+                    del sessions[ expiredId ]
+            sessions[ request.newSession ] = [ principal, now + config[ 'sessionTimeout' ] ]
+    return principal
+
+def throttled( statusCode, code, message ):
+    response = cupiError( statusCode, code, message )[ 0 ]
+    response.status_code = statusCode
+    response.headers[ 'Retry-After' ] = str( config[ 'retryAfter' ] )
+    return response
+
+@app.before_request
+def injectFaults():
+    global inFlight
+    # Like CUC, reject requests beyond the number it can process at once
+    if config[ 'capacity' ]:
+        with inFlightLock:
+            if inFlight >= config[ 'capacity' ]:
+                return throttled( 429, 'TOO_MANY_REQUESTS', 'Too many concurrent requests' )
+            inFlight += 1
+        request.admitted = True
+    delay = config[ 'latency' ] + random.uniform( 0, config[ 'jitter' ] )
+    if delay:
+        time.sleep( delay )
+    roll = random.random()
+    if roll < config[ 'throttleRate' ]:
+        return throttled( 429, 'TOO_MANY_REQUESTS', 'Request throttled' )
+    roll -= config[ 'throttleRate' ]
+    if roll < config[ 'unavailableRate' ]:
+        return throttled( 503, 'SERVICE_UNAVAILABLE', 'Service unavailable' )
+    roll -= config[ 'unavailableRate' ]
+    if roll < config[ 'errorRate' ]:
+        return cupiError( 500, 'INTERNAL_SERVER_ERROR', 'Injected error' )
+    request.principal = authenticate()
+    if request.principal is None:
+        return cupiError( 401, 'AUTHENTICATION_FAILED', 'Authentication failed' )
+
+# On a kept-alive connection, a request body left unread (e.g. by a request
+# rejected with 401/429) would be parsed as the next request: read it to the end
+@app.after_request
+def drainRequestBody( response ):
+    while request.stream.read( 65536 ):
+        pass
+    return response
+
+@app.after_request
+def setSessionCookie( response ):
+    if getattr( request, 'newSession', None ):
+        response.set_cookie( 'JSESSIONID', request.newSession, path = '/', secure = request.is_secure, httponly = True )
+    return response
+
+@app.teardown_request
+def releaseCapacity( exception ):
+    global inFlight
+    if getattr( request, 'admitted', False ):
+        with inFlightLock:
+            inFlight -= 1
+
+def requireAdmin():
+    if request.principal != 'admin':
+        return cupiError( 403, 'FORBIDDEN', 'Administrator access required' )
+    return None
+
+# The mailbox a CUMI request acts on: the authenticated user, or the
+# userobjectid parameter for admin requests
+def mailboxOwner():
+    if request.principal == 'admin':
+        return request.args.get( 'userobjectid' )
+    return request.principal
+
+# ---- CUPI users ----
+
+@app.route( '/vmrest/users', methods = [ 'POST' ] )
+def createUser():
+    denied = requireAdmin()
+    if denied: return denied
+    if not request.args.get( 'templateAlias' ):
+        return cupiError( 400, 'INVALID_PARAMETER', 'templateAlias is required' )
+    body = request.get_json( force = True )
+    if not body.get( 'Alias' ) or not body.get( 'DtmfAccessId' ):
+        return cupiError( 400, 'INVALID_PARAMETER', 'Alias and DtmfAccessId are required' )
+    with stateLock:
+        if body[ 'Alias' ].lower() in aliases or body[ 'DtmfAccessId' ] in extensions:
+            return cupiError( 400, 'DUPLICATE_OBJECT', f'Duplicate alias or extension: { body[ "Alias" ] }' )
+        objectId = str( uuid.uuid4() )
+        aliases[ body[ 'Alias' ].lower() ] = objectId
+        extensions[ body[ 'DtmfAccessId' ] ] = objectId
+        users[ objectId ] = {
+            **body,
+            'ObjectId': objectId,
+            'DisplayName': body.get( 'DisplayName', body[ 'Alias' ] ),
+            'URI': f'/vmrest/users/{ objectId }' }
+        smtpDevices[ objectId ] = { 'ObjectId': str( uuid.uuid4() ), 'DisplayName': 'SMTP', 'Active': 'false', 'SmtpAddress': '' }
+        mailboxes[ objectId ] = { 'inbox': {}, 'sent': {}, 'deleted': {} }
+    return '', 201, { 'Location': f'{ request.host_url }vmrest/users/{ objectId }' }
+
+@app.route( '/vmrest/users', methods = [ 'GET' ] )
+def listUsers():
+    denied = requireAdmin()
+    if denied: return denied
+    query = request.args.get( 'query', '' )
+    with stateLock:
+        matches = sorted( users.values(), key = lambda user: user[ 'Alias' ] )
+    # Only the (alias is X) / (dtmfaccessid is X) query forms are supported
+    if query.startswith( '(' ) and ' is ' in query:
+        field, value = query.strip( '()' ).split( ' is ', 1 )
+        key = { 'alias': 'Alias', 'dtmfaccessid': 'DtmfAccessId' }.get( field.strip().lower(), field.strip() )
+        matches = [ user for user in matches if str( user.get( key, '' ) ).lower() == value.strip().lower() ]
+    return collection( 'User', page( matches ), total = len( matches ) )
+
+@app.route( '/vmrest/users/<objectId>', methods = [ 'GET', 'DELETE' ] )
+def user( objectId ):
+    denied = requireAdmin()
+    if denied: return denied
+    with stateLock:
+        if objectId not in users:
+            return cupiError( 404, 'NOT_FOUND', f'User not found: { objectId }' )
+        if request.method == 'GET':
+            return jsonify( users[ objectId ] )
+        removed = users.pop( objectId )
+        aliases.pop( removed[ 'Alias' ].lower(), None )
+        extensions.pop( removed[ 'DtmfAccessId' ], None )
+        passwords.pop( objectId, None )
+        smtpDevices.pop( objectId, None )
+        for sessionId in [ key for key, ( principal, _ ) in sessions.items() if principal == objectId ]:
+            del sessions[ sessionId ]
+        for folder in mailboxes.pop( objectId, {} ).values():
+            for msgId in folder:
+                attachments.pop( msgId, None )
+    return '', 204
+
+@app.route( '/vmrest/users/<objectId>/credential/password', methods = [ 'PUT' ] )
+def setPassword( objectId ):
+    denied = requireAdmin()
+    if denied: return denied
+    body = request.get_json( force = True )
+    with stateLock:
+        if objectId not in users:
+            return cupiError( 404, 'NOT_FOUND', f'User not found: { objectId }' )
+        passwords[ objectId ] = body.get( 'Credentials' )
+    return '', 204
+
+@app.route( '/vmrest/users/<objectId>/notificationdevices/smtpdevices', methods = [ 'GET' ] )
+def listSmtpDevices( objectId ):
+    denied = requireAdmin()
+    if denied: return denied
+    with stateLock:
+        if objectId not in smtpDevices:
+            return cupiError( 404, 'NOT_FOUND', f'User not found: { objectId }' )
+        return collection( 'SmtpDevice', [ smtpDevices[ objectId ] ] )
+
+@app.route( '/vmrest/users/<objectId>/notificationdevices/smtpdevices/<deviceId>', methods = [ 'PUT' ] )
+def updateSmtpDevice( objectId, deviceId ):
+    denied = requireAdmin()
+    if denied: return denied
+    body = request.get_json( force = True )
+    with stateLock:
+        device = smtpDevices.get( objectId )
+        if not device or device[ 'ObjectId' ] != deviceId:
+            return cupiError( 404, 'NOT_FOUND', f'Device not found: { deviceId }' )
+        device.update( { key: str( value ).lower() if isinstance( value, bool ) else value for key, value in body.items() } )
+    return '', 204
+
+@app.route( '/vmrest/mailboxstores', methods = [ 'GET' ] )
+def listMailboxStores():
+    denied = requireAdmin()
+    if denied: return denied
+    return collection( 'MailboxStore', [ mailboxStore ] )
+
+# ---- CUMI mailbox ----
+
+@app.route( '/vmrest/mailbox/addresses', methods = [ 'GET' ] )
+def listAddresses():
+    name = request.args.get( 'name', '' ).lower()
+    with stateLock:
+        matches = [ {
+            'ObjectId': user[ 'ObjectId' ],
+            'DisplayName': user[ 'DisplayName' ],
+            'Alias': user[ 'Alias' ],
+            'DtmfAccessId': user[ 'DtmfAccessId' ] }
+            for user in users.values()
+            if name in user[ 'Alias' ].lower() or name in user[ 'DisplayName' ].lower() ]
+    return collection( 'Address', page( matches ), total = len( matches ) )
+
+# Split a hand-built CUMI multipart body into ( content-type, content ) parts
+def multipartParts( body, boundary ):
+    parts = []
+    for part in body.split( b'--' + boundary.encode() ):
+        if not part.strip() or part.strip() == b'--':
+            continue
+        headers, _, content = part.partition( b'\r\n\r\n' )
+        contentType = ''
+        for line in headers.decode( 'latin-1' ).split( '\r\n' ):
+            if line.lower().startswith( 'content-type:' ):
+                contentType = line.split( ':', 1 )[ 1 ].strip()
+        parts.append( ( contentType, content[ : -2 ] if content.endswith( b'\r\n' ) else content ) )
+    return parts
+
+@app.route( '/vmrest/messages', methods = [ 'POST' ] )
+def sendMessage():
+    sender = mailboxOwner()
+    contentType = request.headers.get( 'Content-Type', '' )
+    if 'boundary=' not in contentType:
+        return cupiError( 400, 'INVALID_PARAMETER', 'multipart body required' )
+    parts = multipartParts( request.get_data(), contentType.split( 'boundary=', 1 )[ 1 ].strip( '"' ) )
+    jsonParts = [ json.loads( content ) for partType, content in parts if partType.startswith( 'application/json' ) ]
+    audioParts = [ ( partType, content ) for partType, content in parts if partType.startswith( 'audio/' ) ]
+    audioBytes = sum( len( content ) for _, content in audioParts )
+    if len( jsonParts ) < 2:
+        return cupiError( 400, 'INVALID_PARAMETER', 'message and recipients parts required' )
+    message, recipients = jsonParts[ 0 ], jsonParts[ 1 ].get( 'Recipient', [] )
+    if not isinstance( recipients, list ): recipients = [ recipients ]
+    if config[ 'maxRecipients' ] and len( recipients ) > config[ 'maxRecipients' ]:
+        return cupiError( 400, 'INVALID_PARAMETER', f'Too many recipients: { len( recipients ) }' )
+    delivered = []
+    with stateLock:
+        for recipient in recipients:
+            userGuid = recipient.get( 'Address', {} ).get( 'UserGuid' )
+            if userGuid not in mailboxes:
+                return cupiError( 400, 'INVALID_RECIPIENT', f'Unknown recipient: { userGuid }' )
+        for recipient in recipients:
+            userGuid = recipient[ 'Address' ][ 'UserGuid' ]
+            msgId = f'0:{ uuid.uuid4() }'
+            mailboxes[ userGuid ][ 'inbox' ][ msgId ] = {
+                'MsgId': msgId,
+                'Subject': message.get( 'Subject', '' ),
+                'Read': 'false',
+                'Priority': message.get( 'Priority', 'Normal' ),
+                'ArrivalTime': str( int( time.time() * 1000 ) ),
+                'SenderGuid': sender or '',
+                'AudioBytes': str( audioBytes ) }
+            attachments[ msgId ] = audioParts
+            delivered.append( ( userGuid, msgId ) )
+    for userGuid, msgId in delivered:
+        notify( userGuid, 'NEW_MESSAGE', msgId )
+    return '', 202
+
+@app.route( '/vmrest/mailbox/folders/<folder>/messages', methods = [ 'GET' ] )
+def listFolder( folder ):
+    owner = mailboxOwner()
+    with stateLock:
+        if owner not in mailboxes or folder not in mailboxes[ owner ]:
+            return cupiError( 404, 'NOT_FOUND', f'Folder not found: { folder }' )
+        messages = list( mailboxes[ owner ][ folder ].values() )
+    return collection( 'Message', page( messages ), total = len( messages ) )
+
+@app.route( '/vmrest/messages/<msgId>', methods = [ 'DELETE' ] )
+def deleteMessage( msgId ):
+    owner = mailboxOwner()
+    with stateLock:
+        for folder in mailboxes.get( owner, {} ).values():
+            if msgId in folder:
+                del folder[ msgId ]
+                attachments.pop( msgId, None )
+                break
+        else:
+            return cupiError( 404, 'NOT_FOUND', f'Message not found: { msgId }' )
+    notify( owner, 'DELETED_MESSAGE', msgId )
+    return '', 204
+
+# A message's attachments, if it is in the requester's mailbox
+def messageAttachments( msgId ):
+    owner = mailboxOwner()
+    with stateLock:
+        for folder in mailboxes.get( owner, {} ).values():
+            if msgId in folder:
+                return attachments.get( msgId, [] )
+    return None
+
+@app.route( '/vmrest/messages/<msgId>/attachments', methods = [ 'GET' ] )
+def listAttachments( msgId ):
+    parts = messageAttachments( msgId )
+    if parts is None:
+        return cupiError( 404, 'NOT_FOUND', f'Message not found: { msgId }' )
+    return collection( 'Attachment', [ {
+        'URI': f'/vmrest/messages/{ msgId }/attachments/{ index }',
+        'ContentType': contentType,
+        'Size': str( len( content ) ) }
+        for index, ( contentType, content ) in enumerate( parts ) ] )
+
+@app.route( '/vmrest/messages/<msgId>/attachments/<int:index>', methods = [ 'GET' ] )
+def getAttachment( msgId, index ):
+    parts = messageAttachments( msgId )
+    if parts is None or index >= len( parts ):
+        return cupiError( 404, 'NOT_FOUND', f'Attachment not found: { msgId }/{ index }' )
+    contentType, content = parts[ index ]
+    return content, 200, { 'Content-Type': contentType }
+
+# ---- CUNI MessageEventService ----
+
+NOTIFY_ENVELOPE = '''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+<soapenv:Body>
+    <ns1:notifyMessageEvent xmlns:ns1="http://unity.cisco.com/messageeventservice/event">
+        <ns1:messageEvent>
+            <ns1:eventType>{eventType}</ns1:eventType>
+            <ns1:subscriptionId>{subscriptionId}</ns1:subscriptionId>
+            <ns1:mailboxId>{mailboxId}</ns1:mailboxId>
+            <ns1:userGuid>{userGuid}</ns1:userGuid>
+            <ns1:messageId>{messageId}</ns1:messageId>
+            <ns1:eventTime>{eventTime}</ns1:eventTime>
+        </ns1:messageEvent>
+    </ns1:notifyMessageEvent>
+</soapenv:Body>
+</soapenv:Envelope>'''
+
+def postCallback( callbackUrl, envelope ):
+    try:
+        callbackSession.post( callbackUrl, data = envelope, headers = { 'Content-Type': 'text/xml' }, timeout = 10 )
+    except requests.RequestException as err:
+        print( f'Callback error: { callbackUrl }: { err }' )
+
+# Post an event to every subscription covering the user (by alias or ObjectId)
+def notify( userObjectId, eventType, msgId ):
+    with stateLock:
+        alias = users.get( userObjectId, {} ).get( 'Alias', '' )
+        targets = [ ( subscriptionId, subscription[ 'callbackUrl' ] )
+            for subscriptionId, subscription in subscriptions.items()
+            if alias in subscription[ 'resourceIds' ] or userObjectId in subscription[ 'resourceIds' ] ]
+    for subscriptionId, callbackUrl in targets:
+        envelope = NOTIFY_ENVELOPE.format(
+            eventType = eventType,
+            subscriptionId = escape( subscriptionId ),
+            mailboxId = escape( alias ),
+            userGuid = escape( userObjectId ),
+            messageId = escape( msgId ),
+            eventTime = datetime.datetime.now( tz = datetime.timezone.utc ).isoformat( timespec = 'seconds' ) )
+        callbackExecutor.submit( postCallback, callbackUrl, envelope )
+
+def soapResponse( operation, result = None ):
+    resultElement = f'<ns1:out>{ escape( result ) }</ns1:out>' if result is not None else ''
+    return f'''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+<soapenv:Body><ns1:{ operation }Response xmlns:ns1="http://unity.cisco.com/messageeventservice/event">{ resultElement }</ns1:{ operation }Response></soapenv:Body>
+</soapenv:Envelope>''', 200, { 'Content-Type': 'text/xml' }
+
+def soapFault( message ):
+    return f'''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+<soapenv:Body><soapenv:Fault><faultcode>soapenv:Server</faultcode><faultstring>{ escape( message ) }</faultstring></soapenv:Fault></soapenv:Body>
+</soapenv:Envelope>''', 500, { 'Content-Type': 'text/xml' }
+
+def childText( element, name ):
+    child = next( element.iter( f'{{*}}{ name }' ), None )
+    return child.text.strip() if child is not None and child.text else None
+
+@app.route( '/messageeventservice/services/MessageEventService', methods = [ 'POST' ] )
+def messageEventService():
+    denied = requireAdmin()
+    if denied: return denied
+    body = next( etree.fromstring( request.get_data() ).iter( '{*}Body' ) )
+    operation = body[ 0 ]
+    name = etree.QName( operation ).localname
+    if name == 'subscribe':
+        subscriptionId = str( uuid.uuid4() )
+        resourceList = next( operation.iter( '{*}resourceIdList' ) )
+        with stateLock:
+            subscriptions[ subscriptionId ] = {
+                'resourceIds': set( element.text.strip() for element in resourceList if element.text ),
+                'callbackUrl': childText( operation, 'callbackServiceUrl' ),
+                'expiration': childText( operation, 'expiration' ) }
+        return soapResponse( name, subscriptionId )
+    subscriptionId = childText( operation, 'subscriptionId' )
+    with stateLock:
+        if subscriptionId not in subscriptions:
+            return soapFault( f'Unknown subscription: { subscriptionId }' )
+        if name == 'renewSubscription':
+            subscriptions[ subscriptionId ][ 'expiration' ] = childText( operation, 'expiration' )
+        elif name == 'unsubscribe':
+            del subscriptions[ subscriptionId ]
+        else:
+            return soapFault( f'Unsupported operation: { name }' )
+    return soapResponse( name )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description = 'Local Unity Connection stand-in server' )
+    parser.add_argument( '--host', default = '127.0.0.1' )
+    parser.add_argument( '--port', type = int, default = 8443 )
+    parser.add_argument( '--cert', help = 'TLS certificate (PEM)' )
+    parser.add_argument( '--key', help = 'TLS private key (PEM)' )
+    parser.add_argument( '--adhoc', action = 'store_true', help = 'Use an ad-hoc self-signed certificate (requires cryptography)' )
+    parser.add_argument( '--latency', type = float, default = 0, help = 'Added latency per request, in ms' )
+    parser.add_argument( '--jitter', type = float, default = 0, help = 'Random additional latency up to this many ms' )
+    parser.add_argument( '--error-rate', type = float, default = 0, help = 'Fraction of requests failing with 500' )
+    parser.add_argument( '--throttle-rate', type = float, default = 0, help = 'Fraction of requests rejected with 429' )
+    parser.add_argument( '--unavailable-rate', type = float, default = 0, help = 'Fraction of requests rejected with 503' )
+    parser.add_argument( '--retry-after', type = int, default = 1, help = 'Retry-After seconds sent with 429/503' )
+    parser.add_argument( '--capacity', type = int, default = 0,
+        help = 'Maximum requests processed at once, more are rejected with 429 (default: unlimited)' )
+    parser.add_argument( '--users', type = int, default = 0, help = 'Number of users to create at startup' )
+    parser.add_argument( '--max-recipients', type = int, default = 0,
+        help = 'Maximum recipients per message, more are rejected with 400 (default: unlimited)' )
+    parser.add_argument( '--auth-latency', type = float, default = 0,
+        help = 'Added latency per Basic auth credential check, in ms (session cookie requests skip it)' )
+    parser.add_argument( '--session-timeout', type = float, default = 1800,
+        help = 'Seconds before an idle JSESSIONID session expires (default: 1800)' )
+    args = parser.parse_args()
+    seedUsers( args.users )
+
+    config.update( {
+        'latency': args.latency / 1000,
+        'jitter': args.jitter / 1000,
+        'errorRate': args.error_rate,
+        'throttleRate': args.throttle_rate,
+        'unavailableRate': args.unavailable_rate,
+        'retryAfter': args.retry_after,
+        'capacity': args.capacity,
+        'maxRecipients': args.max_recipients,
+        'authLatency': args.auth_latency / 1000,
+        'sessionTimeout': args.session_timeout } )
+
+    if args.cert:
+        sslContext = ( args.cert, args.key )
+    elif args.adhoc:
+        sslContext = 'adhoc'
+    else:
+        sslContext = None
+        print( 'Warning: serving plain HTTP - the samples expect HTTPS, use --cert/--key or --adhoc' )
+
+    # Keep connections alive between requests, as CUC does (the default
+    # handler speaks HTTP/1.0, closing every connection)
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    app.run( host = args.host, port = args.port, ssl_context = sslContext, threaded = True )
@@ -0,0 +1,300 @@
+'''
+Cisco Unity Connection voicemail archive script using the CUPI/CUMI APIs
+
+Downloads the audio attachments of every message in the mailboxes of many
+users to a directory, for compliance archiving:
+
+* Aliases are resolved to user ObjectIds (cached, see RESOLVER_CACHE_* in .env),
+  and each user's folders listed page by page
+* Attachments (GET /vmrest/messages/{MsgId}/attachments/{n}) are downloaded
+  `--workers` at a time, streamed to disk in chunks while their SHA-256 is
+  computed, so whole recordings are never held in memory.  Files are written
+  under a temporary name and renamed once complete
+* Each archived message is appended to a manifest (NDJSON: alias, MsgId,
+  folder, subject, arrival time, and each attachment's file, size and
+  SHA-256).  When the archive is re-run, messages already in the manifest
+  whose files are still present with the same checksum are skipped without
+  any download
+
+Usage:
+
+    python cumi_archive_messages.py users.txt archive --folders inbox,deleted
+    python cumi_archive_messages.py users.txt archive --workers 16 --skip-verify
+
+Files are written to <outputDir>/<alias>/<MsgId>-<n>.<ext>, and the manifest
+to <outputDir>/manifest.ndjson.  The users file lists one alias per line
+(lines starting with # are ignored).  Throughput is reported in MB/s and
+messages/sec.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+import threading
+import time
+from requests.exceptions import HTTPError, RequestException
+import urllib3
+from cumi_mailbox import iterFolderMessages
+from cuc_resolver_cache import cacheFromEnv
+from cuc_session_pool import poolFromEnv
+from cuc_metrics import metricsFromEnv
+from cuc_response import first, items
+
+# Edit .env file to specify your CUC address and user credentials
+from dotenv import load_dotenv
+load_dotenv( override = True )
+
+parser = argparse.ArgumentParser( description = 'Archive CUC voicemail audio via CUMI' )
+parser.add_argument( 'usersFile', help = 'File listing user aliases, one per line' )
+parser.add_argument( 'outputDir', help = 'Archive directory' )
+parser.add_argument( '--folders', default = 'inbox',
+    help = 'Comma separated folders to archive: inbox, sent, deleted (default: inbox)' )
+parser.add_argument( '--workers', type = int, default = 8,
+    help = 'Number of concurrent downloads/connections (default: 8)' )
+parser.add_argument( '--skip-verify', action = 'store_true',
+    help = 'Skip archived messages if their files have the recorded size, without re-computing the checksum' )
+args = parser.parse_args()
+
+# CUC self-signed certs do no have a (deprecated) subjectAltName,
+# disable the warning.
+urllib3.disable_warnings( urllib3.exceptions.SubjectAltNameWarning )
+# Certificate checking is disabled unless CUC_CERT is configured in .env
+if not os.getenv( 'CUC_CERT' ):
+    urllib3.disable_warnings( urllib3.exceptions.InsecureRequestWarning )
+
+baseUrl = f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest'
+
+# Size of the slices read from the response and written to disk
+CHUNK_SIZE = 256 * 1024
+
+# Alias -> ObjectId lookups are cached (and can be persisted between runs)
+resolverCache = cacheFromEnv()
+
+# One keep-alive connection per download worker, plus the folder listings
+pool = poolFromEnv( poolSize = args.workers + 2 )
+session = pool.session( os.getenv( 'CUC_HOSTNAME' ), os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) )
+session.headers.update( { 'Accept': 'application/json' } )
+pool.addHook( resolverCache.responseHook )
+
+# Per-endpoint latency metrics, see METRICS_* in .env
+metrics = metricsFromEnv()
+metrics.install( pool )
+
+folders = [ folder.strip() for folder in args.folders.split( ',' ) if folder.strip() ]
+
+# Format a failed request the same way the single-user samples do
+def describeError( operation, err ):
+    if isinstance( err, HTTPError ):
+        return f'{ operation } Status Code: { err.response.status_code } URL:{ err.response.url } { err.response.content.decode( "utf-8", errors = "ignore" ) }'
+    if isinstance( err, ( RequestException, OSError ) ):
+        return f'{ operation } { err }'
+    return f'{ operation } { type( err ).__name__ }: { err }'
+
+# User aliases in file order, without duplicates (ignoring case)
+def readAliases( fileName ):
+    aliases = {}
+    with open( fileName, encoding = 'utf-8' ) as f:
+        for line in f:
+            alias = line.strip()
+            if alias and not alias.startswith( '#' ):
+                aliases.setdefault( alias.lower(), alias )
+    return list( aliases.values() )
+
+def lookupUser( alias ):
+    resp = session.get( f'{ baseUrl }/users', params = { 'query': f'(alias is { alias })' } )
+    resp.raise_for_status()
+    user = first( resp, 'User' )
+    return user[ 'ObjectId' ] if user else None
+
+# MsgIds (e.g. 0:4b1c...) and aliases may contain characters which aren't
+# safe in file names
+def safeName( name ):
+    return re.sub( r'[^A-Za-z0-9._-]', '_', name )
+
+def fileDigest( path ):
+    digest = hashlib.sha256()
+    with open( path, 'rb' ) as f:
+        for chunk in iter( lambda: f.read( CHUNK_SIZE ), b'' ):
+            digest.update( chunk )
+    return digest.hexdigest()
+
+# A manifest entry's files are all present and intact
+def isArchived( entry ):
+    for attachment in entry[ 'Attachments' ]:
+        path = os.path.join( args.outputDir, attachment[ 'File' ] )
+        if not os.path.isfile( path ) or os.path.getsize( path ) != attachment[ 'Size' ]:
+            return False
+        if not args.skip_verify and fileDigest( path ) != attachment[ 'Sha256' ]:
+            return False
+    return True
+
+os.makedirs( args.outputDir, exist_ok = True )
+manifestPath = os.path.join( args.outputDir, 'manifest.ndjson' )
+
+# MsgId -> latest manifest entry from earlier runs
+archived = {}
+if os.path.exists( manifestPath ):
+    with open( manifestPath, encoding = 'utf-8' ) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads( line )
+                archived[ entry[ 'MsgId' ] ] = entry
+
+manifest = open( manifestPath, 'a', encoding = 'utf-8' )
+lock = threading.Lock()
+bytesWritten = 0
+messagesArchived = 0
+messagesSkipped = 0
+failures = []
+
+# Stream one attachment to disk, returning its manifest record
+def downloadAttachment( userObjectId, msgId, index, directory ):
+    global bytesWritten
+    resp = session.get(
+        f'{ baseUrl }/messages/{ msgId }/attachments/{ index }',
+        params = { 'userobjectid': userObjectId },
+        headers = { 'Accept': '*/*' },
+        stream = True )
+    with resp:
+        resp.raise_for_status()
+        contentType = resp.headers.get( 'Content-Type', 'application/octet-stream' ).split( ';' )[ 0 ].strip()
+        extension = '.wav' if contentType in ( 'audio/wav', 'audio/x-wav' ) else ( mimetypes.guess_extension( contentType ) or '.bin' )
+        fileName = f'{ safeName( msgId ) }-{ index }{ extension }'
+        path = os.path.join( args.outputDir, directory, fileName )
+        temporaryPath = f'{ path }.part'
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open( temporaryPath, 'wb' ) as f:
+                for chunk in resp.iter_content( CHUNK_SIZE ):
+                    f.write( chunk )
+                    digest.update( chunk )
+                    size += len( chunk )
+        except BaseException:
+            os.remove( temporaryPath )
+            raise
+    os.replace( temporaryPath, path )
+    with lock:
+        bytesWritten += size
+    return { 'File': f'{ directory }/{ fileName }', 'ContentType': contentType, 'Size': size, 'Sha256': digest.hexdigest() }
+
+def archiveMessage( alias, userObjectId, message ):
+    global messagesArchived, messagesSkipped
+    msgId = message.get( 'MsgId' )
+    if not msgId:
+        with lock:
+            failures.append( f'{ alias }: message without a MsgId: { message }' )
+        return
+    entry = archived.get( msgId )
+    if entry and isArchived( entry ):
+        with lock:
+            messagesSkipped += 1
+        return
+    try:
+        resp = session.get( f'{ baseUrl }/messages/{ msgId }/attachments', params = { 'userobjectid': userObjectId } )
+        resp.raise_for_status()
+        directory = safeName( alias )
+        os.makedirs( os.path.join( args.outputDir, directory ), exist_ok = True )
+        attachments = [ downloadAttachment( userObjectId, msgId, index, directory )
+            for index in range( len( items( resp, 'Attachment' ) ) ) ]
+    # Anything unexpected (e.g. a non-JSON response) is a failure too, rather
+    # than lost in the executor's future
+    except Exception as err:
+        with lock:
+            failures.append( f'{ alias }: { msgId }: { describeError( "GET /attachments", err ) }' )
+        return
+    entry = {
+        'Alias': alias,
+        'UserObjectId': userObjectId,
+        'MsgId': msgId,
+        'Folder': message.get( 'Folder' ),
+        'Subject': message.get( 'Subject' ),
+        'ArrivalTime': message.get( 'ArrivalTime' ),
+        'ArchivedTime': int( time.time() * 1000 ),
+        'Attachments': attachments }
+    with lock:
+        manifest.write( json.dumps( entry ) + '\n' )
+        manifest.flush()
+        messagesArchived += 1
+
+# A user's messages in all the folders, or an error message
+def listUser( alias, userObjectId ):
+    try:
+        return [ message for folder in folders for message in iterFolderMessages( session, baseUrl, folder, userObjectId ) ], None
+    except Exception as err:
+        return [], describeError( 'GET /messages', err )
+
+aliases = readAliases( args.usersFile )
+
+print( f'\nArchiving { ", ".join( folders ) } for { len( aliases ) } users to { args.outputDir }, { args.workers } downloads at a time\n' )
+
+startTime = time.perf_counter()
+
+userObjectIds, lookupErrors = resolverCache.resolveMany( 'alias', aliases, lookupUser, workers = args.workers )
+
+# Bound the number of queued downloads, so huge mailboxes are not all queued at once
+inFlight = threading.BoundedSemaphore( args.workers * 2 )
+
+def onDone( future ):
+    inFlight.release()
+
+with ThreadPoolExecutor( max_workers = args.workers ) as downloads, ThreadPoolExecutor( max_workers = 2 ) as listings:
+    def listFuture( alias ):
+        if alias in lookupErrors:
+            return None, describeError( 'GET /users', lookupErrors[ alias ] )
+        if not userObjectIds[ alias ]:
+            return None, 'user not found'
+        return userObjectIds[ alias ], listings.submit( listUser, alias, userObjectIds[ alias ] )
+    # Listings run ahead of the downloads, in user order
+    for alias, ( userObjectId, listing ) in [ ( alias, listFuture( alias ) ) for alias in aliases ]:
+        if not userObjectId:
+            failures.append( f'{ alias }: { listing }' )
+            continue
+        messages, error = listing.result()
+        if error:
+            failures.append( f'{ alias }: { error }' )
+        for message in messages:
+            inFlight.acquire()
+            downloads.submit( archiveMessage, alias, userObjectId, message ).add_done_callback( onDone )
+        print( f'{ alias }: { len( messages ) } messages' )
+
+elapsed = time.perf_counter() - startTime
+
+manifest.close()
+pool.close()
+
+for failure in failures:
+    print( f'Request error: { failure }' )
+
+print( f'\nArchive: { len( aliases ) } users, { messagesArchived } messages archived, { messagesSkipped } already archived, { len( failures ) } errors' )
+print( f'Downloaded: { bytesWritten / 1e6 :.1f} MB, { bytesWritten / 1e6 / elapsed if elapsed else 0 :.1f} MB/s,'
+    f' { messagesArchived / elapsed if elapsed else 0 :.1f} messages/sec' )
+print( f'Elapsed: { elapsed :.2f}s' )
+print( f'Connections opened: { pool.stats()[ "handshakes" ] }\n' )
+
+metrics.report()
+
+if failures:
+    sys.exit( 1 )
@@ -0,0 +1,172 @@
+'''
+Cisco Unity Connection message audio pre-transcoding
+
+Recordings are often produced as 16-bit PCM at 44.1/48 kHz, which CUC
+transcodes to telephony format when the message is sent.  transcode()
+does this on the client instead, using NumPy to low-pass filter, resample
+and G.711 encode the whole recording at once: 8 kHz mono µ-law or A-law
+(1 byte per sample) in a WAV container, 5-10x smaller than the original.
+
+Results are cached on disk, keyed by a hash of the source audio, so the same
+announcement sent to thousands of mailboxes is only converted (and hashed)
+once:
+
+    audioPath = transcode( 'message.wav', 'ulaw' )
+    requestBody = MessageBody( message, recipients, audioPath )
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import hashlib
+import os
+import struct
+import threading
+import wave
+import numpy as np
+
+TARGET_RATE = 8000
+
+# WAVE_FORMAT_ALAW / WAVE_FORMAT_MULAW
+FORMAT_TAGS = { 'alaw': 6, 'ulaw': 7 }
+
+# Bump when the conversion changes, so older cache entries aren't reused
+CACHE_VERSION = 1
+
+# G.711 segment end points (ITU-T G.711 / Sun g711.c reference)
+SEG_AEND = np.array( [ 0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF ] )
+SEG_UEND = np.array( [ 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF ] )
+
+# Read a PCM WAV file as mono float samples in the range -1..1
+def readWav( path ):
+    with wave.open( path, 'rb' ) as f:
+        channels = f.getnchannels()
+        sampleWidth = f.getsampwidth()
+        rate = f.getframerate()
+        frames = f.readframes( f.getnframes() )
+    if sampleWidth == 1:
+        samples = ( np.frombuffer( frames, dtype = np.uint8 ).astype( np.float32 ) - 128 ) / 128
+    elif sampleWidth == 2:
+        samples = np.frombuffer( frames, dtype = '<i2' ).astype( np.float32 ) / 32768
+    elif sampleWidth == 4:
+        samples = np.frombuffer( frames, dtype = '<i4' ).astype( np.float32 ) / 2147483648
+    else:
+        raise ValueError( f'{ path }: unsupported sample width { sampleWidth * 8 } bits' )
+    if channels > 1:
+        samples = samples.reshape( -1, channels ).mean( axis = 1 )
+    return samples, rate
+
+# Windowed-sinc low-pass filter (cutoff as a fraction of the input rate)
+def lowPassTaps( cutoff, taps = 101 ):
+    n = np.arange( taps ) - ( taps - 1 ) / 2
+    kernel = 2 * cutoff * np.sinc( 2 * cutoff * n ) * np.hamming( taps )
+    return kernel / kernel.sum()
+
+# Resample by low-pass filtering below the new Nyquist frequency, then
+# linearly interpolating at the output sample times
+def resample( samples, fromRate, toRate = TARGET_RATE ):
+    if fromRate == toRate:
+        return samples
+    if toRate < fromRate:
+        samples = np.convolve( samples, lowPassTaps( 0.45 * toRate / fromRate ), mode = 'same' )
+    count = int( len( samples ) * toRate / fromRate )
+    times = np.arange( count ) * ( fromRate / toRate )
+    return np.interp( times, np.arange( len( samples ) ), samples )
+
+def toPcm16( samples ):
+    return np.clip( np.round( samples * 32768 ), -32768, 32767 ).astype( np.int32 )
+
+# 16-bit linear PCM -> G.711 µ-law bytes
+def linearToUlaw( pcm ):
+    pcm = pcm >> 2
+    mask = np.where( pcm < 0, 0x7F, 0xFF )
+    pcm = np.minimum( np.abs( pcm ), 8159 ) + ( 0x84 >> 2 )
+    seg = np.searchsorted( SEG_UEND, pcm )
+    ulaw = np.where( seg >= 8, 0x7F, ( np.minimum( seg, 7 ) << 4 ) | ( ( pcm >> ( seg + 1 ) ) & 0x0F ) )
+    return ( ulaw ^ mask ).astype( np.uint8 )
+
+# 16-bit linear PCM -> G.711 A-law bytes
+def linearToAlaw( pcm ):
+    pcm = pcm >> 3
+    mask = np.where( pcm >= 0, 0xD5, 0x55 )
+    pcm = np.where( pcm >= 0, pcm, -pcm - 1 )
+    seg = np.searchsorted( SEG_AEND, pcm )
+    shift = np.maximum( seg, 1 )
+    alaw = np.where( seg >= 8, 0x7F, ( np.minimum( seg, 7 ) << 4 ) | ( ( pcm >> shift ) & 0x0F ) )
+    return ( alaw ^ mask ).astype( np.uint8 )
+
+# WAV file header for 8-bit G.711 audio: non-PCM formats need the extended
+# fmt chunk (cbSize) and a fact chunk with the sample count
+def g711WavHeader( encoding, sampleCount, rate = TARGET_RATE ):
+    fmt = struct.pack( '<HHIIHHH', FORMAT_TAGS[ encoding ], 1, rate, rate, 1, 8, 0 )
+    fact = struct.pack( '<I', sampleCount )
+    size = 4 + ( 8 + len( fmt ) ) + ( 8 + len( fact ) ) + ( 8 + sampleCount )
+    return (
+        b'RIFF' + struct.pack( '<I', size ) + b'WAVE' +
+        b'fmt ' + struct.pack( '<I', len( fmt ) ) + fmt +
+        b'fact' + struct.pack( '<I', len( fact ) ) + fact +
+        b'data' + struct.pack( '<I', sampleCount ) )
+
+# Convert a PCM WAV file to 8 kHz G.711 WAV bytes
+def encodeG711( path, encoding = 'ulaw' ):
+    if encoding not in FORMAT_TAGS:
+        raise ValueError( f'Unknown encoding { encoding }, expected one of: { ", ".join( FORMAT_TAGS ) }' )
+    samples, rate = readWav( path )
+    pcm = toPcm16( resample( samples, rate ) )
+    encoded = linearToUlaw( pcm ) if encoding == 'ulaw' else linearToAlaw( pcm )
+    return g711WavHeader( encoding, len( encoded ) ) + encoded.tobytes()
+
+def fileDigest( path ):
+    digest = hashlib.sha256()
+    with open( path, 'rb' ) as f:
+        for chunk in iter( lambda: f.read( 1024 * 1024 ), b'' ):
+            digest.update( chunk )
+    return digest.hexdigest()
+
+# ( path, size, mtime, encoding ) -> transcoded path, so repeat calls in one
+# run don't even re-hash the source
+_transcoded = {}
+_lock = threading.Lock()
+
+# Return the path of the cached G.711 version of a WAV file, converting it
+# the first time
+def transcode( path, encoding = 'ulaw', cacheDir = '.audio_cache' ):
+    stat = os.stat( path )
+    memoKey = ( os.path.abspath( path ), stat.st_size, stat.st_mtime_ns, encoding, cacheDir )
+    with _lock:
+        cachedPath = _transcoded.get( memoKey )
+        if cachedPath and os.path.exists( cachedPath ):
+            return cachedPath
+        cachedPath = os.path.join( cacheDir, f'{ fileDigest( path ) }-{ encoding }-v{ CACHE_VERSION }.wav' )
+        if not os.path.exists( cachedPath ):
+            os.makedirs( cacheDir, exist_ok = True )
+            # Write to a temporary file first, so a crash can't leave a
+            # truncated entry in the cache
+            temporaryPath = f'{ cachedPath }.{ os.getpid() }.tmp'
+            with open( temporaryPath, 'wb' ) as f:
+                f.write( encodeG711( path, encoding ) )
+            os.replace( temporaryPath, cachedPath )
+        _transcoded[ memoKey ] = cachedPath
+        return cachedPath
+
+# Transcode per the AUDIO_TRANSCODE (ulaw/alaw) and AUDIO_CACHE_DIR settings
+# in .env, or return the original path if transcoding isn't enabled
+def transcodeFromEnv( path ):
+    encoding = os.getenv( 'AUDIO_TRANSCODE' )
+    if not encoding:
+        return path
+    return transcode( path, encoding.lower(), os.getenv( 'AUDIO_CACHE_DIR' ) or '.audio_cache' )
@@ -0,0 +1,275 @@
+'''
+Cisco Unity Connection broadcast message script using the CUPI/CUMI APIs
+
+Sends one voice message to many mailboxes (e.g. thousands of users), with
+as few requests as possible:
+
+* Recipient names are de-duplicated (ignoring case), then resolved to address
+  ObjectIds via GET /vmrest/mailbox/addresses, `--workers` lookups at a time.
+  Lookups are cached (see RESOLVER_CACHE_* in .env), so repeat broadcasts
+  to the same list need none
+* Recipients are packed up to `--max-recipients` per POST /vmrest/messages,
+  chunks being sent concurrently.  If a chunk is rejected (400), it is split
+  in two and each half retried, which isolates invalid recipients; if the
+  halves all succeed, the chunk was over the server's recipient limit, and
+  later chunks use the smaller size
+* The audio is transcoded once (if AUDIO_TRANSCODE is set in .env) and the
+  same file is streamed in every chunk's request
+
+The message is sent from the `--sender` mailbox, using the admin credentials
+in .env (APP_USER/APP_PASSWORD).  The recipients file lists one alias or
+extension per line (lines starting with # are ignored).
+
+Usage:
+
+    python cumi_broadcast.py recipients.txt --sender operator --subject 'Fire drill at 3pm'
+    python cumi_broadcast.py recipients.txt --sender operator --max-recipients 50 --results results.ndjson
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from requests.exceptions import HTTPError, RequestException
+import urllib3
+from cumi_multipart import MessageBody
+from cuc_resolver_cache import cacheFromEnv
+from cuc_session_pool import poolFromEnv
+from cuc_metrics import metricsFromEnv
+from cuc_response import first, items
+
+# Edit .env file to specify your CUC address and user credentials
+from dotenv import load_dotenv
+load_dotenv( override = True )
+
+parser = argparse.ArgumentParser( description = 'Send one voice message to many CUC mailboxes via CUMI' )
+parser.add_argument( 'recipientsFile', help = 'File listing recipient aliases/extensions, one per line' )
+parser.add_argument( '--sender', default = os.getenv( 'BROADCAST_SENDER' ),
+    help = 'Alias of the sending mailbox (default: BROADCAST_SENDER in .env)' )
+parser.add_argument( '--subject', default = 'Broadcast message', help = 'Message subject' )
+parser.add_argument( '--audio', default = 'message.wav', help = 'Audio file to send (default: message.wav)' )
+parser.add_argument( '--max-recipients', type = int, default = int( os.getenv( 'BROADCAST_MAX_RECIPIENTS', 100 ) ),
+    help = 'Recipients per POST /messages (default: BROADCAST_MAX_RECIPIENTS in .env, or 100)' )
+parser.add_argument( '--workers', type = int, default = 4,
+    help = 'Concurrent lookups / message sends (default: 4)' )
+parser.add_argument( '--results', help = 'Write per-recipient results to this NDJSON file' )
+args = parser.parse_args()
+
+if not args.sender:
+    parser.error( '--sender (or BROADCAST_SENDER in .env) is required' )
+
+# CUC self-signed certs do no have a (deprecated) subjectAltName,
+# disable the warning.
+urllib3.disable_warnings( urllib3.exceptions.SubjectAltNameWarning )
+# Certificate checking is disabled unless CUC_CERT is configured in .env
+if not os.getenv( 'CUC_CERT' ):
+    urllib3.disable_warnings( urllib3.exceptions.InsecureRequestWarning )
+
+baseUrl = f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest'
+
+# Address lookups are cached (and can be persisted between runs)
+resolverCache = cacheFromEnv()
+
+# One keep-alive connection per worker
+pool = poolFromEnv( poolSize = args.workers )
+session = pool.session( os.getenv( 'CUC_HOSTNAME' ), os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) )
+session.headers.update( { 'Accept': 'application/json' } )
+pool.addHook( resolverCache.responseHook )
+
+# Per-endpoint latency metrics, see METRICS_* in .env
+metrics = metricsFromEnv()
+metrics.install( pool )
+
+# Format a failed request the same way the single-user samples do
+def describeError( operation, err ):
+    if isinstance( err, HTTPError ):
+        return f'{ operation } Status Code: { err.response.status_code } URL:{ err.response.url } { err.response.content.decode( "utf-8", errors = "ignore" ) }'
+    return f'{ operation } { err }'
+
+# Recipient names in file order, without duplicates (ignoring case)
+def readRecipients( fileName ):
+    names = {}
+    count = 0
+    with open( fileName, encoding = 'utf-8' ) as f:
+        for line in f:
+            name = line.strip()
+            if not name or name.startswith( '#' ):
+                continue
+            count += 1
+            names.setdefault( name.lower(), name )
+    return list( names.values() ), count - len( names )
+
+def lookupUser( alias ):
+    resp = session.get( f'{ baseUrl }/users', params = { 'query': f'(alias is { alias })' } )
+    resp.raise_for_status()
+    user = first( resp, 'User' )
+    return user[ 'ObjectId' ] if user else None
+
+# The name search matches aliases and display names containing the name, so
+# only an exact alias (or extension) match is taken.  None if there is none
+def lookupAddress( name ):
+    resp = session.get(
+        f'{ baseUrl }/mailbox/addresses',
+        params = { 'name': name, 'userobjectid': senderObjectId } )
+    resp.raise_for_status()
+    for address in items( resp, 'Address', fields = ( 'ObjectId', 'Alias', 'DtmfAccessId' ) ):
+        if name.lower() in ( str( address.get( 'Alias', '' ) ).lower(), str( address.get( 'DtmfAccessId', '' ) ) ):
+            return address[ 'ObjectId' ]
+    return None
+
+try:
+    senderObjectId = resolverCache.resolve( 'alias', args.sender, lookupUser )
+except RequestException as err:
+    print( f'Request error: { describeError( "GET /users", err ) }' )
+    sys.exit( 1 )
+if not senderObjectId:
+    print( f'Sender not found: { args.sender }' )
+    sys.exit( 1 )
+
+names, duplicates = readRecipients( args.recipientsFile )
+
+print( f'\nBroadcasting to { len( names ) } recipients from { args.sender }, up to { args.max_recipients } per message' )
+
+# Resolve every recipient before sending anything
+startTime = time.perf_counter()
+addressIds, lookupErrors = resolverCache.resolveMany( 'address', names, lookupAddress, workers = args.workers )
+resolveElapsed = time.perf_counter() - startTime
+
+# Recipient name -> result record
+results = {}
+for name in names:
+    if name in lookupErrors:
+        results[ name ] = { 'Recipient': name, 'status': 'failed', 'error': describeError( 'GET /addresses', lookupErrors[ name ] ) }
+    elif not addressIds[ name ]:
+        results[ name ] = { 'Recipient': name, 'status': 'not-found' }
+
+# The message and audio are the same for every chunk: only the recipients part differs
+message = json.dumps( {
+    'Subject': args.subject,
+    'Priority': 'Normal',
+    'Sensitivity': 'Normal',
+    'ReadReceiptRequested': False,
+    'Secure': True } ).encode( 'utf-8' )
+
+audioPath = args.audio
+if os.getenv( 'AUDIO_TRANSCODE' ):
+    # NumPy is only loaded when transcoding is enabled
+    from cumi_audio import transcodeFromEnv
+    audioPath = transcodeFromEnv( audioPath )
+
+postCount = 0
+maxRecipients = args.max_recipients
+chunkLock = threading.Lock()
+
+def postMessage( chunk ):
+    global postCount
+    requestBody = MessageBody( message, {
+        'Recipient': [ { 'Type': 'TO', 'Address': { 'UserGuid': addressIds[ name ] } } for name in chunk ] },
+        audioPath )
+    with chunkLock:
+        postCount += 1
+    resp = session.post(
+        f'{ baseUrl }/messages',
+        params = { 'userobjectid': senderObjectId },
+        headers = { 'Content-Type': requestBody.contentType },
+        data = requestBody )
+    resp.raise_for_status()
+
+# Send to a chunk of recipients, returning a result record for each.  A
+# rejected chunk is split in two until the invalid recipients are isolated
+def sendChunk( chunk ):
+    global maxRecipients
+    try:
+        postMessage( chunk )
+        return [ { 'Recipient': name, 'status': 'sent', 'ObjectId': addressIds[ name ] } for name in chunk ]
+    except HTTPError as err:
+        if err.response.status_code != 400:
+            error = describeError( 'POST /messages', err )
+            return [ { 'Recipient': name, 'status': 'failed', 'ObjectId': addressIds[ name ], 'error': error } for name in chunk ]
+        if len( chunk ) == 1:
+            # The cached address may be stale - look it up again next time
+            resolverCache.invalidate( 'address', chunk[ 0 ] )
+            return [ { 'Recipient': chunk[ 0 ], 'status': 'rejected', 'ObjectId': addressIds[ chunk[ 0 ] ],
+                'error': describeError( 'POST /messages', err ) } ]
+    except RequestException as err:
+        error = describeError( 'POST /messages', err )
+        return [ { 'Recipient': name, 'status': 'failed', 'ObjectId': addressIds[ name ], 'error': error } for name in chunk ]
+    half = len( chunk ) // 2
+    chunkResults = sendChunk( chunk[ : half ] ) + sendChunk( chunk[ half : ] )
+    if all( result[ 'status' ] == 'sent' for result in chunkResults ):
+        # Nothing wrong with the recipients - too many of them
+        with chunkLock:
+            if half < maxRecipients:
+                print( f'POST /messages: { len( chunk ) } recipients rejected, using { half } per message' )
+                maxRecipients = half
+    return chunkResults
+
+# Recipients still to send to; each worker takes the next `maxRecipients`
+pending = deque( name for name in names if name not in results )
+
+def sendWorker():
+    while True:
+        with chunkLock:
+            if not pending:
+                return
+            chunk = [ pending.popleft() for _ in range( min( maxRecipients, len( pending ) ) ) ]
+        chunkResults = sendChunk( chunk )
+        sent = sum( 1 for result in chunkResults if result[ 'status' ] == 'sent' )
+        with chunkLock:
+            for result in chunkResults:
+                results[ result[ 'Recipient' ] ] = result
+            print( f'POST /messages: { sent } of { len( chunk ) } recipients sent' )
+
+sendStart = time.perf_counter()
+with ThreadPoolExecutor( max_workers = args.workers ) as executor:
+    for future in [ executor.submit( sendWorker ) for _ in range( args.workers ) ]:
+        future.result()
+elapsed = time.perf_counter() - startTime
+sendElapsed = time.perf_counter() - sendStart
+
+pool.close()
+
+counts = {}
+for name in names:
+    result = results[ name ]
+    counts[ result[ 'status' ] ] = counts.get( result[ 'status' ], 0 ) + 1
+    if result[ 'status' ] != 'sent':
+        print( f'{ result[ "status" ] }: { name }{ ": " + result[ "error" ] if result.get( "error" ) else "" }' )
+
+if args.results:
+    with open( args.results, 'w', encoding = 'utf-8' ) as f:
+        for name in names:
+            f.write( json.dumps( results[ name ] ) + '\n' )
+
+print( f'\nBroadcast: { len( names ) } recipients ({ duplicates } duplicates ignored), { counts.get( "sent", 0 ) } sent,'
+    f' { counts.get( "not-found", 0 ) } not found, { counts.get( "rejected", 0 ) } rejected, { counts.get( "failed", 0 ) } failed' )
+print( f'POST /messages: { postCount } requests, { os.path.getsize( audioPath ) } byte audio' )
+print( f'Resolve: { resolveElapsed :.2f}s, send: { sendElapsed :.2f}s' )
+print( f'Elapsed: { elapsed :.2f}s, { len( names ) / elapsed if elapsed else 0 :.1f} recipients/sec' )
+print( f'Connections opened: { pool.stats()[ "handshakes" ] }\n' )
+
+metrics.report()
+
+if counts.get( 'sent', 0 ) < len( names ):
+    sys.exit( 1 )
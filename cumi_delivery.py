@@ -0,0 +1,240 @@
+'''
+Cisco Unity Connection CUMI message delivery confirmation
+
+After POST /vmrest/messages is accepted, the message still has to be
+delivered to the recipient's mailbox.  Rather than sleeping for a fixed time
+before looking for it, DeliveryMonitor returns as soon as the message arrives,
+and reports how long delivery took:
+
+* if a CUNI subscription could be set up for the recipients, it waits for the
+  NEW_MESSAGE event, received by a small callback listener and parsed by an
+  EventPipeline
+* otherwise (or if the event is lost) it polls the recipient's inbox message
+  count, starting at `initialInterval` and doubling up to `maxInterval`
+
+    monitor = monitorFromEnv( adminSession, baseUrl, [ 'testUser' ] )
+    pending = monitor.prepare( userSession, userObjectId, 'testUser' )
+    ...send the message...
+    delivery = monitor.wait( pending )
+    print( f'Delivered in { delivery.latency :.3f}s ({ delivery.method })' )
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import datetime
+import os
+import socket
+import threading
+import time
+from cumi_mailbox import fetchFolderPage
+
+class Delivery:
+
+    __slots__ = ( 'latency', 'method', 'msgId' )
+
+    # latency: seconds from prepare() (just before sending) to arrival
+    # method: 'event' or 'poll'
+    def __init__( self, latency, method, msgId = None ):
+        self.latency = latency
+        self.method = method
+        self.msgId = msgId
+
+class PendingDelivery:
+
+    __slots__ = ( 'session', 'userObjectId', 'keys', 'marker', 'baseline', 'startTime' )
+
+    def __init__( self, session, userObjectId, keys, marker, baseline ):
+        self.session = session
+        self.userObjectId = userObjectId
+        self.keys = keys
+        self.marker = marker
+        self.baseline = baseline
+        self.startTime = time.time()
+
+# EventPipeline sink recording NEW_MESSAGE arrivals per mailbox alias and
+# user ObjectId, and waking up threads waiting for them
+class DeliveryWaiter:
+
+    def __init__( self ):
+        self.condition = threading.Condition()
+        # lower-cased alias/ObjectId -> list of NEW_MESSAGE events, in arrival order
+        self.arrivals = {}
+
+    def write( self, events ):
+        with self.condition:
+            for event in events:
+                if event.get( 'eventType' ) != 'NEW_MESSAGE':
+                    continue
+                for name in ( 'mailboxId', 'userGuid' ):
+                    if event.get( name ):
+                        self.arrivals.setdefault( event[ name ].lower(), [] ).append( event )
+            self.condition.notify_all()
+
+    # Current arrival counts, so wait() only sees events received afterwards
+    def marker( self, keys ):
+        with self.condition:
+            return { key: len( self.arrivals.get( key, () ) ) for key in keys }
+
+    # First event received after the marker, or None after `timeout` seconds
+    def wait( self, marker, timeout ):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                for key, seen in marker.items():
+                    arrivals = self.arrivals.get( key, () )
+                    if len( arrivals ) > seen:
+                        return arrivals[ seen ]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait( remaining )
+
+# Minimal HTTP server accepting CUNI notification POSTs into a pipeline
+class CallbackListener:
+
+    def __init__( self, port, pipeline ):
+        class Handler( BaseHTTPRequestHandler ):
+            def do_POST( self ):
+                pipeline.submit( self.rfile.read( int( self.headers.get( 'Content-Length' ) or 0 ) ) )
+                self.send_response( 200 )
+                self.send_header( 'Content-Length', '0' )
+                self.end_headers()
+            def log_message( self, format, *args ):
+                pass
+        self.server = ThreadingHTTPServer( ( '', port ), Handler )
+        self.server.daemon_threads = True
+        self.thread = threading.Thread( target = self.server.serve_forever, name = 'cumi-delivery-listener', daemon = True )
+
+    def start( self ):
+        self.thread.start()
+
+    def stop( self ):
+        self.server.shutdown()
+        self.server.server_close()
+
+def inboxCount( session, baseUrl, userObjectId ):
+    total, _ = fetchFolderPage( session, baseUrl, 'inbox', 1, 1, { 'userobjectid': userObjectId } )
+    return total
+
+class DeliveryMonitor:
+
+    # timeout: seconds to wait for delivery
+    # initialInterval/maxInterval: inbox polling backoff, in seconds
+    def __init__( self, baseUrl, timeout = 30.0, initialInterval = 0.1, maxInterval = 2.0 ):
+        self.baseUrl = baseUrl
+        self.timeout = timeout
+        self.initialInterval = initialInterval
+        self.maxInterval = maxInterval
+        self.waiter = None
+        self.pipeline = None
+        self.listener = None
+        self.subscriptionManager = None
+
+    # Listen on `port` for NEW_MESSAGE events for the given aliases, with a
+    # CUNI subscription posting to `callbackUrl`.  Returns False (and leaves
+    # the monitor polling) if the subscription fails
+    def subscribe( self, serviceUrl, session, callbackUrl, port, aliases ):
+        # The CUNI modules (and lxml) are only loaded when events are used
+        from cuni_event_pipeline import EventPipeline
+        from cuni_subscription_manager import SubscriptionManager
+        waiter = DeliveryWaiter()
+        manager = SubscriptionManager( serviceUrl, session, callbackUrl, aliases,
+            lifetime = datetime.timedelta( hours = 1 ), renewAhead = datetime.timedelta( minutes = 10 ),
+            workers = 1, eventTypes = ( 'NEW_MESSAGE', ) )
+        # The manager sees the subscription lifecycle events; both sinks are
+        # registered before the workers start
+        pipeline = EventPipeline( [ waiter, manager ], workers = 1, flushInterval = 0.05 )
+        try:
+            listener = CallbackListener( port, pipeline )
+        except OSError as err:
+            print( f'Delivery listener error: port { port }: { err }' )
+            return False
+        pipeline.start()
+        listener.start()
+        if not manager.start():
+            manager.stop( unsubscribe = False )
+            listener.stop()
+            pipeline.stop()
+            return False
+        self.waiter, self.pipeline, self.listener, self.subscriptionManager = waiter, pipeline, listener, manager
+        return True
+
+    # Call just before sending: snapshots the recipient's inbox count (and
+    # event arrivals, if subscribed), using the recipient's session
+    def prepare( self, session, userObjectId, alias = None ):
+        keys = [ key.lower() for key in ( alias, userObjectId ) if key ]
+        marker = self.waiter.marker( keys ) if self.waiter else None
+        return PendingDelivery( session, userObjectId, keys, marker,
+            inboxCount( session, self.baseUrl, userObjectId ) )
+
+    # Block until the message arrives, returning a Delivery, or None on timeout.
+    # When subscribed, the inbox is still polled every `maxInterval` in case
+    # the event is lost
+    def wait( self, pending ):
+        deadline = pending.startTime + self.timeout
+        interval = self.maxInterval if self.waiter else self.initialInterval
+        while True:
+            remaining = max( deadline - time.time(), 0 )
+            if self.waiter:
+                event = self.waiter.wait( pending.marker, min( interval, remaining ) )
+                if event:
+                    return Delivery( event[ 'receivedTime' ] - pending.startTime, 'event', event.get( 'messageId' ) )
+            else:
+                time.sleep( min( interval, remaining ) )
+            if inboxCount( pending.session, self.baseUrl, pending.userObjectId ) > pending.baseline:
+                return Delivery( time.time() - pending.startTime, 'poll' )
+            if time.time() >= deadline:
+                return None
+            interval = min( interval * 2, self.maxInterval )
+
+    def close( self ):
+        if self.subscriptionManager:
+            self.subscriptionManager.stop()
+            self.listener.stop()
+            self.pipeline.stop()
+            self.subscriptionManager = None
+
+# Create a monitor configured by the DELIVERY_* settings in .env.  With
+# DELIVERY_EVENTS=True, NEW_MESSAGE events for `aliases` are subscribed using
+# `session` (admin credentials), with callbacks to APP_HOSTNAME (or the
+# detected local IP) on DELIVERY_CALLBACK_PORT
+def monitorFromEnv( session, baseUrl, aliases ):
+    monitor = DeliveryMonitor(
+        baseUrl,
+        timeout = float( os.getenv( 'DELIVERY_TIMEOUT', 30 ) ),
+        initialInterval = float( os.getenv( 'DELIVERY_POLL_INTERVAL', 0.1 ) ) )
+    if os.getenv( 'DELIVERY_EVENTS' ) != 'True':
+        return monitor
+    cucHost = urlsplit( baseUrl )
+    hostAddress = os.getenv( 'APP_HOSTNAME' )
+    if not hostAddress:
+        # Use the local IP address CUC would see us as
+        sock = socket.create_connection( ( cucHost.hostname, cucHost.port or 443 ) )
+        hostAddress = sock.getsockname()[ 0 ]
+        sock.close()
+    port = int( os.getenv( 'DELIVERY_CALLBACK_PORT', 5001 ) )
+    if not monitor.subscribe(
+            f'https://{ cucHost.netloc }/messageeventservice/services/MessageEventService',
+            session,
+            f'http://{ hostAddress }:{ port }/incomingMessages',
+            port,
+            aliases ):
+        print( 'NEW_MESSAGE subscription failed, polling the inbox for delivery instead' )
+    return monitor
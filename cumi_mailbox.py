@@ -0,0 +1,88 @@
+'''
+Cisco Unity Connection CUMI mailbox folder helpers
+
+iterFolderMessages() walks a mailbox folder (inbox, sent, deleted) one page at
+a time using the CUMI `pageNumber`/`rowsPerPage` query parameters, yielding
+one message dict at a time.  While the caller works through the current page,
+the next page is already being fetched in the background, so at most two
+pages are held in memory and the first message is available after a single
+round trip:
+
+    for message in iterFolderMessages( userSession, baseUrl, 'inbox', userObjectId ):
+        print( message[ 'MsgId' ], message[ 'Subject' ] )
+
+Note: deleting/moving messages in a folder while walking it shifts the later
+pages - collect the MsgIds first if the folder is to be modified.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from cuc_response import page
+
+DEFAULT_ROWS_PER_PAGE = 100
+
+# CUMI returns booleans as 'true'/'false' strings, convert them and tag
+# each message with the folder it was listed from
+def normaliseMessage( message, folder ):
+    normalised = {}
+    for key, value in message.items():
+        if value == 'true':
+            value = True
+        elif value == 'false':
+            value = False
+        normalised[ key ] = value
+    normalised[ 'Folder' ] = folder
+    return normalised
+
+# Fetch one page of a folder listing, returning ( total, [ messages ] )
+def fetchFolderPage( session, baseUrl, folder, pageNumber, rowsPerPage, params = None ):
+    resp = session.get(
+        f'{ baseUrl }/mailbox/folders/{ folder }/messages',
+        params = { **( params or {} ), 'pageNumber': pageNumber, 'rowsPerPage': rowsPerPage },
+        headers = { 'Accept': 'application/json' } )
+    resp.raise_for_status()
+    # Message is always a list, even with < 2 messages
+    return page( resp, 'Message' )
+
+# Lazily yield every message in a folder, prefetching the next page.
+# Raises requests HTTPError if a page request fails.
+def iterFolderMessages( session, baseUrl, folder = 'inbox', userObjectId = None,
+        rowsPerPage = DEFAULT_ROWS_PER_PAGE, params = None ):
+    params = dict( params or {} )
+    if userObjectId:
+        params[ 'userobjectid' ] = userObjectId
+
+    executor = ThreadPoolExecutor( max_workers = 1 )
+    try:
+        pageNumber = 1
+        pending = executor.submit( fetchFolderPage, session, baseUrl, folder, pageNumber, rowsPerPage, params )
+        seen = 0
+        while pending:
+            total, messages = pending.result()
+            seen += len( messages )
+            # Start fetching the next page before handing out this one
+            if messages and len( messages ) >= rowsPerPage and seen < total:
+                pageNumber += 1
+                pending = executor.submit( fetchFolderPage, session, baseUrl, folder, pageNumber, rowsPerPage, params )
+            else:
+                pending = None
+            for message in messages:
+                yield normaliseMessage( message, folder )
+    finally:
+        executor.shutdown( wait = False )
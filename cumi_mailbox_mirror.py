@@ -0,0 +1,219 @@
+'''
+Cisco Unity Connection local mailbox metadata mirror
+
+Keeps a copy of the message metadata (MsgId, subject, read state, folder,
+arrival time) of many mailboxes in an indexed SQLite database, so questions
+like "how many unread messages does each of these 5000 users have" are
+answered locally rather than by listing every inbox on CUC:
+
+* seed() lists a mailbox's folders once via CUMI (iterFolderMessages)
+* the mirror is an EventPipeline sink, applying CUNI NEW_MESSAGE,
+  OPENED_MESSAGE, UNREAD_MESSAGE, SAVED_MESSAGE and DELETED_MESSAGE events as
+  they arrive to keep it current
+
+    mirror = MailboxMirror( 'mailboxes.db' )
+    pipeline.sinks.append( mirror )
+    mirror.seed( session, baseUrl, 'jsmith', userObjectId )
+    mirror.unreadCounts()
+
+The pipeline's workers may apply events out of order, so each row keeps the
+receive time of the latest event (or listing) applied to it, and older
+changes are ignored: an OPENED_MESSAGE or DELETED_MESSAGE handled before its
+NEW_MESSAGE wins, and deleted messages are moved to the `deleted` folder,
+rather than removed, so a late NEW_MESSAGE can't bring them back.  Likewise,
+events received while a mailbox is being seeded are not lost: rows updated
+by an event after the listing started are left alone by the seed.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import RequestException
+import sqlite3
+import threading
+import time
+from cumi_mailbox import iterFolderMessages
+from cuc_response import first
+
+FOLDERS = ( 'inbox', 'sent', 'deleted' )
+
+class MailboxMirror:
+
+    def __init__( self, path ):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect( path, check_same_thread = False )
+        self.db.execute( 'PRAGMA journal_mode=WAL' )
+        self.db.execute( 'PRAGMA synchronous=NORMAL' )
+        self.db.execute( '''CREATE TABLE IF NOT EXISTS mailboxes (
+            mailbox TEXT PRIMARY KEY,
+            userObjectId TEXT,
+            seededTime REAL )''' )
+        self.db.execute( 'CREATE INDEX IF NOT EXISTS mailboxes_user ON mailboxes ( userObjectId )' )
+        self.db.execute( '''CREATE TABLE IF NOT EXISTS messages (
+            mailbox TEXT,
+            msgId TEXT,
+            folder TEXT,
+            subject TEXT,
+            read INTEGER,
+            arrivalTime INTEGER,
+            updatedTime REAL,
+            PRIMARY KEY ( mailbox, msgId ) )''' )
+        self.db.execute( 'CREATE INDEX IF NOT EXISTS messages_unread ON messages ( mailbox, folder, read )' )
+        self.db.commit()
+        self.eventsApplied = 0
+
+    # Mailbox key for an event: the (lower case) alias, or the alias of a
+    # seeded mailbox with this user ObjectId
+    def eventMailbox( self, event ):
+        if event.get( 'mailboxId' ):
+            return event[ 'mailboxId' ].lower()
+        row = self.db.execute( 'SELECT mailbox FROM mailboxes WHERE userObjectId = ?', ( event.get( 'userGuid' ), ) ).fetchone()
+        return row[ 0 ] if row else ( event.get( 'userGuid' ) or '' ).lower()
+
+    # EventPipeline sink interface - apply a batch of events in one transaction
+    def write( self, events ):
+        with self.lock:
+            applied = 0
+            for event in events:
+                eventType = event.get( 'eventType' )
+                msgId = event.get( 'messageId' ) or event.get( 'msgId' )
+                if not msgId:
+                    continue
+                mailbox = self.eventMailbox( event )
+                updatedTime = event.get( 'receivedTime' ) or time.time()
+                if eventType == 'NEW_MESSAGE':
+                    # If a later event got here first, only fill in the details
+                    self.db.execute( '''INSERT INTO messages ( mailbox, msgId, folder, subject, read, arrivalTime, updatedTime )
+                        VALUES ( ?, ?, 'inbox', ?, 0, ?, ? )
+                        ON CONFLICT ( mailbox, msgId ) DO UPDATE SET
+                            subject = COALESCE( messages.subject, excluded.subject ),
+                            arrivalTime = COALESCE( messages.arrivalTime, excluded.arrivalTime ),
+                            updatedTime = MAX( messages.updatedTime, excluded.updatedTime )''',
+                        ( mailbox, msgId, event.get( 'subject' ), int( updatedTime * 1000 ), updatedTime ) )
+                # A saved message has been listened to, and kept
+                elif eventType in ( 'OPENED_MESSAGE', 'SAVED_MESSAGE', 'UNREAD_MESSAGE' ):
+                    self.db.execute( '''INSERT INTO messages ( mailbox, msgId, folder, read, updatedTime )
+                        VALUES ( ?, ?, 'inbox', ?, ? )
+                        ON CONFLICT ( mailbox, msgId ) DO UPDATE SET read = excluded.read, updatedTime = excluded.updatedTime
+                        WHERE messages.updatedTime <= excluded.updatedTime''',
+                        ( mailbox, msgId, 0 if eventType == 'UNREAD_MESSAGE' else 1, updatedTime ) )
+                elif eventType == 'DELETED_MESSAGE':
+                    self.db.execute( '''INSERT INTO messages ( mailbox, msgId, folder, read, updatedTime )
+                        VALUES ( ?, ?, 'deleted', 1, ? )
+                        ON CONFLICT ( mailbox, msgId ) DO UPDATE SET folder = 'deleted', updatedTime = excluded.updatedTime
+                        WHERE messages.updatedTime <= excluded.updatedTime''',
+                        ( mailbox, msgId, updatedTime ) )
+                else:
+                    continue
+                applied += 1
+            self.db.commit()
+            self.eventsApplied += applied
+
+    # List a mailbox's folders via CUMI and store the results.  Rows which
+    # weren't listed are removed, unless an event has touched them since the
+    # listing started
+    def seed( self, session, baseUrl, mailbox, userObjectId, folders = FOLDERS ):
+        mailbox = mailbox.lower()
+        startTime = time.time()
+        rows = []
+        for folder in folders:
+            for message in iterFolderMessages( session, baseUrl, folder, userObjectId ):
+                rows.append( (
+                    mailbox,
+                    message[ 'MsgId' ],
+                    folder,
+                    message.get( 'Subject' ),
+                    1 if message.get( 'Read' ) is True else 0,
+                    int( message.get( 'ArrivalTime' ) or 0 ),
+                    startTime ) )
+        with self.lock:
+            self.db.execute( 'CREATE TEMP TABLE IF NOT EXISTS listed ( msgId TEXT PRIMARY KEY )' )
+            self.db.execute( 'DELETE FROM listed' )
+            self.db.executemany( 'INSERT OR IGNORE INTO listed VALUES ( ? )', ( ( row[ 1 ], ) for row in rows ) )
+            self.db.executemany( '''INSERT INTO messages ( mailbox, msgId, folder, subject, read, arrivalTime, updatedTime )
+                VALUES ( ?, ?, ?, ?, ?, ?, ? )
+                ON CONFLICT ( mailbox, msgId ) DO UPDATE SET
+                    folder = excluded.folder, subject = excluded.subject, read = excluded.read,
+                    arrivalTime = excluded.arrivalTime, updatedTime = excluded.updatedTime
+                WHERE messages.updatedTime < excluded.updatedTime''', rows )
+            self.db.execute( '''DELETE FROM messages WHERE mailbox = ? AND updatedTime < ?
+                AND msgId NOT IN ( SELECT msgId FROM listed )''', ( mailbox, startTime ) )
+            self.db.execute( 'INSERT OR REPLACE INTO mailboxes VALUES ( ?, ?, ? )', ( mailbox, userObjectId, startTime ) )
+            self.db.commit()
+        return len( rows )
+
+    # Seed many mailboxes concurrently: mailboxes is a list of ( alias, userObjectId ).
+    # Returns the number seeded successfully
+    def seedAll( self, session, baseUrl, mailboxes, workers = 4 ):
+        def seedOne( mailbox ):
+            try:
+                self.seed( session, baseUrl, *mailbox )
+                return True
+            except RequestException as err:
+                print( f'Mailbox seed error: { mailbox[ 0 ] }: { err }' )
+                return False
+        with ThreadPoolExecutor( max_workers = workers ) as executor:
+            return sum( executor.map( seedOne, mailboxes ) )
+
+    # Unread inbox message count per mailbox (every seeded mailbox, or those given)
+    def unreadCounts( self, mailboxes = None ):
+        with self.lock:
+            if mailboxes is None:
+                counts = { mailbox: 0 for ( mailbox, ) in self.db.execute( 'SELECT mailbox FROM mailboxes' ) }
+                rows = self.db.execute( '''SELECT mailbox, COUNT(*) FROM messages
+                    WHERE folder = 'inbox' AND read = 0 GROUP BY mailbox''' )
+            else:
+                mailboxes = [ mailbox.lower() for mailbox in mailboxes ]
+                counts = { mailbox: 0 for mailbox in mailboxes }
+                rows = self.db.execute( f'''SELECT mailbox, COUNT(*) FROM messages
+                    WHERE folder = 'inbox' AND read = 0 AND mailbox IN ( { ','.join( '?' * len( mailboxes ) ) } )
+                    GROUP BY mailbox''', mailboxes )
+            counts.update( rows )
+            return counts
+
+    def messages( self, mailbox, folder = None ):
+        query = 'SELECT msgId, folder, subject, read, arrivalTime FROM messages WHERE mailbox = ?'
+        params = [ mailbox.lower() ]
+        if folder:
+            query += ' AND folder = ?'
+            params.append( folder )
+        with self.lock:
+            return [ { 'MsgId': msgId, 'Folder': folder, 'Subject': subject, 'Read': bool( read ), 'ArrivalTime': arrivalTime }
+                for msgId, folder, subject, read, arrivalTime in self.db.execute( query + ' ORDER BY arrivalTime DESC', params ) ]
+
+    def stats( self ):
+        with self.lock:
+            mailboxes, = self.db.execute( 'SELECT COUNT(*) FROM mailboxes' ).fetchone()
+            messages, = self.db.execute( 'SELECT COUNT(*) FROM messages' ).fetchone()
+            return { 'mailboxes': mailboxes, 'messages': messages, 'eventsApplied': self.eventsApplied }
+
+    def close( self ):
+        with self.lock:
+            self.db.close()
+
+# Look up the ObjectId of each alias (aliases which aren't found are assumed
+# to already be ObjectIds), returning a list of ( alias, userObjectId )
+def resolveMailboxes( session, baseUrl, aliases, workers = 4 ):
+    def resolve( alias ):
+        resp = session.get( f'{ baseUrl }/users', params = { 'query': f'(alias is { alias })' },
+            headers = { 'Accept': 'application/json' } )
+        resp.raise_for_status()
+        user = first( resp, 'User' )
+        return ( alias, user[ 'ObjectId' ] if user else alias )
+    with ThreadPoolExecutor( max_workers = workers ) as executor:
+        return list( executor.map( resolve, aliases ) )
@@ -0,0 +1,95 @@
+'''
+Streaming multipart body for the CUMI POST /vmrest/messages API
+
+CUMI does not appear to like the Content-Disposition multi-part headers
+created by Requests when using the 'files' option, so the body has to be
+built by hand.  Rather than reading the whole audio file and concatenating
+everything into one (repeatedly copied) bytes object, MessageBody yields the
+JSON message part, the JSON recipients part and then the audio file in
+chunks, sliced straight out of a read-only memory map of the file.
+
+MessageBody can be passed as `data` to both requests (it has a length, so a
+normal Content-Length is sent rather than chunked encoding) and aiohttp (as
+an async iterable - set the Content-Length header to `len( body )`):
+
+    body = MessageBody( message, recipients, 'message.wav' )
+    session.post( url, headers = { 'Content-Type': body.contentType }, data = body )
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import json
+import mmap
+import os
+
+BOUNDARY = 'the_message_boundary'
+CONTENT_TYPE = f'multipart/form-data; boundary={ BOUNDARY }'
+
+# Size of the audio slices handed to the HTTP client
+CHUNK_SIZE = 256 * 1024
+
+def _jsonPart( content ):
+    if isinstance( content, ( dict, list ) ):
+        content = json.dumps( content )
+    if isinstance( content, str ):
+        content = content.encode( 'utf-8' )
+    return (
+        b'--' + BOUNDARY.encode() + b'\r\n' +
+        b'Content-Type: application/json\r\n\r\n' +
+        content + b'\r\n' )
+
+class MessageBody:
+
+    contentType = CONTENT_TYPE
+
+    # message / recipients: JSON strings/bytes, or dicts to be serialized
+    # audioPath: path of the audio attachment file
+    def __init__( self, message, recipients, audioPath, audioType = 'audio/wav', chunkSize = CHUNK_SIZE ):
+        self.audioPath = audioPath
+        self.audioSize = os.path.getsize( audioPath )
+        self.chunkSize = chunkSize
+        self.head = (
+            _jsonPart( message ) +
+            _jsonPart( recipients ) +
+            b'--' + BOUNDARY.encode() + b'\r\n' +
+            b'Content-Type: ' + audioType.encode() + b'\r\n\r\n' )
+        self.tail = b'\r\n--' + BOUNDARY.encode() + b'--\r\n'
+
+    def __len__( self ):
+        return len( self.head ) + self.audioSize + len( self.tail )
+
+    # Memoryview slices of the mapped file - nothing is copied until the
+    # socket write.  The slices keep the mapping alive until they are released,
+    # so the map is never explicitly closed while the client may still hold one.
+    def audioChunks( self ):
+        if not self.audioSize:
+            return
+        with open( self.audioPath, 'rb' ) as f:
+            mapped = mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ )
+        view = memoryview( mapped )
+        for offset in range( 0, len( view ), self.chunkSize ):
+            yield view[ offset : offset + self.chunkSize ]
+
+    def __iter__( self ):
+        yield self.head
+        yield from self.audioChunks()
+        yield self.tail
+
+    async def __aiter__( self ):
+        for chunk in self:
+            yield chunk
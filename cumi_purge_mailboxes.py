@@ -0,0 +1,224 @@
+'''
+Cisco Unity Connection bulk mailbox purge script using the CUPI/CUMI APIs
+
+Deletes messages from the mailboxes of many users (e.g. a whole department),
+optionally only those older than a given age, already read, or in given
+folders - for retention trimming:
+
+* Aliases are resolved to user ObjectIds (cached, see RESOLVER_CACHE_* in .env)
+* Each user's folders are listed page by page, then the matching messages
+  deleted in listing order.  `--workers` users are purged concurrently, over
+  that many keep-alive connections, using the admin credentials in .env
+* A failed delete is recorded and the purge carries on; messages which are
+  already gone (404) count as deleted
+
+Usage:
+
+    python cumi_purge_mailboxes.py users.txt --older-than 90 --folders inbox,deleted
+    python cumi_purge_mailboxes.py users.txt --read-only --workers 16 --results purge.ndjson
+    python cumi_purge_mailboxes.py users.txt --older-than 30 --dry-run
+
+The users file lists one alias per line (lines starting with # are ignored).
+Throughput is reported in messages deleted per second.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from requests.exceptions import HTTPError, RequestException
+import urllib3
+from cumi_mailbox import iterFolderMessages
+from cuc_resolver_cache import cacheFromEnv
+from cuc_session_pool import poolFromEnv
+from cuc_metrics import metricsFromEnv
+from cuc_response import first
+
+# Edit .env file to specify your CUC address and user credentials
+from dotenv import load_dotenv
+load_dotenv( override = True )
+
+parser = argparse.ArgumentParser( description = 'Delete messages from many CUC mailboxes via CUMI' )
+parser.add_argument( 'usersFile', help = 'File listing user aliases, one per line' )
+parser.add_argument( '--folders', default = 'inbox',
+    help = 'Comma separated folders to purge: inbox, sent, deleted (default: inbox)' )
+parser.add_argument( '--older-than', type = float,
+    help = 'Only delete messages which arrived more than this many days ago (messages without an ArrivalTime are kept)' )
+parser.add_argument( '--read-only', action = 'store_true', help = 'Only delete messages which have been read' )
+parser.add_argument( '--workers', type = int, default = 8,
+    help = 'Number of users purged concurrently (default: 8)' )
+parser.add_argument( '--dry-run', action = 'store_true', help = 'List and count the matching messages, without deleting' )
+parser.add_argument( '--results', help = 'Write per-user results to this NDJSON file' )
+args = parser.parse_args()
+
+# CUC self-signed certs do no have a (deprecated) subjectAltName,
+# disable the warning.
+urllib3.disable_warnings( urllib3.exceptions.SubjectAltNameWarning )
+# Certificate checking is disabled unless CUC_CERT is configured in .env
+if not os.getenv( 'CUC_CERT' ):
+    urllib3.disable_warnings( urllib3.exceptions.InsecureRequestWarning )
+
+baseUrl = f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest'
+
+# Alias -> ObjectId lookups are cached (and can be persisted between runs)
+resolverCache = cacheFromEnv()
+
+# All workers share one pooled Session, one keep-alive connection per worker
+pool = poolFromEnv( poolSize = args.workers )
+session = pool.session( os.getenv( 'CUC_HOSTNAME' ), os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) )
+session.headers.update( { 'Accept': 'application/json' } )
+pool.addHook( resolverCache.responseHook )
+
+# Per-endpoint latency metrics, see METRICS_* in .env
+metrics = metricsFromEnv()
+metrics.install( pool )
+
+folders = [ folder.strip() for folder in args.folders.split( ',' ) if folder.strip() ]
+
+# ArrivalTime is in milliseconds since the epoch
+cutoffTime = ( time.time() - args.older_than * 86400 ) * 1000 if args.older_than is not None else None
+
+# Format a failed request the same way the single-user samples do
+def describeError( operation, err ):
+    if isinstance( err, HTTPError ):
+        return f'{ operation } Status Code: { err.response.status_code } URL:{ err.response.url } { err.response.content.decode( "utf-8", errors = "ignore" ) }'
+    return f'{ operation } { err }'
+
+# User aliases in file order, without duplicates (ignoring case)
+def readAliases( fileName ):
+    aliases = {}
+    with open( fileName, encoding = 'utf-8' ) as f:
+        for line in f:
+            alias = line.strip()
+            if alias and not alias.startswith( '#' ):
+                aliases.setdefault( alias.lower(), alias )
+    return list( aliases.values() )
+
+def lookupUser( alias ):
+    resp = session.get( f'{ baseUrl }/users', params = { 'query': f'(alias is { alias })' } )
+    resp.raise_for_status()
+    user = first( resp, 'User' )
+    return user[ 'ObjectId' ] if user else None
+
+def matches( message ):
+    if cutoffTime is not None:
+        # A message without an ArrivalTime can't be shown to be old enough: keep it
+        if not message.get( 'ArrivalTime' ) or int( message[ 'ArrivalTime' ] ) >= cutoffTime:
+            return False
+    if args.read_only and message.get( 'Read' ) is not True:
+        return False
+    return True
+
+deleted = 0
+countLock = threading.Lock()
+
+# Purge one user's folders, returning a result record.  The matching MsgIds
+# of a folder are collected before deleting any, as deletes shift the later pages
+def purgeUser( alias, userObjectId ):
+    global deleted
+    result = { 'Alias': alias, 'ObjectId': userObjectId, 'listed': 0, 'matched': 0, 'deleted': 0, 'failed': 0, 'errors': [] }
+    try:
+        for folder in folders:
+            try:
+                msgIds = []
+                for message in iterFolderMessages( session, baseUrl, folder, userObjectId ):
+                    result[ 'listed' ] += 1
+                    if matches( message ):
+                        msgIds.append( message[ 'MsgId' ] )
+            except RequestException as err:
+                result[ 'errors' ].append( describeError( f'GET /folders/{ folder }/messages', err ) )
+                continue
+            result[ 'matched' ] += len( msgIds )
+            if args.dry_run:
+                continue
+            for msgId in msgIds:
+                try:
+                    resp = session.delete( f'{ baseUrl }/messages/{ msgId }', params = { 'userobjectid': userObjectId } )
+                    # Already deleted, e.g. by the user or an earlier run
+                    if resp.status_code != 404:
+                        resp.raise_for_status()
+                except RequestException as err:
+                    result[ 'failed' ] += 1
+                    # Keep the first few errors, not one per message
+                    if len( result[ 'errors' ] ) < 5:
+                        result[ 'errors' ].append( describeError( 'DELETE /messages', err ) )
+                    continue
+                result[ 'deleted' ] += 1
+                with countLock:
+                    deleted += 1
+    except Exception as err:
+        # Anything unexpected fails this user's result, rather than losing it
+        result[ 'errors' ].append( f'{ type( err ).__name__ }: { err }' )
+    return result
+
+aliases = readAliases( args.usersFile )
+
+print( f'\nPurging { ", ".join( folders ) } for { len( aliases ) } users, { args.workers } at a time{ " (dry run)" if args.dry_run else "" }\n' )
+
+startTime = time.perf_counter()
+
+userObjectIds, lookupErrors = resolverCache.resolveMany( 'alias', aliases, lookupUser, workers = args.workers )
+
+results = []
+resultsLock = threading.Lock()
+
+def recordResult( result ):
+    with resultsLock:
+        results.append( result )
+        if result[ 'errors' ] or not result[ 'ObjectId' ]:
+            print( f'Request error: { result[ "Alias" ] }: { "; ".join( result[ "errors" ] ) or "user not found" }' )
+        else:
+            print( f'{ result[ "Alias" ] }: { result[ "matched" ] } of { result[ "listed" ] } messages'
+                f' { "matched" if args.dry_run else "deleted" }' )
+
+with ThreadPoolExecutor( max_workers = args.workers ) as executor:
+    for alias in aliases:
+        if alias in lookupErrors:
+            recordResult( { 'Alias': alias, 'ObjectId': None, 'listed': 0, 'matched': 0, 'deleted': 0, 'failed': 0,
+                'errors': [ describeError( 'GET /users', lookupErrors[ alias ] ) ] } )
+        elif not userObjectIds[ alias ]:
+            recordResult( { 'Alias': alias, 'ObjectId': None, 'listed': 0, 'matched': 0, 'deleted': 0, 'failed': 0, 'errors': [] } )
+        else:
+            executor.submit( purgeUser, alias, userObjectIds[ alias ] ).add_done_callback( lambda future: recordResult( future.result() ) )
+
+elapsed = time.perf_counter() - startTime
+
+pool.close()
+
+if args.results:
+    with open( args.results, 'w', encoding = 'utf-8' ) as f:
+        for result in results:
+            f.write( json.dumps( result ) + '\n' )
+
+failedUsers = sum( 1 for result in results if result[ 'errors' ] or not result[ 'ObjectId' ] )
+print( f'\nPurge: { len( aliases ) } users, { failedUsers } with errors' )
+print( f'Messages: { sum( result[ "listed" ] for result in results ) } listed,'
+    f' { sum( result[ "matched" ] for result in results ) } matched,'
+    f' { deleted } deleted, { sum( result[ "failed" ] for result in results ) } failed' )
+print( f'Elapsed: { elapsed :.2f}s, { deleted / elapsed if elapsed else 0 :.1f} messages deleted/sec' )
+print( f'Connections opened: { pool.stats()[ "handshakes" ] }\n' )
+
+metrics.report()
+
+if failedUsers:
+    sys.exit( 1 )
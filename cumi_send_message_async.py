@@ -0,0 +1,280 @@
+'''
+Cisco Unity Connection asyncio send message script using the CUPI/CUMI APIs
+
+Runs the same sequence as cumi_send_message.py, but for many independent
+test users at once on a single asyncio event loop (using aiohttp):
+
+* Creates a test user
+* Sets the user's password
+* Performs a user address lookup
+* Sends a message with audio file attachment
+* Deletes all messages in the user's inbox
+* Deletes the user
+
+Each workflow uses its own alias/extension, built from --alias-prefix and
+--extension-start plus the workflow number.  All workflows share one
+connection pool, limited by --limit-per-host.
+
+Usage:
+
+    python cumi_send_message_async.py --workflows 200 --concurrency 50 --limit-per-host 20
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import aiohttp
+import argparse
+import asyncio
+import json
+import os
+import ssl
+import sys
+import time
+from cumi_multipart import MessageBody
+from cuc_governor import AsyncGovernor, GovernedClient, governorFromEnv
+from cuc_response import items, objectIdFromLocation
+
+print()
+
+# Edit .env file to specify your CUC hostname and API admin user credentials
+from dotenv import load_dotenv
+load_dotenv( override = True )
+
+parser = argparse.ArgumentParser( description = 'Run many CUMI send message workflows concurrently' )
+parser.add_argument( '--workflows', type = int, default = 10,
+    help = 'Total number of user/message workflows to run (default: 10)' )
+parser.add_argument( '--concurrency', type = int, default = 10,
+    help = 'Maximum number of workflows in progress at once (default: 10)' )
+parser.add_argument( '--limit-per-host', type = int, default = 20,
+    help = 'Maximum simultaneous connections to the CUC host (default: 20)' )
+parser.add_argument( '--alias-prefix', default = 'testUser',
+    help = 'Test user alias prefix (default: testUser)' )
+parser.add_argument( '--extension-start', type = int, default = 987650000,
+    help = 'First test user extension (default: 987650000)' )
+parser.add_argument( '--delivery-timeout', type = float, default = 30,
+    help = 'Maximum seconds to wait for message delivery (default: 30)' )
+args = parser.parse_args()
+
+baseUrl = f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest'
+password = '0xFt3i4#%p$V'
+
+# Every workflow sends the same recording - if AUDIO_TRANSCODE is set in .env
+# it is converted to 8Khz G.711 once, up front
+audioPath = 'message.wav'
+if os.getenv( 'AUDIO_TRANSCODE' ):
+    # NumPy is only loaded when transcoding is enabled
+    from cumi_audio import transcodeFromEnv
+    audioPath = transcodeFromEnv( audioPath )
+
+# If the CUC 'tomcat' certificate location is configured in .env,
+# enable server certificate checking for requests
+if os.getenv( 'CUC_CERT' ):
+    sslContext = ssl.create_default_context( cafile = os.getenv( 'CUC_CERT' ) )
+# Else disable certificate checking
+else:
+    sslContext = False
+
+adminCredentials = aiohttp.BasicAuth( os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) )
+
+# Concurrency governor, see GOVERNOR_* in .env
+governor = governorFromEnv( AsyncGovernor )
+
+# Seconds from each message send being accepted to it appearing in the inbox
+deliveryLatencies = []
+
+# Aliases of the test users which could not be deleted afterwards
+cleanupFailures = []
+
+# Raised to abandon a single workflow after a failed request
+class WorkflowError( Exception ):
+    pass
+
+# Check a response, printing error details the same way as
+# cumi_send_message.py's HTTPError handlers
+async def checkResponse( resp, operation ):
+    if resp.status < 400:
+        return
+    content = await resp.read()
+    try:
+        status = json.loads( content )[ 'errors' ][ 'code' ]
+    except ( ValueError, KeyError, TypeError ):
+        status = ''
+    print( f'Request error: { operation }: Status Code:{ resp.status } { status } URL:{ resp.url }' )
+    print( f'Error: { content.decode( "utf-8", errors = "ignore" ) }' )
+    if operation == 'POST /users' and resp.status == 400:
+        print( 'This error may be due to existing duplicate alias/extension.\n' )
+    raise WorkflowError( operation )
+
+# Poll the inbox with exponential backoff (0.1s doubling up to 2s) until it
+# holds a message, returning the messages, or an empty list on timeout
+async def waitForMessages( http, userObjectId, userCredentials ):
+    deadline = time.monotonic() + args.delivery_timeout
+    interval = 0.1
+    while True:
+        await asyncio.sleep( min( interval, max( deadline - time.monotonic(), 0 ) ) )
+        async with http.get(
+            f'{ baseUrl }/mailbox/folders/inbox/messages',
+            params = { 'userobjectid': userObjectId },
+            auth = userCredentials ) as resp:
+            await checkResponse( resp, 'GET /messages' )
+            # A single message is returned as a singleton - items() makes it a list
+            messages = items( await resp.read(), 'Message' )
+        if messages or time.monotonic() >= deadline:
+            return messages
+        interval = min( interval * 2, 2.0 )
+
+async def runWorkflow( http, index ):
+    alias = f'{ args.alias_prefix }{ index:05d}'
+    extension = str( args.extension_start + index )
+    userCredentials = aiohttp.BasicAuth( alias, password )
+
+    # Create a new test user
+    async with http.post(
+        f'{ baseUrl }/users',
+        params = { 'templateAlias': 'voicemailusertemplate' },
+        auth = adminCredentials,
+        json = { 'Alias': alias, 'DtmfAccessId': extension } ) as resp:
+        await checkResponse( resp, 'POST /users' )
+        # Parse the new user's ObjectId from the end of the Location header URL
+        userObjectId = objectIdFromLocation( resp )
+
+    try:
+        # Set the password for the new user
+        async with http.put(
+            f'{ baseUrl }/users/{ userObjectId }/credential/password',
+            auth = adminCredentials,
+            json = {
+                'Credentials': password,
+                'CantChange': False,
+                'DoesntExpire': True,
+                'Locked': False,
+                'CredMustChange': False } ) as resp:
+            await checkResponse( resp, 'PUT /password' )
+
+        # Query the mailbox address list using the new user's own name
+        async with http.get(
+            f'{ baseUrl }/mailbox/addresses',
+            params = { 'name': alias },
+            auth = userCredentials ) as resp:
+            await checkResponse( resp, 'GET /addresses' )
+            # A single address is returned as a singleton - items() makes it a list
+            addressObjectId = items( await resp.read(), 'Address' )[ 0 ][ 'ObjectId' ]
+
+        message = json.dumps( {
+            'Subject': 'testMessage',
+            'Priority': 'Normal',
+            'Sensitivity': 'Normal',
+            'ReadReceiptRequested': False,
+            'Secure': True } )
+
+        recipients = json.dumps( {
+            'Recipient': [
+                {
+                    'Type': 'TO',
+                    'Address': { 'UserGuid': addressObjectId }
+                }
+            ] } )
+
+        # CUMI needs the hand-built multipart body, streamed from the audio file
+        requestBody = MessageBody( message, recipients, audioPath )
+
+        async with http.post(
+            f'{ baseUrl }/messages',
+            params = { 'userobjectid': userObjectId },
+            auth = userCredentials,
+            headers = {
+                'Content-Type': requestBody.contentType,
+                'Content-Length': str( len( requestBody ) ) },
+            data = requestBody ) as resp:
+            await checkResponse( resp, 'POST /messages' )
+        sentTime = time.perf_counter()
+
+        # Retrieve the messages in the inbox, as soon as the message is delivered
+        messages = await waitForMessages( http, userObjectId, userCredentials )
+        if not messages:
+            print( f'Delivery error: { alias }: message not delivered within { args.delivery_timeout :.0f}s' )
+            raise WorkflowError( 'message not delivered' )
+        deliveryLatencies.append( time.perf_counter() - sentTime )
+
+        # Delete all the messages in the inbox
+        for message in messages:
+            async with http.delete(
+                f'{ baseUrl }/messages/{ message[ "MsgId" ] }',
+                auth = userCredentials ) as resp:
+                await checkResponse( resp, 'DELETE /messages' )
+
+        return len( messages )
+
+    finally:
+        # Always clean up the user we created, using the admin credentials.  A
+        # failure is reported separately, so it doesn't hide the workflow's own error
+        try:
+            async with http.delete(
+                f'{ baseUrl }/users/{ userObjectId }',
+                auth = adminCredentials ) as resp:
+                await checkResponse( resp, 'DELETE /users' )
+        except Exception as err:
+            if not isinstance( err, WorkflowError ):
+                print( f'Request error: DELETE /users: { err!r}' )
+            cleanupFailures.append( alias )
+
+async def main():
+    # Limit simultaneous workflows, and connections to the CUC host
+    workflowSlots = asyncio.Semaphore( args.concurrency )
+    connector = aiohttp.TCPConnector( limit = args.limit_per_host, limit_per_host = args.limit_per_host, ssl = sslContext )
+
+    # The CUC JSESSIONID cookie identifies the authenticated user,
+    # so don't share cookies between the admin and many end-users
+    async with aiohttp.ClientSession(
+        connector = connector,
+        cookie_jar = aiohttp.DummyCookieJar(),
+        headers = { 'Accept': 'application/json' } ) as clientSession:
+
+        # Adapt the requests in flight to CUC's throttling, retrying 429/503s
+        http = GovernedClient( clientSession, governor ) if governor else clientSession
+
+        async def limitedWorkflow( index ):
+            async with workflowSlots:
+                return await runWorkflow( http, index )
+
+        startTime = time.perf_counter()
+        results = await asyncio.gather(
+            *( limitedWorkflow( index ) for index in range( args.workflows ) ),
+            return_exceptions = True )
+        elapsed = time.perf_counter() - startTime
+
+    failures = [ result for result in results if isinstance( result, BaseException ) ]
+    for failure in failures:
+        if not isinstance( failure, WorkflowError ):
+            print( f'Request error: { failure!r}' )
+
+    succeeded = len( results ) - len( failures )
+    print( f'\nWorkflows: { len( results ) }, { succeeded } succeeded, { len( failures ) } failed' )
+    print( f'Elapsed: { elapsed :.2f}s, { succeeded / elapsed if elapsed else 0 :.1f} workflows/sec' )
+    if deliveryLatencies:
+        deliveryLatencies.sort()
+        print( f'Delivery latency: p50 { deliveryLatencies[ len( deliveryLatencies ) // 2 ] * 1000 :.0f} ms, max { deliveryLatencies[ -1 ] * 1000 :.0f} ms' )
+    if cleanupFailures:
+        print( f'Cleanup failed, test users left behind: { ", ".join( sorted( cleanupFailures ) ) }' )
+    if governor:
+        print( f'Throttled requests retried: { governor.stats()[ "retried" ] }' )
+    print()
+    return not failures and not cleanupFailures
+
+if not asyncio.run( main() ):
+    sys.exit( 1 )
@@ -0,0 +1,276 @@
+'''
+Cisco Unity Connection CUNI notification ingestion pipeline
+
+CUC expects the callback service to answer notifications promptly - if the
+callback backs up, the subscription gets dropped.  EventPipeline decouples
+receiving from processing: the Flask route just calls submit() with the raw
+SOAP payload, which is put on a bounded queue (or counted as dropped if the
+queue is full) and returns immediately.  A pool of worker threads parses the
+payloads with lxml and hands the events, in batches, to one or more sinks:
+
+    pipeline = EventPipeline( [ SqliteEventSink( 'events.db' ) ] )
+    pipeline.start()
+    ...
+    pipeline.submit( request.get_data() )
+
+Sinks are registered before start(): the workers don't expect the list to
+change under them.
+
+Each parsed event is a flat dict of the notification's leaf elements, keyed by
+element local-name (e.g. eventType, subscriptionId), plus `receivedTime`.
+Use eventMailbox()/eventMsgId() to read the mailbox and message ids.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from collections import deque
+from lxml import etree
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# Element names which may carry the mailbox/user and message ids
+MAILBOX_FIELDS = ( 'mailboxId', 'userGuid', 'resourceId', 'userId', 'alias' )
+MESSAGE_FIELDS = ( 'messageId', 'msgId' )
+
+def eventField( event, names ):
+    for name in names:
+        if event.get( name ):
+            return event[ name ]
+    return None
+
+def eventMailbox( event ):
+    return eventField( event, MAILBOX_FIELDS )
+
+def eventMsgId( event ):
+    return eventField( event, MESSAGE_FIELDS )
+
+# lxml parsers should not be shared between threads
+_parsers = threading.local()
+
+def _parser():
+    parser = getattr( _parsers, 'parser', None )
+    if parser is None:
+        parser = etree.XMLParser( resolve_entities = False, no_network = True, remove_blank_text = True )
+        _parsers.parser = parser
+    return parser
+
+# Parse a CUNI notification SOAP payload into a list of event dicts.
+# Every element containing an `eventType` child is treated as one event, and
+# its leaf descendants are flattened into the dict.
+def parseEvents( payload ):
+    root = etree.fromstring( payload, _parser() )
+    events = []
+    for eventType in root.iter( '{*}eventType' ):
+        container = eventType.getparent()
+        event = {}
+        for element in container.iter():
+            if len( element ) == 0 and isinstance( element.tag, str ):
+                event.setdefault( etree.QName( element ).localname, ( element.text or '' ).strip() )
+        events.append( event )
+    return events
+
+# Persist events into a SQLite table, one transaction per batch
+class SqliteEventSink:
+
+    def __init__( self, path ):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect( path, check_same_thread = False )
+        self.db.execute( 'PRAGMA journal_mode=WAL' )
+        self.db.execute( '''CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            receivedTime REAL,
+            eventType TEXT,
+            subscriptionId TEXT,
+            mailbox TEXT,
+            msgId TEXT,
+            event TEXT )''' )
+        self.db.execute( 'CREATE INDEX IF NOT EXISTS events_mailbox ON events ( mailbox, receivedTime )' )
+        self.db.commit()
+
+    def write( self, events ):
+        rows = [ (
+            event[ 'receivedTime' ],
+            event.get( 'eventType' ),
+            event.get( 'subscriptionId' ),
+            eventMailbox( event ),
+            eventMsgId( event ),
+            json.dumps( event ) ) for event in events ]
+        with self.lock:
+            self.db.executemany(
+                'INSERT INTO events ( receivedTime, eventType, subscriptionId, mailbox, msgId, event ) VALUES ( ?, ?, ?, ?, ?, ? )',
+                rows )
+            self.db.commit()
+
+    def close( self ):
+        with self.lock:
+            self.db.close()
+
+# Append events to an NDJSON file, rotating it to path.1 .. path.<backupCount>
+# once it exceeds maxBytes
+class NdjsonEventSink:
+
+    def __init__( self, path, maxBytes = 100 * 1024 * 1024, backupCount = 5 ):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.lock = threading.Lock()
+        self.file = open( path, 'a', encoding = 'utf-8' )
+
+    def rotate( self ):
+        self.file.close()
+        for index in range( self.backupCount - 1, 0, -1 ):
+            if os.path.exists( f'{ self.path }.{ index }' ):
+                os.replace( f'{ self.path }.{ index }', f'{ self.path }.{ index + 1 }' )
+        if self.backupCount:
+            os.replace( self.path, f'{ self.path }.1' )
+        self.file = open( self.path, 'w', encoding = 'utf-8' )
+
+    def write( self, events ):
+        lines = ''.join( json.dumps( event ) + '\n' for event in events )
+        with self.lock:
+            self.file.write( lines )
+            self.file.flush()
+            if self.file.tell() >= self.maxBytes:
+                self.rotate()
+
+    def close( self ):
+        with self.lock:
+            self.file.close()
+
+# Print events to the console, as the original logger did
+class PrintEventSink:
+
+    def write( self, events ):
+        for event in events:
+            print( json.dumps( event ) )
+
+# Pick a sink from a file name: .db/.sqlite for SQLite, otherwise NDJSON
+def sinkForPath( path ):
+    if path.endswith( ( '.db', '.sqlite', '.sqlite3' ) ):
+        return SqliteEventSink( path )
+    return NdjsonEventSink( path )
+
+class EventPipeline:
+
+    def __init__( self, sinks, queueSize = 10000, workers = 2, batchSize = 200, flushInterval = 1.0 ):
+        self.sinks = list( sinks )
+        self.queue = queue.Queue( maxsize = queueSize )
+        self.workerCount = workers
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.threads = []
+        self.running = False
+        self.statsLock = threading.Lock()
+        self.received = 0
+        self.dropped = 0
+        self.parseErrors = 0
+        self.sinkErrors = 0
+        self.eventsWritten = 0
+        self.parseTimes = deque( maxlen = 1024 )
+
+    # Called from the HTTP request thread: never blocks
+    def submit( self, payload ):
+        try:
+            self.queue.put_nowait( ( time.time(), payload ) )
+        except queue.Full:
+            with self.statsLock:
+                self.dropped += 1
+            return False
+        with self.statsLock:
+            self.received += 1
+        return True
+
+    def start( self ):
+        self.running = True
+        for index in range( self.workerCount ):
+            thread = threading.Thread( target = self.work, name = f'cuni-event-worker-{ index }', daemon = True )
+            thread.start()
+            self.threads.append( thread )
+
+    def stop( self ):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        for sink in self.sinks:
+            if hasattr( sink, 'close' ):
+                sink.close()
+
+    def flush( self, batch ):
+        for sink in self.sinks:
+            try:
+                sink.write( batch )
+            except Exception as err:
+                print( f'Event sink error: { type( sink ).__name__ }: { err }' )
+                with self.statsLock:
+                    self.sinkErrors += 1
+        with self.statsLock:
+            self.eventsWritten += len( batch )
+
+    def work( self ):
+        batch = []
+        batchStart = None
+        while self.running or not self.queue.empty():
+            try:
+                receivedTime, payload = self.queue.get( timeout = self.flushInterval )
+            except queue.Empty:
+                payload = None
+            if payload is not None:
+                startTime = time.perf_counter()
+                # Any failure to parse one payload is counted, and never
+                # stops the worker
+                try:
+                    events = parseEvents( payload )
+                except Exception as err:
+                    print( f'Event parse error: { type( err ).__name__ }: { err }' )
+                    with self.statsLock:
+                        self.parseErrors += 1
+                    events = []
+                parseTime = time.perf_counter() - startTime
+                with self.statsLock:
+                    self.parseTimes.append( parseTime )
+                for event in events:
+                    event[ 'receivedTime' ] = receivedTime
+                if events and not batch:
+                    batchStart = time.monotonic()
+                batch.extend( events )
+            if batch and ( len( batch ) >= self.batchSize or time.monotonic() - batchStart >= self.flushInterval ):
+                self.flush( batch )
+                batch = []
+        if batch:
+            self.flush( batch )
+
+    def stats( self ):
+        with self.statsLock:
+            parseTimes = sorted( self.parseTimes )
+            return {
+                'queueDepth': self.queue.qsize(),
+                'queueSize': self.queue.maxsize,
+                'received': self.received,
+                'dropped': self.dropped,
+                'parseErrors': self.parseErrors,
+                'sinkErrors': self.sinkErrors,
+                'eventsWritten': self.eventsWritten,
+                'parseLatencyMs': {
+                    'avg': 1000 * sum( parseTimes ) / len( parseTimes ) if parseTimes else 0,
+                    'p99': 1000 * parseTimes[ int( len( parseTimes ) * 0.99 ) ] if parseTimes else 0,
+                    'max': 1000 * parseTimes[ -1 ] if parseTimes else 0 } }
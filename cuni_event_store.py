@@ -0,0 +1,177 @@
+'''
+Cisco Unity Connection in-memory CUNI event store
+
+Holds the most recent `capacity` events received by the notification logger
+in a fixed-size ring buffer, for queries such as "the last 20 events for
+jsmith" or "events per type in the last minute".
+
+Memory use is fixed up front: events are stored column-wise in preallocated
+arrays (receive time, event type, mailbox, subscription, MsgId, link to the
+mailbox's previous event), about 36 bytes per event plus the MsgId string.
+Event types, mailboxes and subscription ids are interned into small integer
+ids, so repeated values cost nothing per event.  Each mailbox's events are
+chained through the `previous` column, so per-user queries don't scan the
+buffer and the index needs no extra memory per event.  Once full, each new
+event overwrites the oldest one.  Per-type counts are kept separately, in
+one-second buckets for the last hour, so they don't depend on the capacity.
+
+    store = EventStore( capacity = 1000000 )
+    pipeline.sinks.append( store )
+    store.recent( 'jsmith', 20 )
+    store.countsByType( 60 )
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from array import array
+import os
+import threading
+import time
+from cuni_event_pipeline import eventMailbox, eventMsgId
+
+# Seconds of per-type event counts kept for countsByType()
+COUNT_HISTORY = 3600
+
+# String <-> small integer id table
+class Interner:
+
+    def __init__( self ):
+        self.ids = {}
+        self.values = []
+
+    def id( self, value ):
+        valueId = self.ids.get( value )
+        if valueId is None:
+            valueId = self.ids[ value ] = len( self.values )
+            self.values.append( value )
+        return valueId
+
+    def __len__( self ):
+        return len( self.values )
+
+class EventStore:
+
+    def __init__( self, capacity = 100000 ):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.times = array( 'd', bytes( 8 * capacity ) )
+        self.types = array( 'I', bytes( 4 * capacity ) )
+        self.mailboxes = array( 'I', bytes( 4 * capacity ) )
+        self.subscriptions = array( 'I', bytes( 4 * capacity ) )
+        # Sequence number of the same mailbox's previous event, -1 if none
+        self.previous = array( 'q', bytes( 8 * capacity ) )
+        self.msgIds = [ None ] * capacity
+        self.eventTypes = Interner()
+        self.mailboxIds = Interner()
+        self.subscriptionIds = Interner()
+        # mailbox id -> sequence number of its latest event
+        self.latest = {}
+        # Sequence number of the next event; event n lives in slot n % capacity
+        self.sequence = 0
+        # Per-second { event type id: count } buckets, and the second each is for
+        self.bucketSeconds = array( 'q', [ -1 ] * COUNT_HISTORY )
+        self.buckets = [ {} for _ in range( COUNT_HISTORY ) ]
+
+    # Oldest sequence number still in the buffer
+    def oldest( self ):
+        return max( 0, self.sequence - self.capacity )
+
+    # EventPipeline sink interface
+    def write( self, events ):
+        with self.lock:
+            for event in events:
+                slot = self.sequence % self.capacity
+                mailboxId = self.mailboxIds.id( ( eventMailbox( event ) or '' ).lower() )
+                receivedTime = event.get( 'receivedTime' ) or time.time()
+                typeId = self.eventTypes.id( event.get( 'eventType' ) or '' )
+                self.times[ slot ] = receivedTime
+                self.types[ slot ] = typeId
+                self.mailboxes[ slot ] = mailboxId
+                self.subscriptions[ slot ] = self.subscriptionIds.id( event.get( 'subscriptionId' ) or '' )
+                self.msgIds[ slot ] = eventMsgId( event )
+                self.previous[ slot ] = self.latest.get( mailboxId, -1 )
+                self.latest[ mailboxId ] = self.sequence
+                self.sequence += 1
+                self.count( int( receivedTime ), typeId )
+
+    def count( self, second, typeId ):
+        index = second % COUNT_HISTORY
+        if self.bucketSeconds[ index ] != second:
+            # Events more than COUNT_HISTORY seconds late are not counted
+            if self.bucketSeconds[ index ] > second:
+                return
+            self.bucketSeconds[ index ] = second
+            self.buckets[ index ] = {}
+        bucket = self.buckets[ index ]
+        bucket[ typeId ] = bucket.get( typeId, 0 ) + 1
+
+    def record( self, sequence ):
+        slot = sequence % self.capacity
+        return {
+            'receivedTime': self.times[ slot ],
+            'eventType': self.eventTypes.values[ self.types[ slot ] ],
+            'mailbox': self.mailboxIds.values[ self.mailboxes[ slot ] ],
+            'subscriptionId': self.subscriptionIds.values[ self.subscriptions[ slot ] ],
+            'msgId': self.msgIds[ slot ] }
+
+    # The mailbox's (alias or user ObjectId) most recent events, newest first
+    def recent( self, mailbox, limit = 20 ):
+        with self.lock:
+            mailboxId = self.mailboxIds.ids.get( mailbox.lower() )
+            sequence = self.latest.get( mailboxId, -1 )
+            oldest = self.oldest()
+            records = []
+            while sequence >= oldest and len( records ) < limit:
+                records.append( self.record( sequence ) )
+                sequence = self.previous[ sequence % self.capacity ]
+            return records
+
+    # The most recent events for all mailboxes, newest first
+    def latestEvents( self, limit = 20 ):
+        with self.lock:
+            return [ self.record( sequence ) for sequence in range( self.sequence - 1, max( self.oldest(), self.sequence - limit ) - 1, -1 ) ]
+
+    # Event counts per type received in the last `seconds` (up to COUNT_HISTORY),
+    # to one second resolution
+    def countsByType( self, seconds = 60 ):
+        now = int( time.time() )
+        since = now - min( int( seconds ), COUNT_HISTORY ) + 1
+        with self.lock:
+            counts = {}
+            for second in range( since, now + 1 ):
+                index = second % COUNT_HISTORY
+                if self.bucketSeconds[ index ] == second:
+                    for typeId, count in self.buckets[ index ].items():
+                        counts[ typeId ] = counts.get( typeId, 0 ) + count
+            return { self.eventTypes.values[ typeId ]: count for typeId, count in counts.items() }
+
+    def stats( self ):
+        with self.lock:
+            return {
+                'capacity': self.capacity,
+                'stored': self.sequence - self.oldest(),
+                'received': self.sequence,
+                'overwritten': self.oldest(),
+                'mailboxes': len( self.mailboxIds ),
+                'eventTypes': len( self.eventTypes ),
+                'oldestTime': self.times[ self.oldest() % self.capacity ] if self.sequence else None }
+
+# Create a store sized by EVENT_MEMORY_CAPACITY in .env, or None if it is 0
+def storeFromEnv():
+    capacity = int( os.getenv( 'EVENT_MEMORY_CAPACITY', 100000 ) )
+    return EventStore( capacity ) if capacity > 0 else None
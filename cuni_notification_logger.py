@@ -5,6 +5,19 @@ Creates a notification event subscription via CUNI, monitoring all mailbox
 events for the two users configured in .env.  Note, the users must exist
 before before running the sample.
 
+Additional users can be listed in the file named by VM_USERS_FILE; large
+lists are split across several subscriptions, which are renewed automatically
+before they expire (see the SUBSCRIPTION_* settings in .env.example).
+
+If MAILBOX_MIRROR is set, the subscribed mailboxes' message metadata is
+mirrored to a local SQLite database, seeded by listing each mailbox and kept
+current from the incoming events; unread counts are then served locally at
+GET /mailboxes/unread.
+
+If WEBHOOK_URLS is set, the events are also forwarded as JSON batches to each
+of the listed HTTP consumers (see cuni_webhook_forwarder.py), with per-consumer
+statistics at GET /webhooks.
+
 Getting started: 
 
 * Identify or create two mailbox users in CUC
@@ -35,15 +48,20 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
-from flask import Flask, request
-import requests
-from requests.auth import HTTPBasicAuth
+from flask import Flask, request, jsonify
 import logging
 from http.client import HTTPConnection
-from lxml import etree
 import socket
 import datetime
 import os
+from cuni_event_pipeline import EventPipeline, PrintEventSink, sinkForPath
+from cuni_subscription_manager import SubscriptionManager
+from cumi_mailbox_mirror import MailboxMirror, resolveMailboxes
+from cuni_event_store import storeFromEnv
+from cuni_webhook_forwarder import forwarderFromEnv
+import threading
+from cuc_session_pool import poolFromEnv
+from cuc_metrics import metricsFromEnv
 
 # Edit .env file to specify your CUC address and user credentials
 from dotenv import load_dotenv
@@ -55,17 +73,117 @@ DEBUG = os.getenv( 'DEBUG' )
 # Instantiate the Flask application
 app = Flask(__name__)
 
+# Incoming notifications are queued and processed by background workers, so
+# CUC's callbacks are answered immediately.  Set EVENT_STORE in .env to
+# persist events to a SQLite (.db) or rotating NDJSON file, otherwise they are
+# printed to the console
+if os.getenv( 'EVENT_STORE' ):
+    eventSinks = [ sinkForPath( os.getenv( 'EVENT_STORE' ) ) ]
+else:
+    eventSinks = [ PrintEventSink() ]
+
+# The most recent events are also kept in a fixed-size in-memory store
+# (EVENT_MEMORY_CAPACITY in .env), queried via the /events routes
+eventStore = storeFromEnv()
+if eventStore:
+    eventSinks.append( eventStore )
+
+# Events are also forwarded in batches to the HTTP consumers listed in
+# WEBHOOK_URLS in .env, each with its own bounded buffer and sender thread
+webhookForwarder = forwarderFromEnv()
+if webhookForwarder:
+    webhookForwarder.start()
+    eventSinks.append( webhookForwarder )
+
+pipeline = EventPipeline(
+    eventSinks,
+    queueSize = int( os.getenv( 'EVENT_QUEUE_SIZE', 10000 ) ),
+    workers = int( os.getenv( 'EVENT_WORKERS', 2 ) ),
+    batchSize = int( os.getenv( 'EVENT_BATCH_SIZE', 200 ) ) )
+
 # The Flask web app routes start below
 
 # This is the entry point of the app - navigate to https://localhost:5000 to start
 @app.route('/incomingMessages', methods = [ 'POST' ] )
 def incomingMessage():
 
-    print( request.data )
+    # Queue the raw SOAP payload - if the queue is full it is dropped (and
+    # counted), rather than holding up CUC
+    pipeline.submit( request.get_data() )
 
     return ( '', 200 )
 
-# Start main program, setup a CUNI subscription
+# Queue depth, drop counts and parse latency, for sizing the pipeline
+@app.route('/stats', methods = [ 'GET' ] )
+def stats():
+
+    return jsonify( pipeline.stats() )
+
+# Most recent events for all mailboxes, newest first (?limit=N, default 20)
+@app.route('/events', methods = [ 'GET' ] )
+def latestEvents():
+
+    if not eventStore:
+        return ( jsonify( { 'error': 'EVENT_MEMORY_CAPACITY is 0' } ), 404 )
+    return jsonify( eventStore.latestEvents( request.args.get( 'limit', 20, type = int ) ) )
+
+# Most recent events for one mailbox (alias or user ObjectId), newest first
+@app.route('/events/users/<mailbox>', methods = [ 'GET' ] )
+def userEvents( mailbox ):
+
+    if not eventStore:
+        return ( jsonify( { 'error': 'EVENT_MEMORY_CAPACITY is 0' } ), 404 )
+    return jsonify( eventStore.recent( mailbox, request.args.get( 'limit', 20, type = int ) ) )
+
+# Event counts by type over the last ?seconds=N (default 60), plus store usage
+@app.route('/events/counts', methods = [ 'GET' ] )
+def eventCounts():
+
+    if not eventStore:
+        return ( jsonify( { 'error': 'EVENT_MEMORY_CAPACITY is 0' } ), 404 )
+    return jsonify( {
+        'counts': eventStore.countsByType( request.args.get( 'seconds', 60, type = float ) ),
+        'store': eventStore.stats() } )
+
+# Unread inbox message counts per mirrored mailbox (MAILBOX_MIRROR in .env),
+# optionally only for ?mailbox=alias1,alias2
+@app.route('/mailboxes/unread', methods = [ 'GET' ] )
+def unreadCounts():
+
+    if not mailboxMirror:
+        return ( jsonify( { 'error': 'MAILBOX_MIRROR is not configured' } ), 404 )
+    mailboxes = request.args.get( 'mailbox' )
+    return jsonify( mailboxMirror.unreadCounts( mailboxes.split( ',' ) if mailboxes else None ) )
+
+# Mirrored message metadata for one mailbox, optionally ?folder=inbox
+@app.route('/mailboxes/<mailbox>/messages', methods = [ 'GET' ] )
+def mailboxMessages( mailbox ):
+
+    if not mailboxMirror:
+        return ( jsonify( { 'error': 'MAILBOX_MIRROR is not configured' } ), 404 )
+    return jsonify( mailboxMirror.messages( mailbox, request.args.get( 'folder' ) ) )
+
+# Per-consumer webhook buffer depth, coalesced/dropped/sent counts and send latency
+@app.route('/webhooks', methods = [ 'GET' ] )
+def webhooks():
+
+    if not webhookForwarder:
+        return ( jsonify( { 'error': 'WEBHOOK_URLS is not configured' } ), 404 )
+    return jsonify( webhookForwarder.stats() )
+
+# Current subscription shards, expirations and next renewal times
+@app.route('/subscriptions', methods = [ 'GET' ] )
+def subscriptions():
+
+    return jsonify( subscriptionManager.status() )
+
+# Subscribe/renew request latency, in Prometheus text format (METRICS=True in .env)
+@app.route('/metrics', methods = [ 'GET' ] )
+def httpMetrics():
+
+    return ( metrics.prometheus(), 200, { 'Content-Type': 'text/plain; version=0.0.4' } )
+
+# Start main program, setup the CUNI subscriptions
 
 if DEBUG:
 
@@ -89,48 +207,59 @@ else:
     hostAddress = sock.getsockname( )[ 0 ]
     sock.close()
 
-expireDateTime = ( datetime.datetime.now( tz = datetime.timezone.utc ) + datetime.timedelta( days = 1 ) ).isoformat( timespec ='seconds' )
-
-# resourceType: ignored, leave empty
-# eventTypeList: can be ALL_EVENTS or one or more of: 
-#       MESSAGE_INFO, NEW_MESSAGE, OPENED_MESSAGE, SAVED_MESSAGE, UNREAD_MESSAGE, 
-#       DELETED_MESSAGE, FAILOVER, NO_EVENTS, SUB_END, SUB_EXP, KEEP_ALIVE
-# resourceIdList: one or more VM user ids/aliases
-# callbackServiceUrl: Complete URL where notifcations should be sent
-# expiration: xsd:dateTime/ISO 8601 format time when the subscription expires
-# keepAliveInterval: 0 or 1 to disable or enable keepalive messages
-subReq = f'''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:even="http://unity.cisco.com/messageeventservice/event" xmlns:even1="http://event.messageeventservice.unity.cisco.com">
-<soapenv:Header/>
-    <soapenv:Body>
-        <even:subscribe>
-            <even:resourceType/>
-            <even:eventTypeList>
-                <even:string>ALL_EVENTS</even:string>
-            </even:eventTypeList>
-            <even:resourceIdList>
-                <even:string>{ os.getenv( "VM_USER_1" ) }</even:string>
-                <even:string>{ os.getenv( "VM_USER_2" ) }</even:string>
-            </even:resourceIdList>
-            <even:callbackServiceInfo>
-                <even1:callbackServiceUrl>http://{ hostAddress }:{ os.getenv( "APP_PORT" ) }/incomingMessages</even1:callbackServiceUrl>
-            </even:callbackServiceInfo>
-            <even:expiration>{ expireDateTime }</even:expiration>
-            <even:keepAliveInterval>1</even:keepAliveInterval>
-        </even:subscribe>
-    </soapenv:Body>
-</soapenv:Envelope>'''
-
-print( '\nRequest============' )
-print( subReq )
-print()
-
-resp = requests.post( 
+# Subscribe for VM_USER_1/VM_USER_2, plus any user aliases/ids listed
+# (one per line) in the file configured as VM_USERS_FILE in .env
+resourceIds = [ alias for alias in ( os.getenv( 'VM_USER_1' ), os.getenv( 'VM_USER_2' ) ) if alias ]
+
+if os.getenv( 'VM_USERS_FILE' ):
+    with open( os.getenv( 'VM_USERS_FILE' ), encoding = 'utf-8' ) as f:
+        resourceIds += [ line.strip() for line in f if line.strip() ]
+
+# The subscribe/renew requests share a pooled keep-alive session.
+# If the CUC 'tomcat' certificate location is configured in .env,
+# server certificate checking is enabled for requests
+pool = poolFromEnv()
+session = pool.session( os.getenv( 'CUC_HOSTNAME' ), os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) )
+metrics = metricsFromEnv()
+metrics.install( pool )
+
+# Large resource lists are split into several subscriptions (shards), which
+# are renewed before they expire and resubscribed on SUB_END/SUB_EXP/FAILOVER
+subscriptionManager = SubscriptionManager(
     f'https://{ os.getenv( "CUC_HOSTNAME" ) }/messageeventservice/services/MessageEventService',
-    auth=HTTPBasicAuth( os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) ),
-    headers = { 'Content-Type': 'text/xml', 'SOAPAction': '""' },
-    data = subReq,
-    verify = False
-    )
-
-print( '\nRESPONSE==========' )
-print( etree.tostring( etree.fromstring( resp.content ), pretty_print = True, encoding = 'unicode' ) )    
\ No newline at end of file
+    session,
+    f'http://{ hostAddress }:{ os.getenv( "APP_PORT" ) }/incomingMessages',
+    resourceIds,
+    shardSize = int( os.getenv( 'SUBSCRIPTION_SHARD_SIZE', 500 ) ),
+    lifetime = datetime.timedelta( hours = float( os.getenv( 'SUBSCRIPTION_LIFETIME_HOURS', 24 ) ) ),
+    renewAhead = datetime.timedelta( minutes = float( os.getenv( 'SUBSCRIPTION_RENEW_AHEAD_MINUTES', 60 ) ) ),
+    verbose = DEBUG == 'True' )
+
+# Let the manager see subscription lifecycle events as they arrive
+pipeline.sinks.append( subscriptionManager )
+
+# Mirror the mailboxes' message metadata, updated from the events
+mailboxMirror = MailboxMirror( os.getenv( 'MAILBOX_MIRROR' ) ) if os.getenv( 'MAILBOX_MIRROR' ) else None
+if mailboxMirror:
+    pipeline.sinks.append( mailboxMirror )
+
+# Start the workers only once all the sinks are registered
+pipeline.start()
+
+subscribed = subscriptionManager.start()
+print( f'\nSubscribed { subscribed } of { len( subscriptionManager.shards ) } shards for { len( resourceIds ) } resources\n' )
+
+# Seed the mirror after subscribing, so no events are missed in between.
+# This runs in the background, while incoming notifications are accepted
+def seedMirror():
+    baseUrl = f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest'
+    try:
+        mailboxes = resolveMailboxes( session, baseUrl, resourceIds )
+    except Exception as err:
+        print( f'Mailbox mirror error: { err }' )
+        return
+    seeded = mailboxMirror.seedAll( session, baseUrl, mailboxes )
+    print( f'Mailbox mirror: seeded { seeded } of { len( mailboxes ) } mailboxes, { mailboxMirror.stats()[ "messages" ] } messages' )
+
+if mailboxMirror:
+    threading.Thread( target = seedMirror, name = 'mailbox-mirror-seed', daemon = True ).start()
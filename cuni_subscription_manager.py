@@ -0,0 +1,295 @@
+'''
+Cisco Unity Connection CUNI subscription manager
+
+A single CUNI subscription covering tens of thousands of mailboxes is
+impractical, and subscriptions expire.  SubscriptionManager splits a list of
+resource ids (user aliases/ids) into shards of `shardSize`, sends the
+subscribe requests for all shards concurrently, and keeps them alive:
+
+* each shard is renewed `renewAhead` before it expires (falling back to a
+  fresh subscribe if the renewal fails)
+* SUB_END / SUB_EXP events resubscribe the affected shard.  FAILOVER events
+  (one per subscription) resubscribe the affected shard too, unsubscribing
+  its old subscription, so notifications aren't delivered twice; a FAILOVER
+  without a known subscriptionId resubscribes every shard, once
+
+The manager can be added to an EventPipeline as a sink, so it sees these
+events as they arrive:
+
+    manager = SubscriptionManager( serviceUrl, session, callbackUrl, aliases )
+    pipeline.sinks.append( manager )
+    pipeline.start()
+    manager.start()
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+from lxml import etree
+import datetime
+import threading
+
+ENVELOPE = '''<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:even="http://unity.cisco.com/messageeventservice/event" xmlns:even1="http://event.messageeventservice.unity.cisco.com">
+<soapenv:Header/>
+    <soapenv:Body>
+{body}
+    </soapenv:Body>
+</soapenv:Envelope>'''
+
+# resourceType: ignored, leave empty
+# eventTypeList: can be ALL_EVENTS or one or more of:
+#       MESSAGE_INFO, NEW_MESSAGE, OPENED_MESSAGE, SAVED_MESSAGE, UNREAD_MESSAGE,
+#       DELETED_MESSAGE, FAILOVER, NO_EVENTS, SUB_END, SUB_EXP, KEEP_ALIVE
+# resourceIdList: one or more VM user ids/aliases
+# callbackServiceUrl: Complete URL where notifcations should be sent
+# expiration: xsd:dateTime/ISO 8601 format time when the subscription expires
+# keepAliveInterval: 0 or 1 to disable or enable keepalive messages
+def buildSubscribeEnvelope( resourceIds, callbackUrl, expiration, eventTypes = ( 'ALL_EVENTS', ), keepAlive = True ):
+    eventTypeList = ''.join( f'''
+                <even:string>{ escape( eventType ) }</even:string>''' for eventType in eventTypes )
+    resourceIdList = ''.join( f'''
+                <even:string>{ escape( resourceId ) }</even:string>''' for resourceId in resourceIds )
+    return ENVELOPE.format( body = f'''        <even:subscribe>
+            <even:resourceType/>
+            <even:eventTypeList>{ eventTypeList }
+            </even:eventTypeList>
+            <even:resourceIdList>{ resourceIdList }
+            </even:resourceIdList>
+            <even:callbackServiceInfo>
+                <even1:callbackServiceUrl>{ escape( callbackUrl ) }</even1:callbackServiceUrl>
+            </even:callbackServiceInfo>
+            <even:expiration>{ expiration.isoformat( timespec = 'seconds' ) }</even:expiration>
+            <even:keepAliveInterval>{ 1 if keepAlive else 0 }</even:keepAliveInterval>
+        </even:subscribe>''' )
+
+def buildRenewEnvelope( subscriptionId, expiration ):
+    return ENVELOPE.format( body = f'''        <even:renewSubscription>
+            <even:subscriptionId>{ escape( subscriptionId ) }</even:subscriptionId>
+            <even:expiration>{ expiration.isoformat( timespec = 'seconds' ) }</even:expiration>
+        </even:renewSubscription>''' )
+
+def buildUnsubscribeEnvelope( subscriptionId ):
+    return ENVELOPE.format( body = f'''        <even:unsubscribe>
+            <even:subscriptionId>{ escape( subscriptionId ) }</even:subscriptionId>
+        </even:unsubscribe>''' )
+
+# Raised when the MessageEventService returns a SOAP fault
+class SubscriptionError( Exception ):
+    pass
+
+# Return the text of the first result element in a SOAP response, raising
+# SubscriptionError for faults
+def parseSoapResponse( content ):
+    root = etree.fromstring( content )
+    fault = next( root.iter( '{*}Fault' ), None )
+    if fault is not None:
+        faultString = next( fault.iter( 'faultstring', '{*}faultstring' ), None )
+        raise SubscriptionError( faultString.text if faultString is not None else 'SOAP fault' )
+    for tag in ( '{*}subscriptionId', '{*}out', '{*}return' ):
+        element = next( root.iter( tag ), None )
+        if element is not None and element.text:
+            return element.text.strip()
+    return None
+
+class Shard:
+
+    def __init__( self, index, resourceIds ):
+        self.index = index
+        self.resourceIds = resourceIds
+        self.subscriptionId = None
+        self.expiration = None
+        # Time of the next renew/retry, None while unscheduled
+        self.due = None
+
+class SubscriptionManager:
+
+    def __init__( self, serviceUrl, session, callbackUrl, resourceIds, shardSize = 500,
+            lifetime = datetime.timedelta( days = 1 ), renewAhead = datetime.timedelta( hours = 1 ),
+            retryInterval = datetime.timedelta( minutes = 1 ), workers = 8,
+            eventTypes = ( 'ALL_EVENTS', ), verbose = False ):
+        self.serviceUrl = serviceUrl
+        self.session = session
+        self.callbackUrl = callbackUrl
+        self.lifetime = lifetime
+        self.renewAhead = renewAhead
+        self.retryInterval = retryInterval
+        self.eventTypes = eventTypes
+        self.verbose = verbose
+        resourceIds = list( resourceIds )
+        self.shards = [ Shard( index, resourceIds[ start : start + shardSize ] )
+            for index, start in enumerate( range( 0, len( resourceIds ), shardSize ) ) ]
+        self.executor = ThreadPoolExecutor( max_workers = workers )
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition( self.lock )
+        self.running = False
+        self.scheduler = None
+
+    def now( self ):
+        return datetime.datetime.now( tz = datetime.timezone.utc )
+
+    def post( self, envelope ):
+        if self.verbose:
+            print( '\nRequest============' )
+            print( envelope )
+        resp = self.session.post(
+            self.serviceUrl,
+            headers = { 'Content-Type': 'text/xml', 'SOAPAction': '""' },
+            data = envelope )
+        if self.verbose:
+            print( '\nRESPONSE==========' )
+            print( etree.tostring( etree.fromstring( resp.content ), pretty_print = True, encoding = 'unicode' ) )
+        # SOAP faults come back as HTTP 500, parse them for the fault string
+        if resp.status_code >= 400 and b'Fault' not in resp.content:
+            resp.raise_for_status()
+        return parseSoapResponse( resp.content )
+
+    # Schedule the shard's next renewal (or retry), and wake up the scheduler
+    def schedule( self, shard, due ):
+        with self.lock:
+            shard.due = due
+            self.wakeup.notify()
+
+    def subscribe( self, shard ):
+        expiration = self.now() + self.lifetime
+        try:
+            subscriptionId = self.post( buildSubscribeEnvelope( shard.resourceIds, self.callbackUrl, expiration, self.eventTypes ) )
+        # Whatever went wrong, retry later rather than leave the shard unscheduled
+        except Exception as err:
+            print( f'Subscribe error: shard { shard.index } ({ len( shard.resourceIds ) } resources): { err }' )
+            self.schedule( shard, self.now() + self.retryInterval )
+            return False
+        with self.lock:
+            shard.subscriptionId = subscriptionId
+            shard.expiration = expiration
+        print( f'Subscribed: shard { shard.index } ({ len( shard.resourceIds ) } resources) subscriptionId: { subscriptionId } expires: { expiration.isoformat( timespec = "seconds" ) }' )
+        self.schedule( shard, expiration - self.renewAhead )
+        return True
+
+    def renew( self, shard ):
+        if not shard.subscriptionId:
+            return self.subscribe( shard )
+        expiration = self.now() + self.lifetime
+        try:
+            self.post( buildRenewEnvelope( shard.subscriptionId, expiration ) )
+        # Whatever went wrong, resubscribe (which reschedules the shard on
+        # failure) rather than let the subscription lapse unscheduled
+        except Exception as err:
+            print( f'Renew error: shard { shard.index } subscriptionId: { shard.subscriptionId }: { err }, resubscribing' )
+            return self.subscribe( shard )
+        with self.lock:
+            shard.expiration = expiration
+        print( f'Renewed: shard { shard.index } subscriptionId: { shard.subscriptionId } expires: { expiration.isoformat( timespec = "seconds" ) }' )
+        self.schedule( shard, expiration - self.renewAhead )
+        return True
+
+    # Subscribe all shards concurrently and start the renewal scheduler.
+    # Returns the number of shards successfully subscribed.
+    def start( self ):
+        self.running = True
+        results = list( self.executor.map( self.subscribe, self.shards ) )
+        self.scheduler = threading.Thread( target = self.run, name = 'cuni-subscription-scheduler', daemon = True )
+        self.scheduler.start()
+        return sum( results )
+
+    def stop( self, unsubscribe = True ):
+        with self.lock:
+            self.running = False
+            self.wakeup.notify()
+        if self.scheduler:
+            self.scheduler.join()
+        if unsubscribe:
+            def unsubscribeShard( shard ):
+                if not shard.subscriptionId:
+                    return
+                try:
+                    self.post( buildUnsubscribeEnvelope( shard.subscriptionId ) )
+                except Exception as err:
+                    print( f'Unsubscribe error: shard { shard.index }: { err }' )
+            list( self.executor.map( unsubscribeShard, self.shards ) )
+        self.executor.shutdown()
+
+    # Scheduler loop: hand due shards to the worker pool for renewal
+    def run( self ):
+        with self.lock:
+            while self.running:
+                now = self.now()
+                due = [ shard for shard in self.shards if shard.due and shard.due <= now ]
+                for shard in due:
+                    shard.due = None
+                    self.executor.submit( self.renew, shard )
+                pending = [ shard.due for shard in self.shards if shard.due ]
+                timeout = ( min( pending ) - now ).total_seconds() if pending else None
+                self.wakeup.wait( timeout = max( timeout, 0 ) if timeout is not None else None )
+
+    # Replace the shard's subscription, optionally unsubscribing the old one
+    # first.  Returns False if the shard is already being resubscribed
+    def resubscribe( self, shard, unsubscribe = False ):
+        with self.lock:
+            oldSubscriptionId = shard.subscriptionId
+            # No subscription and no retry scheduled: a subscribe is in progress
+            if not oldSubscriptionId and not shard.due:
+                return False
+            shard.subscriptionId = None
+            shard.due = None
+        def replace():
+            if unsubscribe and oldSubscriptionId:
+                try:
+                    self.post( buildUnsubscribeEnvelope( oldSubscriptionId ) )
+                except Exception as err:
+                    print( f'Unsubscribe error: shard { shard.index } subscriptionId: { oldSubscriptionId }: { err }' )
+            self.subscribe( shard )
+        self.executor.submit( replace )
+        return True
+
+    def shardFor( self, subscriptionId ):
+        with self.lock:
+            for shard in self.shards:
+                if subscriptionId and shard.subscriptionId == subscriptionId:
+                    return shard
+        return None
+
+    # EventPipeline sink interface - react to subscription lifecycle events
+    def write( self, events ):
+        failoverAll = False
+        for event in events:
+            eventType = event.get( 'eventType' )
+            if eventType not in ( 'FAILOVER', 'SUB_END', 'SUB_EXP' ):
+                continue
+            subscriptionId = event.get( 'subscriptionId' )
+            shard = self.shardFor( subscriptionId )
+            if shard:
+                # The subscription still exists after a FAILOVER: drop it
+                if self.resubscribe( shard, unsubscribe = eventType == 'FAILOVER' ):
+                    print( f'{ eventType } event received, resubscribing shard { shard.index }' )
+            elif eventType == 'FAILOVER' and not subscriptionId:
+                failoverAll = True
+        if failoverAll:
+            print( 'FAILOVER event received, resubscribing all shards' )
+            for shard in self.shards:
+                self.resubscribe( shard, unsubscribe = True )
+
+    def status( self ):
+        with self.lock:
+            return [ {
+                'shard': shard.index,
+                'resources': len( shard.resourceIds ),
+                'subscriptionId': shard.subscriptionId,
+                'expiration': shard.expiration.isoformat( timespec = 'seconds' ) if shard.expiration else None,
+                'nextRenewal': shard.due.isoformat( timespec = 'seconds' ) if shard.due else None }
+                for shard in self.shards ]
@@ -0,0 +1,264 @@
+'''
+Cisco Unity Connection CUNI event webhook forwarder
+
+Forwards the events received by the notification logger to any number of
+downstream HTTP consumers (ticketing, presence, ...), as JSON batches:
+
+    POST <url>
+    { "events": [ { "eventType": "NEW_MESSAGE", "mailboxId": ..., ... }, ... ] }
+
+The forwarder is an EventPipeline sink.  write() only adds the events to a
+bounded buffer per consumer and returns - each consumer has its own sender
+thread and keep-alive Session, so a slow or unreachable consumer never holds
+up the pipeline workers (and so CUC's callbacks), nor the other consumers:
+
+* Batches are sent once `batchSize` events are waiting, or `flushInterval`
+  seconds after the first one arrived
+* While events wait, repeats of a `coalesceTypes` event for the same mailbox
+  (and message) replace the earlier one, e.g. a burst of MESSAGE_INFO
+  updates is sent as only the latest, with a `coalesced` count of the events
+  it stands for.  The slower a consumer, the more its events are coalesced
+* If a consumer's buffer is full, its oldest waiting events are dropped (and
+  counted); connection errors, 429 and 5xx responses are retried with backoff
+
+    forwarder = WebhookForwarder( [ 'https://tickets.example.com/cuc-events' ] )
+    forwarder.start()
+    pipeline.sinks.append( forwarder )
+    forwarder.stats()
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from collections import OrderedDict, deque
+import itertools
+import json
+import os
+import threading
+import time
+import requests
+from requests.exceptions import RequestException
+from cuni_event_pipeline import eventMailbox, eventMsgId
+
+# Event types whose repeats are coalesced by default
+COALESCE_TYPES = ( 'MESSAGE_INFO', 'UNREAD_MESSAGE' )
+
+# One downstream consumer: its buffer of waiting events, sender thread and counters
+class WebhookConsumer:
+
+    def __init__( self, url, batchSize = 100, flushInterval = 1.0, bufferSize = 10000,
+            coalesceTypes = COALESCE_TYPES, retries = 3, timeout = 10, verify = True ):
+        self.url = url
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.bufferSize = bufferSize
+        self.coalesceTypes = frozenset( coalesceTypes )
+        self.retries = retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.lock = threading.Lock()
+        self.ready = threading.Condition( self.lock )
+        # key -> ( event, number of events it stands for ), oldest first.
+        # Coalescable events are keyed by type/mailbox/message, others by a
+        # sequence number
+        self.pending = OrderedDict()
+        self.sequence = itertools.count()
+        self.firstPending = None
+        self.running = False
+        self.thread = None
+        self.queued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.sent = 0
+        self.batches = 0
+        self.retried = 0
+        self.failedBatches = 0
+        self.failedEvents = 0
+        self.lastError = None
+        self.sendTimes = deque( maxlen = 1024 )
+
+    # Called from the pipeline workers: never blocks on the consumer
+    def add( self, events ):
+        with self.lock:
+            wasEmpty = not self.pending
+            for event in events:
+                eventType = event.get( 'eventType' )
+                if eventType in self.coalesceTypes:
+                    key = ( eventType, eventMailbox( event ), eventMsgId( event ) )
+                    entry = self.pending.pop( key, None )
+                    if entry:
+                        # Keep the latest event, at the back of the queue
+                        self.pending[ key ] = ( event, entry[ 1 ] + 1 )
+                        self.coalesced += 1
+                        continue
+                else:
+                    key = next( self.sequence )
+                if len( self.pending ) >= self.bufferSize:
+                    _, ( _, count ) = self.pending.popitem( last = False )
+                    self.dropped += count
+                if not self.pending:
+                    self.firstPending = time.monotonic()
+                self.pending[ key ] = ( event, 1 )
+                self.queued += 1
+            # Wake the sender to start the flush interval, or send a full batch
+            if ( wasEmpty and self.pending ) or len( self.pending ) >= self.batchSize:
+                self.ready.notify()
+
+    # Wait for a full batch or the flush interval, and take it from the buffer
+    def takeBatch( self ):
+        with self.lock:
+            while self.running:
+                if len( self.pending ) >= self.batchSize:
+                    break
+                if self.pending:
+                    remaining = self.firstPending + self.flushInterval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.ready.wait( remaining )
+                else:
+                    self.ready.wait()
+            batch = []
+            while self.pending and len( batch ) < self.batchSize:
+                _, ( event, count ) = self.pending.popitem( last = False )
+                batch.append( dict( event, coalesced = count ) if count > 1 else event )
+            self.firstPending = time.monotonic() if self.pending else None
+            return batch
+
+    # POST one batch, retrying connection errors, 429 and 5xx with backoff
+    def send( self, batch ):
+        body = json.dumps( { 'events': batch } ).encode( 'utf-8' )
+        for attempt in range( self.retries + 1 ):
+            if attempt:
+                # When stopping, make one attempt per batch rather than back off
+                if not self.running:
+                    break
+                with self.lock:
+                    self.retried += 1
+                time.sleep( min( 0.5 * 2 ** ( attempt - 1 ), 30 ) )
+            startTime = time.perf_counter()
+            try:
+                resp = self.session.post( self.url, data = body, timeout = self.timeout,
+                    headers = { 'Content-Type': 'application/json' } )
+            except RequestException as err:
+                error = f'{ type( err ).__name__ }: { err }'
+                continue
+            if resp.status_code < 400:
+                with self.lock:
+                    self.sendTimes.append( time.perf_counter() - startTime )
+                    self.sent += len( batch )
+                    self.batches += 1
+                return True
+            error = f'Status Code: { resp.status_code }'
+            if resp.status_code != 429 and resp.status_code < 500:
+                break
+        print( f'Webhook error: { self.url } { error }, { len( batch ) } events lost' )
+        with self.lock:
+            self.failedBatches += 1
+            self.failedEvents += sum( event.get( 'coalesced', 1 ) for event in batch )
+            self.lastError = error
+        return False
+
+    def run( self ):
+        while True:
+            batch = self.takeBatch()
+            if batch:
+                self.send( batch )
+            elif not self.running:
+                break
+
+    def start( self ):
+        self.running = True
+        self.thread = threading.Thread( target = self.run, name = f'cuni-webhook-{ self.url }', daemon = True )
+        self.thread.start()
+
+    # Stop the sender once the waiting events have been sent
+    def stop( self ):
+        with self.lock:
+            self.running = False
+            self.ready.notify()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.session.close()
+
+    def stats( self ):
+        with self.lock:
+            sendTimes = sorted( self.sendTimes )
+            return {
+                'url': self.url,
+                'pending': len( self.pending ),
+                'bufferSize': self.bufferSize,
+                'queued': self.queued,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'sent': self.sent,
+                'batches': self.batches,
+                'retried': self.retried,
+                'failedBatches': self.failedBatches,
+                'failedEvents': self.failedEvents,
+                'lastError': self.lastError,
+                'sendLatencyMs': {
+                    'avg': 1000 * sum( sendTimes ) / len( sendTimes ) if sendTimes else 0,
+                    'p99': 1000 * sendTimes[ int( len( sendTimes ) * 0.99 ) ] if sendTimes else 0,
+                    'max': 1000 * sendTimes[ -1 ] if sendTimes else 0 } }
+
+# EventPipeline sink fanning events out to several WebhookConsumers.
+# eventTypes: only forward these event types (default: all)
+class WebhookForwarder:
+
+    def __init__( self, urls, eventTypes = None, **consumerSettings ):
+        self.eventTypes = frozenset( eventTypes ) if eventTypes else None
+        self.consumers = [ WebhookConsumer( url, **consumerSettings ) for url in urls ]
+
+    def write( self, events ):
+        if self.eventTypes:
+            events = [ event for event in events if event.get( 'eventType' ) in self.eventTypes ]
+        if events:
+            for consumer in self.consumers:
+                consumer.add( events )
+
+    def start( self ):
+        for consumer in self.consumers:
+            consumer.start()
+
+    def close( self ):
+        for consumer in self.consumers:
+            consumer.stop()
+
+    def stats( self ):
+        return [ consumer.stats() for consumer in self.consumers ]
+
+def envList( name, default = '' ):
+    return [ value.strip() for value in os.getenv( name, default ).split( ',' ) if value.strip() ]
+
+# Create a forwarder for the consumers listed in WEBHOOK_URLS in .env (see the
+# other WEBHOOK_* settings), or None if there are none
+def forwarderFromEnv():
+    urls = envList( 'WEBHOOK_URLS' )
+    if not urls:
+        return None
+    return WebhookForwarder(
+        urls,
+        eventTypes = envList( 'WEBHOOK_EVENT_TYPES' ),
+        batchSize = int( os.getenv( 'WEBHOOK_BATCH_SIZE', 100 ) ),
+        flushInterval = float( os.getenv( 'WEBHOOK_FLUSH_INTERVAL', 1.0 ) ),
+        bufferSize = int( os.getenv( 'WEBHOOK_BUFFER_SIZE', 10000 ) ),
+        coalesceTypes = envList( 'WEBHOOK_COALESCE_TYPES', ','.join( COALESCE_TYPES ) ),
+        retries = int( os.getenv( 'WEBHOOK_RETRIES', 3 ) ),
+        timeout = float( os.getenv( 'WEBHOOK_TIMEOUT', 10 ) ),
+        verify = os.getenv( 'WEBHOOK_CERT' ) or True )
@@ -26,172 +26,172 @@ from ssl import SSLError
 from time import sleep
 import requests
 from requests import Request, Session
-from requests.auth import HTTPBasicAuth
 from requests.exceptions import HTTPError
-from requests_toolbelt.utils import dump
 import urllib3
 import os
 import sys
 import json
-
-print()
-
-# Edit .env file to specify your CUC hostname and user credentials
+from cuc_resolver_cache import cacheFromEnv
+from cuc_session_pool import poolFromEnv
+from cuc_metrics import metricsFromEnv
+from cuc_response import items, objectIdFromLocation
 from dotenv import load_dotenv
-load_dotenv( override = True )
-
-# Enable detailed HTTP/XML logging in .env
-DEBUG = os.getenv( 'DEBUG' ) == 'True'
-
-def logHttp( response ):
-    if not DEBUG == True: return
-    print( '--------------- Request/Response ---------------' )
-    print(
-        dump.dump_all(
-            response = response,
-            request_prefix = None,
-            response_prefix = None
-        ).decode( 'utf-8', errors='ignore' ), '\n' )
-
-# Create a requests.Session to enable default parameters,
-# cookies and persistent HTTP connections
-session = requests.Session()
-
-# Download the CUCM 'tomcat' PEM format certificate via 
-# CUCM OS Administration -> Security -> Certificate Management and 
-# place it in the root directory of this project.
-# Configure the certificate location .env
-
-# If the CUC tomcat cert is configured in .env
-if os.getenv( 'CUC_CERT' ):
-    session.verify = os.getenv( 'CUC_CERT' )
-# else disable certificate checking (not for production)
-else:
-    session.verify = False
-
-# CUC self-signed certs do no have a (deprecated) subjectAltName.
-# Disable the warning.
-urllib3.disable_warnings( urllib3.exceptions.SubjectAltNameWarning )
-
-# Create a Basic Auth encoded credential
-adminCredentials = HTTPBasicAuth( os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) )
-
-# Retrieve the list of available MailboxStores
-try:
-    resp = session.get( 
-        f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/mailboxstores',
-        headers = { 'Accept': 'application/json' },
-        auth = adminCredentials )
-    # Raise an exception if a non-200 HTTP response received
-    logHttp( resp )
-    resp.raise_for_status()
-except HTTPError as err:
-    statusCode = err.response.status_code
-    print( f'Request error: POST /user Status Code:{ statusCode } URL:{ err.response.url }' )
-    print( f'Error: { err.response.content.decode( "utf-8" ) }' )
-    if statusCode == 400:
-        print( '-->Hint: this error may be due to existing duplicate alias/extension.\n' )
-    sys.exit( 1 )
-
-mailboxStores = resp.json()[ 'MailboxStore' ]
-
-# If there are < 2 mailbox stores, mailboxStores will be a singleton, not a list,
-# so stuff it into a list to making parsing easier
-if not isinstance( mailboxStores, list ): mailboxStores = [ mailboxStores ]
-
-# Parse the ObjectId of the first mailbox store in the list
-mailboxStoreId = mailboxStores[ 0 ][ 'ObjectId' ]
-
-print( f'GET /mailboxstores: ObjectId: { mailboxStoreId }\n' )
-input( 'Press Enter to continue...\n' )
-
-# Create a new test user with extension 987654321
-req = {
-    "Alias": "testUser",
-    "DtmfAccessId": "987654321"
-}
-
-# Note: templateAlias must be provided in URL query parameters
-try:
-    resp = session.post( 
-        f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/users',
-        params = { 'templateAlias': 'voicemailusertemplate' },
-        headers = { 'Content-Type': 'application/json' },
-        auth = adminCredentials,
-        json = req )
-    logHttp( resp )
-    resp.raise_for_status()
-except HTTPError as err:
-    statusCode = err.response.status_code
-    print( f'Request error: POST /user Status Code:{ statusCode } URL:{ err.response.url }' )
-    print( f'Error: { err.response.content.decode( "utf-8" ) }' )
-    if statusCode == 400:
-        print( 'This error may be due to existing duplicate alias/extension.\n' )
-    sys.exit( 1 )
-
-# Parse the new user's ObjectId from the end of the Location header URL
-userObjectId = resp.headers[ 'Location' ].split( '/' )[ -1 ]
-
-print( f'POST /users: ObjectId: { userObjectId }\n' )
-
-input( 'Press Enter to continue...\n' )
-
-# The new user will have a default SMTP notification device.
-# This device has no specific configuration details and is disabled.
-# Retrieve the user's SMTP device list
-try:
-    resp = session.get( 
-        f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/users/{ userObjectId }/notificationdevices/smtpdevices',
-        headers = { 'Accept': 'application/json' },
-        auth = adminCredentials )
-    logHttp( resp )
-    resp.raise_for_status()
-except Exception as err:
-    print( f'Request error: GET /smtpdevices: { err }\n' )
-    sys.exit( 1 )
-
-# Parse the device ObjectId from the first device in the list
-deviceObjectId = resp.json()[ 'SmtpDevice' ][ 'ObjectId' ]
-
-print( f'GET smtpdevices: ObjectId: { deviceObjectId }\n' )
-
-input( 'Press Enter to continue...\n' )    
-
-# Update the device to enable it and set the To: email destination
-req = {
-    "Active": True,
-    "SmtpAddress": "user@abc.inc"
-}
-
-try:
-    resp = session.put( 
-        f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/users/{ userObjectId }/notificationdevices/smtpdevices/{ deviceObjectId }',
-        headers = { 'Content-Type': 'application/json' },
-        auth = adminCredentials,
-        json = req
-        )
-    logHttp( resp )
-    resp.raise_for_status()
-except Exception as err:
-    print( f'Request error: PUT /smtpdevices: { err }\n' )
-    sys.exit( 1 )
-
-print( f'PUT /smtpdevices: Success\n' )
-input( 'Press Enter to continue...\n' )       
-
-# Delete the user we just created
-try:
-    resp = session.delete( 
-        f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/users/{ userObjectId }',
-        auth = HTTPBasicAuth( os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) ),
-        headers = { 'Accept': 'application/json' }
-        )
-
-    # Raise an exception if a non-200 HTTP response received
-    resp.raise_for_status()
-    
-except Exception as err:
-    print( f'Request error: DELETE /users: { err }\n' )
-    sys.exit( 1 )
-
-print( f'DELETE /users: Success' )
\ No newline at end of file
+
+# Run the sample; with interactive=False it doesn't pause between steps,
+# so it can be run from scripts (see cuc_cli.py)
+def main( interactive = True ):
+    print()
+
+    # Per-endpoint latency metrics (METRICS=True in .env), and sampled
+    # request/response logging (DEBUG=True logs every request, bodies truncated)
+    metrics = metricsFromEnv()
+
+    # Download the CUCM 'tomcat' PEM format certificate via
+    # CUCM OS Administration -> Security -> Certificate Management and
+    # place it in the root directory of this project.
+    # Configure the certificate location .env
+
+    # Get a requests.Session from the shared session pool to enable default parameters,
+    # cookies and persistent HTTP connections.  If the CUC tomcat cert is configured
+    # in .env certificate checking is enabled, else it is disabled (not for production)
+    pool = poolFromEnv()
+    session = pool.session( os.getenv( 'CUC_HOSTNAME' ), os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) )
+
+    # CUC self-signed certs do no have a (deprecated) subjectAltName.
+    # Disable the warning.
+    urllib3.disable_warnings( urllib3.exceptions.SubjectAltNameWarning )
+
+    # Cache of mailbox store/alias -> ObjectId lookups (see RESOLVER_CACHE_* in .env),
+    # entries for deleted objects are dropped when a request for them returns 404
+    resolverCache = cacheFromEnv()
+    pool.addHook( resolverCache.responseHook )
+    metrics.install( pool )
+
+    # Retrieve the list of available MailboxStores
+    def lookupMailboxStore( name ):
+        resp = session.get(
+            f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/mailboxstores',
+            headers = { 'Accept': 'application/json' } )
+        # Raise an exception if a non-200 HTTP response received
+        resp.raise_for_status()
+
+        # If there are < 2 mailbox stores, MailboxStore is a singleton, not a list -
+        # items() always returns a list
+        mailboxStores = items( resp, 'MailboxStore' )
+
+        # Parse the ObjectId of the first mailbox store in the list
+        return mailboxStores[ 0 ][ 'ObjectId' ]
+
+    # The mailbox store rarely changes, so it is only looked up if not already cached
+    try:
+        mailboxStoreId = resolverCache.resolve( 'mailboxstore', 'default', lookupMailboxStore )
+    except HTTPError as err:
+        statusCode = err.response.status_code
+        print( f'Request error: GET /mailboxstores Status Code:{ statusCode } URL:{ err.response.url }' )
+        print( f'Error: { err.response.content.decode( "utf-8" ) }' )
+        sys.exit( 1 )
+
+    print( f'GET /mailboxstores: ObjectId: { mailboxStoreId }\n' )
+    if interactive:
+        input( 'Press Enter to continue...\n' )
+
+    # Create a new test user with extension 987654321
+    req = {
+        "Alias": "testUser",
+        "DtmfAccessId": "987654321"
+    }
+
+    # Note: templateAlias must be provided in URL query parameters
+    try:
+        resp = session.post(
+            f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/users',
+            params = { 'templateAlias': 'voicemailusertemplate' },
+            headers = { 'Content-Type': 'application/json' },
+            json = req )
+        resp.raise_for_status()
+    except HTTPError as err:
+        statusCode = err.response.status_code
+        print( f'Request error: POST /user Status Code:{ statusCode } URL:{ err.response.url }' )
+        print( f'Error: { err.response.content.decode( "utf-8" ) }' )
+        if statusCode == 400:
+            print( 'This error may be due to existing duplicate alias/extension.\n' )
+        sys.exit( 1 )
+
+    # Parse the new user's ObjectId from the end of the Location header URL
+    userObjectId = objectIdFromLocation( resp )
+    resolverCache.put( 'alias', req[ 'Alias' ], userObjectId )
+    resolverCache.put( 'extension', req[ 'DtmfAccessId' ], userObjectId )
+
+    print( f'POST /users: ObjectId: { userObjectId }\n' )
+
+    if interactive:
+        input( 'Press Enter to continue...\n' )
+
+    # The new user will have a default SMTP notification device.
+    # This device has no specific configuration details and is disabled.
+    # Retrieve the user's SMTP device list
+    try:
+        resp = session.get(
+            f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/users/{ userObjectId }/notificationdevices/smtpdevices',
+            headers = { 'Accept': 'application/json' } )
+        resp.raise_for_status()
+    except Exception as err:
+        print( f'Request error: GET /smtpdevices: { err }\n' )
+        sys.exit( 1 )
+
+    # Parse the device ObjectId from the first device in the list
+    deviceObjectId = items( resp, 'SmtpDevice' )[ 0 ][ 'ObjectId' ]
+
+    print( f'GET smtpdevices: ObjectId: { deviceObjectId }\n' )
+
+    if interactive:
+        input( 'Press Enter to continue...\n' )
+
+    # Update the device to enable it and set the To: email destination
+    req = {
+        "Active": True,
+        "SmtpAddress": "user@abc.inc"
+    }
+
+    try:
+        resp = session.put(
+            f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/users/{ userObjectId }/notificationdevices/smtpdevices/{ deviceObjectId }',
+            headers = { 'Content-Type': 'application/json' },
+            json = req
+            )
+        resp.raise_for_status()
+    except Exception as err:
+        print( f'Request error: PUT /smtpdevices: { err }\n' )
+        sys.exit( 1 )
+
+    print( f'PUT /smtpdevices: Success\n' )
+    if interactive:
+        input( 'Press Enter to continue...\n' )
+
+    # Delete the user we just created
+    try:
+        resp = session.delete(
+            f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/users/{ userObjectId }',
+            headers = { 'Accept': 'application/json' }
+            )
+
+        # Raise an exception if a non-200 HTTP response received
+        resp.raise_for_status()
+
+    except Exception as err:
+        print( f'Request error: DELETE /users: { err }\n' )
+        sys.exit( 1 )
+
+    # The user's ObjectId is no longer valid
+    resolverCache.invalidateValue( userObjectId )
+
+    print( f'DELETE /users: Success\n' )
+
+    print( f'Connections opened: { pool.stats()[ "handshakes" ] }' )
+
+    metrics.report()
+
+if __name__ == '__main__':
+    # Edit .env file to specify your CUC address and user credentials
+    load_dotenv( override = True )
+    main()
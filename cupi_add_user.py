@@ -21,73 +21,81 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
-import requests
-from requests.auth import HTTPBasicAuth
 import logging
 from http.client import HTTPConnection
 import os
 import sys
-
-# Edit .env file to specify your CUC address and user credentials
+from cuc_session_pool import poolFromEnv
+from cuc_response import objectIdFromLocation
 from dotenv import load_dotenv
-load_dotenv( override = True )
-
-# Enable detailed HTTP/XML logging in .env
-DEBUG = os.getenv( 'DEBUG' )
-
-if DEBUG:
-    print()
-    log = logging.getLogger( 'urllib3' )
-    log.setLevel( logging.DEBUG )
-
-    # logging from urllib3 to console
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
-    log.addHandler( ch )
-
-    # print statements from `http.client.HTTPConnection` to console/stdout
-    HTTPConnection.debuglevel = 1
-
-# Create a basic new user
-req = {
-    'Alias': 'testUser',
-    'DtmfAccessId': '987654321'
-}
-
-try:
-    resp = requests.post( 
-        f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/users?templateAlias=voicemailusertemplate',
-        auth=HTTPBasicAuth( os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) ),
-        json = req,
-        verify = False
-        )
-
-    # Raise an exception if a non-200 HTTP response received
-    resp.raise_for_status()
-    
-except Exception as err:
-    print( f'Request error: POST /users: { err }' )
-    sys.exit( 1 )
-
-userId = resp.headers['Location'].split( '/' )[ -1 ]
-
-print( f'\n POST ../users: Created user Id: { userId }\n' )
-
-input( 'Press Enter to continue...' )
-
-# Delete the user we just created
-try:
-    resp = requests.delete( 
-        f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/users/{ userId }',
-        auth = HTTPBasicAuth( os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) ),
-        verify = False
-        )
-
-    # Raise an exception if a non-200 HTTP response received
-    resp.raise_for_status()
-    
-except Exception as err:
-    print( f'Request error: DELETE ../users: { err }' )
-    sys.exit( 1 )
-
-print( f'\n DELETE ../users/{ userId }: Success\n' )
\ No newline at end of file
+
+# Run the sample; with interactive=False it doesn't pause between steps,
+# so it can be run from scripts (see cuc_cli.py)
+def main( interactive = True ):
+    # Enable detailed HTTP/XML logging in .env
+    DEBUG = os.getenv( 'DEBUG' )
+
+    if DEBUG:
+        print()
+        log = logging.getLogger( 'urllib3' )
+        log.setLevel( logging.DEBUG )
+
+        # logging from urllib3 to console
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        log.addHandler( ch )
+
+        # print statements from `http.client.HTTPConnection` to console/stdout
+        HTTPConnection.debuglevel = 1
+
+    # All requests go through a shared, keep-alive connection pool
+    pool = poolFromEnv()
+    session = pool.session( os.getenv( 'CUC_HOSTNAME' ), os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) )
+
+    # Create a basic new user
+    req = {
+        'Alias': 'testUser',
+        'DtmfAccessId': '987654321'
+    }
+
+    try:
+        resp = session.post(
+            f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/users?templateAlias=voicemailusertemplate',
+            json = req
+            )
+
+        # Raise an exception if a non-200 HTTP response received
+        resp.raise_for_status()
+
+    except Exception as err:
+        print( f'Request error: POST /users: { err }' )
+        sys.exit( 1 )
+
+    userId = objectIdFromLocation( resp )
+
+    print( f'\n POST ../users: Created user Id: { userId }\n' )
+
+    if interactive:
+        input( 'Press Enter to continue...' )
+
+    # Delete the user we just created
+    try:
+        resp = session.delete(
+            f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest/users/{ userId }'
+            )
+
+        # Raise an exception if a non-200 HTTP response received
+        resp.raise_for_status()
+
+    except Exception as err:
+        print( f'Request error: DELETE ../users: { err }' )
+        sys.exit( 1 )
+
+    print( f'\n DELETE ../users/{ userId }: Success\n' )
+
+    print( f' Connections opened: { pool.stats()[ "handshakes" ] }\n' )
+
+if __name__ == '__main__':
+    # Edit .env file to specify your CUC address and user credentials
+    load_dotenv( override = True )
+    main()
@@ -0,0 +1,368 @@
+'''
+Cisco Unity Connection bulk add user script using the CUPI API.
+
+Creates and/or deletes the users listed in a CSV or NDJSON file.  The CUPI
+requests are run through a bounded pool of worker threads sharing a pool of
+persistent (keep-alive) connections, so the TLS handshake cost is paid once
+per worker rather than once per user.
+
+Each user is provisioned in steps (create, set password, configure the SMTP
+notification device, delete).  With --journal, every completed step is
+recorded in an append-only journal file; re-running the same command after a
+crash or interruption skips the steps already done.  Each create is preceded
+by a journaled intent record, so when resuming, a create that fails because
+the user already exists is treated as done - provided the existing user's
+DtmfAccessId and names match the input.  Otherwise, as without --journal,
+an existing alias is reported as a failure; once CUC has rejected a user's
+create, later runs never take over an existing user for it.
+
+Input file format:
+
+* CSV - a header row is required; `Alias` and `DtmfAccessId` are expected,
+  any other columns are sent as additional user fields on create, except:
+  `Password` - set as the user's web application password after create;
+  `SmtpAddress` - enables the user's SMTP notification device with this address;
+  `ObjectId` - used for deletes.
+* NDJSON - one JSON user object per line (`.ndjson`/`.jsonl` extension)
+
+Each alias is processed once: later entries repeating it (ignoring case) are
+skipped and counted.
+
+Usage:
+
+    python cupi_bulk_add_user.py users.csv --mode create --workers 16
+    python cupi_bulk_add_user.py users.csv --mode delete --results results.ndjson
+    python cupi_bulk_add_user.py users.csv --mode create --journal create.journal
+
+Modes:
+
+* create - POST each user, then set its password / SMTP device if given
+* delete - DELETE each user (by ObjectId, or looked up by Alias)
+* create-delete - create then immediately delete each user (like cupi_add_user.py)
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from requests.exceptions import HTTPError, RequestException
+import urllib3
+from cuc_resolver_cache import cacheFromEnv
+from cuc_session_pool import poolFromEnv
+from cuc_metrics import metricsFromEnv
+from cuc_journal import Journal, Job
+from cuc_response import first, items, objectIdFromLocation
+
+# Edit .env file to specify your CUC address and user credentials
+from dotenv import load_dotenv
+load_dotenv( override = True )
+
+parser = argparse.ArgumentParser( description = 'Bulk create/delete CUC users via CUPI' )
+parser.add_argument( 'inputFile', help = 'CSV or NDJSON file listing the users' )
+parser.add_argument( '--mode', choices = [ 'create', 'delete', 'create-delete' ], default = 'create' )
+parser.add_argument( '--workers', type = int, default = 8,
+    help = 'Number of concurrent worker threads/connections (default: 8)' )
+parser.add_argument( '--template', default = 'voicemailusertemplate',
+    help = 'User template alias used for creates (default: voicemailusertemplate)' )
+parser.add_argument( '--results', help = 'Write per-user results to this NDJSON file' )
+parser.add_argument( '--journal',
+    help = 'Checkpoint journal file - completed steps are recorded here and skipped when the job is re-run' )
+args = parser.parse_args()
+
+# CUC self-signed certs do no have a (deprecated) subjectAltName,
+# disable the warning.
+urllib3.disable_warnings( urllib3.exceptions.SubjectAltNameWarning )
+# Certificate checking is disabled unless CUC_CERT is configured in .env
+if not os.getenv( 'CUC_CERT' ):
+    urllib3.disable_warnings( urllib3.exceptions.InsecureRequestWarning )
+
+baseUrl = f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest'
+
+# Alias -> ObjectId lookups for deletes are cached (and can be persisted
+# between runs, see RESOLVER_CACHE_* in .env)
+resolverCache = cacheFromEnv()
+
+# All workers share one pooled Session, whose keep-alive connection pool is
+# sized to the number of workers, so at most one connection per worker is opened
+pool = poolFromEnv( poolSize = args.workers )
+session = pool.session( os.getenv( 'CUC_HOSTNAME' ), os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) )
+session.headers.update( { 'Accept': 'application/json' } )
+pool.addHook( resolverCache.responseHook )
+
+# Per-endpoint latency metrics, see METRICS_* in .env
+metrics = metricsFromEnv()
+metrics.install( pool )
+
+# Lazily read user records from a CSV or NDJSON file
+def readUsers( fileName ):
+    if fileName.endswith( ( '.ndjson', '.jsonl' ) ):
+        with open( fileName, encoding = 'utf-8' ) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads( line )
+    else:
+        with open( fileName, newline = '', encoding = 'utf-8' ) as f:
+            for row in csv.DictReader( f ):
+                # Drop empty columns so they are not sent as blank fields
+                yield { key: value for key, value in row.items() if key and value }
+
+# Columns used by the provisioning steps, rather than sent as user fields
+STEP_FIELDS = ( 'ObjectId', 'Password', 'SmtpAddress' )
+
+# Request made by each step, for error messages
+STEP_OPERATIONS = {
+    'create': 'POST /users',
+    'password': 'PUT /password',
+    'smtpdevice': 'PUT /smtpdevices',
+    'delete': 'DELETE /users' }
+
+# Format a failed request the same way the single-user samples do
+def describeError( operation, err ):
+    if isinstance( err, HTTPError ):
+        statusCode = err.response.status_code
+        message = f'{ operation } Status Code: { statusCode } URL:{ err.response.url } { err.response.content.decode( "utf-8", errors = "ignore" ) }'
+        if statusCode == 400 and operation.startswith( 'POST' ):
+            message += ' (this error may be due to existing duplicate alias/extension)'
+        return message
+    if isinstance( err, ( RequestException, LookupError ) ):
+        return f'{ operation } { err }'
+    return f'{ operation } { type( err ).__name__ }: { err }'
+
+def createUser( user ):
+    req = { key: value for key, value in user.items() if key not in STEP_FIELDS }
+    resp = session.post(
+        f'{ baseUrl }/users',
+        params = { 'templateAlias': args.template },
+        json = req )
+    resp.raise_for_status()
+    # Parse the new user's ObjectId from the end of the Location header URL
+    userObjectId = objectIdFromLocation( resp )
+    resolverCache.put( 'alias', user[ 'Alias' ], userObjectId )
+    if user.get( 'DtmfAccessId' ):
+        resolverCache.put( 'extension', user[ 'DtmfAccessId' ], userObjectId )
+    return userObjectId
+
+def findUser( alias ):
+    resp = session.get(
+        f'{ baseUrl }/users',
+        params = { 'query': f'(alias is { alias })' } )
+    resp.raise_for_status()
+    return first( resp, 'User' )
+
+def lookupUser( alias ):
+    user = findUser( alias )
+    return user[ 'ObjectId' ] if user else None
+
+# Fields which must match for an existing user to be taken as our own create
+MATCH_FIELDS = ( 'DtmfAccessId', 'FirstName', 'LastName', 'DisplayName' )
+
+def isOwnCreate( user, existing ):
+    fields = [ field for field in MATCH_FIELDS if user.get( field ) ]
+    return bool( fields ) and all( str( existing.get( field ) ) == str( user[ field ] ) for field in fields )
+
+def deleteUser( userObjectId ):
+    resp = session.delete( f'{ baseUrl }/users/{ userObjectId }' )
+    resp.raise_for_status()
+    resolverCache.invalidateValue( userObjectId )
+
+# Provisioning steps: each takes the user's job context and returns the
+# results to journal
+
+def createStep( context ):
+    user = context[ 'user' ]
+    key = jobKey( user )
+    # An intent record left by an interrupted earlier run: its create may have
+    # succeeded before the step itself was journaled
+    intent = journal.get( key, 'create-intent' )
+    # A rejected intent stays rejected: it is never replaced by a fresh one,
+    # which an interrupted retry would leave looking like our own create
+    rejected = intent is not None and bool( intent.get( 'rejected' ) )
+    resuming = intent is not None and not rejected
+    if args.journal and intent is None:
+        journal.record( key, 'create-intent' )
+    try:
+        return { 'ObjectId': createUser( user ) }
+    except HTTPError as err:
+        if err.response.status_code != 400 or not resuming:
+            # CUC answered, so nothing was created: a later run must not take
+            # over an existing user with this alias
+            if args.journal and not resuming and not rejected:
+                journal.record( key, 'create-intent', { 'rejected': True } )
+            raise
+        # Only then is an existing alias taken to be our own earlier create,
+        # rather than a duplicate - and only if it is the user we asked for
+        existing = findUser( user[ 'Alias' ] )
+        if not existing or not isOwnCreate( user, existing ):
+            journal.record( key, 'create-intent', { 'rejected': True } )
+            raise
+        resolverCache.put( 'alias', user[ 'Alias' ], existing[ 'ObjectId' ] )
+        return { 'ObjectId': existing[ 'ObjectId' ], 'existing': True }
+
+# CredentialType 3 = password, 4 = pin
+def passwordStep( context ):
+    password = context[ 'user' ].get( 'Password' )
+    if not password:
+        return None
+    resp = session.put(
+        f'{ baseUrl }/users/{ context[ "ObjectId" ] }/credential/password',
+        json = {
+            'Credentials': password,
+            'CantChange': False,
+            'DoesntExpire': True,
+            'Locked': False,
+            'CredMustChange': False } )
+    resp.raise_for_status()
+
+# New users have a default, disabled SMTP notification device: enable it
+# and set its destination address
+def smtpDeviceStep( context ):
+    smtpAddress = context[ 'user' ].get( 'SmtpAddress' )
+    if not smtpAddress:
+        return None
+    devicesUrl = f'{ baseUrl }/users/{ context[ "ObjectId" ] }/notificationdevices/smtpdevices'
+    resp = session.get( devicesUrl )
+    resp.raise_for_status()
+    deviceObjectId = items( resp, 'SmtpDevice' )[ 0 ][ 'ObjectId' ]
+    resp = session.put( f'{ devicesUrl }/{ deviceObjectId }', json = { 'Active': True, 'SmtpAddress': smtpAddress } )
+    resp.raise_for_status()
+    return { 'SmtpDeviceObjectId': deviceObjectId }
+
+def deleteStep( context ):
+    user = context[ 'user' ]
+    userObjectId = context.get( 'ObjectId' ) or user.get( 'ObjectId' )
+    if not userObjectId:
+        userObjectId = resolverCache.resolve( 'alias', user[ 'Alias' ], lookupUser )
+        if not userObjectId:
+            raise LookupError( f'user not found: { user[ "Alias" ] }' )
+    try:
+        deleteUser( userObjectId )
+    except HTTPError as err:
+        # Already deleted, e.g. by an interrupted earlier run
+        if err.response.status_code != 404:
+            raise
+    return { 'ObjectId': userObjectId }
+
+steps = []
+if args.mode in ( 'create', 'create-delete' ):
+    steps += [ ( 'create', createStep ), ( 'password', passwordStep ), ( 'smtpdevice', smtpDeviceStep ) ]
+if args.mode in ( 'delete', 'create-delete' ):
+    steps.append( ( 'delete', deleteStep ) )
+
+# With --journal, completed steps are checkpointed to disk (fsync'ed) before
+# moving on, and skipped when the job is re-run
+journal = Journal( args.journal )
+job = Job( journal, steps )
+
+def jobKey( user ):
+    return str( user.get( 'Alias' ) or user.get( 'ObjectId' ) ).lower()
+
+# Run the remaining steps for a single user, returning a result record
+def processUser( user ):
+    context = { 'user': user }
+    result = { 'Alias': user.get( 'Alias' ), 'ok': True }
+    try:
+        job.run( jobKey( user ), context )
+    # Anything unexpected (e.g. a non-JSON response) fails this user too,
+    # rather than losing its result
+    except Exception as err:
+        result[ 'ok' ] = False
+        result[ 'error' ] = describeError( STEP_OPERATIONS.get( context.get( 'failedStep' ), '' ), err )
+    result[ 'ObjectId' ] = context.get( 'ObjectId' ) or user.get( 'ObjectId' )
+    return result
+
+resultsFile = open( args.results, 'a' if args.journal else 'w', encoding = 'utf-8' ) if args.results else None
+succeeded = 0
+failed = 0
+resumed = 0
+duplicates = 0
+
+def recordResult( future ):
+    global succeeded, failed
+    result = future.result()
+    if result[ 'ok' ]:
+        succeeded += 1
+        print( f'{ args.mode }: { result[ "Alias" ] }: ObjectId: { result[ "ObjectId" ] }' )
+    else:
+        failed += 1
+        print( f'Request error: { result[ "Alias" ] }: { result[ "error" ] }' )
+    if resultsFile:
+        resultsFile.write( json.dumps( result ) + '\n' )
+
+# Bound the number of queued users so huge input files are not read into memory
+inFlight = threading.BoundedSemaphore( args.workers * 2 )
+resultsLock = threading.Lock()
+
+def onDone( future ):
+    try:
+        with resultsLock:
+            recordResult( future )
+    finally:
+        inFlight.release()
+
+print()
+startTime = time.perf_counter()
+
+# Keys of the users seen so far: only the first occurrence of an alias (ignoring
+# case) is processed, so duplicates in the input file are not POSTed twice
+seenKeys = set()
+
+with ThreadPoolExecutor( max_workers = args.workers ) as executor:
+    for user in readUsers( args.inputFile ):
+        key = jobKey( user )
+        if key in seenKeys:
+            duplicates += 1
+            print( f'Skipped duplicate: { user.get( "Alias" ) or user.get( "ObjectId" ) }' )
+            continue
+        seenKeys.add( key )
+        # Users whose steps are all journaled need no requests at all
+        if args.journal and job.isComplete( key ):
+            resumed += 1
+            continue
+        inFlight.acquire()
+        executor.submit( processUser, user ).add_done_callback( onDone )
+
+elapsed = time.perf_counter() - startTime
+
+pool.close()
+journal.close()
+if resultsFile:
+    resultsFile.close()
+
+total = succeeded + failed
+print( f'\n{ args.mode }: { total } users, { succeeded } succeeded, { failed } failed' )
+if duplicates:
+    print( f'Duplicates skipped: { duplicates }' )
+if args.journal:
+    print( f'Journal: { resumed } users already complete, { job.skipped } steps skipped, { journal.stats()[ "syncs" ] } fsyncs' )
+usersPerSec = total / elapsed if elapsed else 0
+print( f'Elapsed: { elapsed :.2f}s, { usersPerSec :.1f} users/sec' )
+print( f'Connections opened: { pool.stats()[ "handshakes" ] }' )
+if pool.governor:
+    print( f'Throttled requests retried: { pool.governor.stats()[ "retried" ] }' )
+print()
+
+metrics.report()
+
+if failed:
+    sys.exit( 1 )
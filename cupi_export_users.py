@@ -0,0 +1,237 @@
+'''
+Cisco Unity Connection user directory export script using the CUPI API.
+
+Exports every user from GET /vmrest/users to an NDJSON or CSV file, for
+auditing and reconciliation.  Pages (`rowsPerPage` users each) are fetched
+concurrently, up to `--window` pages in flight, and each page is written out
+in order as soon as it arrives, so memory use depends on the window and page
+size, not on the size of the directory.
+
+* `--fields` - only these user fields (plus ObjectId) are written
+* `--detail` - also fetch each user's full record (GET /vmrest/users/{id}),
+  rather than the summary returned in the list
+* `--state` - incremental export: a digest of every exported user is kept in
+  this file, and on later runs only new or changed users are written (and
+  fetched, with --detail).  Users deleted since the last run are written to
+  NDJSON exports as { "ObjectId": ..., "Deleted": true }
+
+Usage:
+
+    python cupi_export_users.py users.ndjson --window 8
+    python cupi_export_users.py users.csv --fields Alias,DtmfAccessId,DisplayName
+    python cupi_export_users.py changes.ndjson --detail --state users.state
+
+Users created or deleted while the export runs can shift the page
+boundaries, so a user may be missed or exported twice; use --state exports
+for reconciliation, where a later run picks up the difference.
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from requests.exceptions import HTTPError, RequestException
+import urllib3
+from cuc_session_pool import poolFromEnv
+from cuc_metrics import metricsFromEnv
+from cuc_response import decode, page
+
+# Edit .env file to specify your CUC address and user credentials
+from dotenv import load_dotenv
+load_dotenv( override = True )
+
+parser = argparse.ArgumentParser( description = 'Export all CUC users via CUPI' )
+parser.add_argument( 'outputFile', help = 'NDJSON (.ndjson/.jsonl) or CSV (.csv) file to write, - for NDJSON to stdout' )
+parser.add_argument( '--window', type = int, default = 4,
+    help = 'Maximum pages (and connections) in flight (default: 4)' )
+parser.add_argument( '--rows-per-page', type = int, default = 500,
+    help = 'Users per page (default: 500)' )
+parser.add_argument( '--fields', help = 'Comma separated user fields to export (default: all)' )
+parser.add_argument( '--detail', action = 'store_true',
+    help = "Fetch each user's full record instead of the list summary" )
+parser.add_argument( '--state',
+    help = 'Incremental export state file - only users changed since the last run are exported' )
+args = parser.parse_args()
+
+# CUC self-signed certs do no have a (deprecated) subjectAltName,
+# disable the warning.
+urllib3.disable_warnings( urllib3.exceptions.SubjectAltNameWarning )
+# Certificate checking is disabled unless CUC_CERT is configured in .env
+if not os.getenv( 'CUC_CERT' ):
+    urllib3.disable_warnings( urllib3.exceptions.InsecureRequestWarning )
+
+baseUrl = f'https://{ os.getenv( "CUC_HOSTNAME" ) }/vmrest'
+
+# One keep-alive connection per page (or detail request) in flight
+pool = poolFromEnv( poolSize = args.window )
+session = pool.session( os.getenv( 'CUC_HOSTNAME' ), os.getenv( 'APP_USER' ), os.getenv( 'APP_PASSWORD' ) )
+session.headers.update( { 'Accept': 'application/json' } )
+
+# Per-endpoint latency metrics, see METRICS_* in .env
+metrics = metricsFromEnv()
+metrics.install( pool )
+
+fields = [ 'ObjectId' ] + [ field.strip() for field in args.fields.split( ',' ) if field.strip() and field.strip() != 'ObjectId' ] if args.fields else None
+
+# Listed users are only needed in full for the --state digest and --detail;
+# otherwise just the exported fields are kept, as lightweight records
+listFields = fields if not ( args.state or args.detail ) else None
+
+def fetchPage( pageNumber ):
+    resp = session.get( f'{ baseUrl }/users', params = { 'pageNumber': pageNumber, 'rowsPerPage': args.rows_per_page } )
+    resp.raise_for_status()
+    # User is always a list, even with only one user on the page
+    return page( resp, 'User', listFields )
+
+def fetchUser( objectId ):
+    resp = session.get( f'{ baseUrl }/users/{ objectId }' )
+    resp.raise_for_status()
+    return decode( resp )
+
+def project( user ):
+    if fields is None:
+        return user
+    return { field: user.get( field, '' ) for field in fields }
+
+# Short digest of a user's (summary) record, to detect changes between runs
+def digest( user ):
+    return hashlib.blake2b( json.dumps( user, sort_keys = True ).encode( 'utf-8' ), digest_size = 8 ).hexdigest()
+
+class NdjsonWriter:
+
+    def __init__( self, f ):
+        self.f = f
+
+    def write( self, record ):
+        self.f.write( json.dumps( record ) + '\n' )
+
+class CsvWriter:
+
+    def __init__( self, f ):
+        self.f = f
+        self.writer = None
+
+    def write( self, record ):
+        # Without --fields, the columns are taken from the first user
+        if self.writer is None:
+            self.writer = csv.DictWriter( self.f, fieldnames = list( record ), restval = '', extrasaction = 'ignore' )
+            self.writer.writeheader()
+        self.writer.writerow( { key: json.dumps( value ) if isinstance( value, ( dict, list ) ) else value
+            for key, value in record.items() } )
+
+# ObjectId -> digest from the previous run
+previousState = {}
+if args.state and os.path.exists( args.state ):
+    with open( args.state, encoding = 'utf-8' ) as f:
+        previousState = json.load( f )
+incremental = bool( previousState )
+state = {}
+
+if args.outputFile == '-':
+    outputFile = sys.stdout
+else:
+    outputFile = open( args.outputFile, 'w', newline = '', encoding = 'utf-8' )
+writer = CsvWriter( outputFile ) if args.outputFile.endswith( '.csv' ) else NdjsonWriter( outputFile )
+
+listed = 0
+exported = 0
+unchanged = 0
+pages = 0
+
+# Write one page of users, fetching full records for the changed ones if --detail
+def writePage( users, detailExecutor ):
+    global listed, exported, unchanged
+    listed += len( users )
+    if not args.state:
+        changed = users
+    else:
+        changed = []
+        for user in users:
+            objectId = user[ 'ObjectId' ]
+            userDigest = digest( user )
+            state[ objectId ] = userDigest
+            if previousState.get( objectId ) == userDigest:
+                unchanged += 1
+            else:
+                changed.append( user )
+    if args.detail:
+        changed = detailExecutor.map( fetchUser, [ user[ 'ObjectId' ] for user in changed ] )
+    for user in changed:
+        writer.write( project( user ) )
+        exported += 1
+
+print( f'\nExporting users from { baseUrl }, { args.window } pages in flight', file = sys.stderr )
+
+startTime = time.perf_counter()
+try:
+    with ThreadPoolExecutor( max_workers = args.window ) as pageExecutor, \
+            ThreadPoolExecutor( max_workers = args.window ) as detailExecutor:
+        # The first page gives the total, then the remaining pages are kept
+        # `window` requests ahead of the writer
+        total, users = fetchPage( 1 )
+        pageCount = max( 1, -( -total // args.rows_per_page ) )
+        nextPage = 2
+        pending = deque()
+        while True:
+            while nextPage <= pageCount and len( pending ) < args.window:
+                pending.append( pageExecutor.submit( fetchPage, nextPage ) )
+                nextPage += 1
+            writePage( users, detailExecutor )
+            pages += 1
+            if not pending:
+                break
+            _, users = pending.popleft().result()
+except ( HTTPError, RequestException ) as err:
+    if isinstance( err, HTTPError ):
+        print( f'Request error: GET /users Status Code: { err.response.status_code } URL:{ err.response.url }', file = sys.stderr )
+        print( f'Error: { err.response.content.decode( "utf-8", errors = "ignore" ) }', file = sys.stderr )
+    else:
+        print( f'Request error: GET /users { err }', file = sys.stderr )
+    sys.exit( 1 )
+
+# Users in the previous export which are no longer listed
+deleted = [ objectId for objectId in previousState if objectId not in state ] if incremental else []
+if not isinstance( writer, CsvWriter ):
+    for objectId in deleted:
+        writer.write( { 'ObjectId': objectId, 'Deleted': True } )
+
+if outputFile is not sys.stdout:
+    outputFile.close()
+elapsed = time.perf_counter() - startTime
+
+# Only save the new state after a complete export
+if args.state:
+    temporaryPath = f'{ args.state }.tmp'
+    with open( temporaryPath, 'w', encoding = 'utf-8' ) as f:
+        json.dump( state, f )
+    os.replace( temporaryPath, args.state )
+
+print( f'\nUsers: { listed } listed in { pages } pages, { exported } exported', file = sys.stderr )
+if incremental:
+    print( f'Incremental: { unchanged } unchanged, { len( deleted ) } deleted', file = sys.stderr )
+print( f'Elapsed: { elapsed :.2f}s, { listed / elapsed if elapsed else 0 :.0f} users/sec', file = sys.stderr )
+print( f'Connections opened: { pool.stats()[ "handshakes" ] }\n', file = sys.stderr )
+
+metrics.report()
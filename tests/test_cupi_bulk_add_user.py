@@ -0,0 +1,109 @@
+'''
+Tests for cupi_bulk_add_user.py, run against a minimal local HTTPS CUPI server
+
+Copyright (c) 2022 Cisco and/or its affiliates.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import threading
+import uuid
+import pytest
+
+SCRIPT = os.path.join( os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ), 'cupi_bulk_add_user.py' )
+
+# Creates users, but answers the SMTP device listing with an HTML page (as a
+# misconfigured proxy might), which fails to decode as JSON
+class CupiHandler( BaseHTTPRequestHandler ):
+
+    protocol_version = 'HTTP/1.1'
+
+    def reply( self, status, body = b'', headers = None ):
+        self.send_response( status )
+        for name, value in ( headers or {} ).items():
+            self.send_header( name, value )
+        self.send_header( 'Content-Length', str( len( body ) ) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def do_POST( self ):
+        self.rfile.read( int( self.headers.get( 'Content-Length', 0 ) ) )
+        if self.path.startswith( '/vmrest/users?' ):
+            self.reply( 201, headers = { 'Location': f'https://{ self.headers[ "Host" ] }/vmrest/users/{ uuid.uuid4() }' } )
+        else:
+            self.reply( 404 )
+
+    def do_GET( self ):
+        if self.path.endswith( '/notificationdevices/smtpdevices' ):
+            self.reply( 200, b'<html>Service Unavailable</html>', { 'Content-Type': 'text/html' } )
+        else:
+            self.reply( 404 )
+
+    def do_PUT( self ):
+        self.rfile.read( int( self.headers.get( 'Content-Length', 0 ) ) )
+        self.reply( 204 )
+
+    def log_message( self, format, *args ):
+        pass
+
+@pytest.fixture
+def cupiServer( tmp_path ):
+    if not shutil.which( 'openssl' ):
+        pytest.skip( 'openssl is needed to create the test certificate' )
+    certFile, keyFile = str( tmp_path / 'cert.pem' ), str( tmp_path / 'key.pem' )
+    subprocess.run( [ 'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+        '-subj', '/CN=localhost', '-keyout', keyFile, '-out', certFile ], check = True, capture_output = True )
+    server = ThreadingHTTPServer( ( '127.0.0.1', 0 ), CupiHandler )
+    context = ssl.SSLContext( ssl.PROTOCOL_TLS_SERVER )
+    context.load_cert_chain( certFile, keyFile )
+    server.socket = context.wrap_socket( server.socket, server_side = True )
+    threading.Thread( target = server.serve_forever, daemon = True ).start()
+    yield f'127.0.0.1:{ server.server_address[ 1 ] }'
+    server.shutdown()
+    server.server_close()
+
+def runBulkAdd( host, tmp_path, rows, *options ):
+    inputFile = tmp_path / 'users.csv'
+    inputFile.write_text( '\n'.join( rows ) + '\n', encoding = 'utf-8' )
+    resultsFile = tmp_path / 'results.ndjson'
+    env = { name: value for name, value in os.environ.items()
+        if not name.startswith( ( 'CUC_', 'RESOLVER_CACHE_', 'GOVERNOR_', 'METRICS_' ) ) and name not in ( 'REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE' ) }
+    env.update( CUC_HOSTNAME = host, APP_USER = 'admin', APP_PASSWORD = 'password' )
+    proc = subprocess.run( [ sys.executable, '-W', 'ignore', SCRIPT, str( inputFile ), '--results', str( resultsFile ), *options ],
+        cwd = tmp_path, env = env, capture_output = True, text = True, timeout = 60 )
+    results = [ json.loads( line ) for line in resultsFile.read_text( encoding = 'utf-8' ).splitlines() ] if resultsFile.exists() else []
+    return proc, { result[ 'Alias' ]: result for result in results }
+
+# A step failing with something other than a request error is reported and
+# counted as a failure, rather than the user silently missing from the results
+def test_unexpected_error_is_reported( cupiServer, tmp_path ):
+    proc, results = runBulkAdd( cupiServer, tmp_path, [
+        'Alias,DtmfAccessId,SmtpAddress',
+        'bulkUser1,81001,',
+        'bulkUser2,81002,bulkUser2@example.com' ] )
+    assert proc.returncode == 1, proc.stdout + proc.stderr
+    assert 'create: 2 users, 1 succeeded, 1 failed' in proc.stdout
+    assert 'Request error: bulkUser2: PUT /smtpdevices JSONDecodeError' in proc.stdout
+    assert results[ 'bulkUser1' ][ 'ok' ]
+    assert not results[ 'bulkUser2' ][ 'ok' ]
+    assert results[ 'bulkUser2' ][ 'error' ].startswith( 'PUT /smtpdevices JSONDecodeError' )